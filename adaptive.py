@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Adaptive max_tokens
+
+    Completion lengths reported in usage are tracked per prompt (model +
+    context/examples). Once a prompt has enough samples, a high percentile
+    of its completion length (with a margin) is reserved instead of the
+    static max_tokens, leaving more room for history. Answers that still hit
+    the reservation (finish_reason == 'length') are continued, up to the
+    static max_tokens in total.
+"""
+
+import math
+
+from .example_selection import content_hash
+from .samples import SampleWindows
+
+
+CONTINUE_PROMPT = 'Continue exactly where you stopped. Do not repeat anything.'
+RESERVE_MARGIN = 1.1
+MIN_RESERVE = 64
+
+completion_lengths = SampleWindows(window=256, min_samples=20)
+
+
+def prompt_key(model: str, prompt_struct: dict | list) -> str:
+    """ Identity of a prompt: its model and static (context/examples) part """
+    if isinstance(prompt_struct, dict):
+        static = [prompt_struct.get('context'), prompt_struct.get('examples')]
+    else:
+        static = [
+            message for message in prompt_struct
+            if (message['role'] == 'system' and not message.get('name'))
+            or message.get('name') in ('example_user', 'example_assistant')
+        ]
+    return f'{model}:{content_hash(static)}'
+
+
+def reserve_tokens(key: str, max_tokens: int, percentile: float) -> int:
+    """ Completion tokens to reserve for a prompt, max_tokens until it has enough samples """
+    observed = completion_lengths.percentile(key, percentile)
+    if observed is None:
+        return max_tokens
+    return min(max_tokens, max(MIN_RESERVE, math.ceil(observed * RESERVE_MARGIN)))
+
+
+def continuation_messages(conversation: list, content: str) -> list:
+    return conversation + [
+        {'role': 'assistant', 'content': content},
+        {'role': 'user', 'content': CONTINUE_PROMPT},
+    ]
+
+
+def merge_usage(total: dict, usage: dict) -> dict:
+    for name in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        total[name] = (total.get(name) or 0) + (usage.get(name) or 0)
+    return total
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Shared event loop and async DIAL clients """
+
+import asyncio
+import concurrent.futures
+import threading
+import uuid
+from typing import Coroutine, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import LRUCache, token_fingerprint
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+CLIENT_CLOSE_DELAY = 600  # an evicted client may still serve in-flight requests
+MAX_POLL_WAIT = 30
+
+
+def _close_client(key, client) -> None:  # pylint: disable=W0613
+    """ Close the connection pool of an evicted client once its requests are done """
+    loop = _loop
+    if loop is None or loop.is_closed():
+        return
+    #
+    async def _close():
+        try:
+            await client.close()
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Failed to close evicted DIAL client: %s', e)
+    #
+    loop.call_soon_threadsafe(loop.call_later, CLIENT_CLOSE_DELAY, lambda: loop.create_task(_close()))
+
+
+_clients = LRUCache(max_items=256, on_evict=_close_client)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """ Event loop shared by all async DIAL calls of this process """
+    global _loop, _loop_thread  # pylint: disable=W0603
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(
+                target=_loop.run_forever, name='ai_dial_event_loop', daemon=True,
+            )
+            _loop_thread.start()
+            log.info('AI Dial event loop started')
+        return _loop
+
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    """ Schedule coroutine on the shared loop """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro: Coroutine, timeout: Optional[float] = None):
+    """ Sync adapter: run coroutine on the shared loop and wait for the result """
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError('run_sync() called from the AI Dial event loop thread')
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+class AsyncResults:
+    """
+        Submitted requests by request id: callers across RPC boundaries get
+        the id and poll for the result, which is dropped once delivered
+    """
+
+    def __init__(self, max_items: int = 16384):
+        self._futures = LRUCache(max_items=max_items)
+
+    def submit(self, coro: Coroutine) -> str:
+        request_id = uuid.uuid4().hex
+        self._futures.put(request_id, submit(coro))
+        return request_id
+
+    def future(self, request_id: str) -> Optional[concurrent.futures.Future]:
+        return self._futures.get(request_id)
+
+    def poll(self, request_id: str, timeout: float = 0) -> dict:
+        """ Status of a request, waiting up to timeout (at most MAX_POLL_WAIT) seconds """
+        future = self._futures.get(request_id)
+        if future is None:
+            return {'request_id': request_id, 'status': 'unknown'}
+        concurrent.futures.wait([future], timeout=min(timeout, MAX_POLL_WAIT))
+        if not future.done():
+            return {'request_id': request_id, 'status': 'pending'}
+        self._futures.pop(request_id)
+        if future.cancelled():
+            return {'request_id': request_id, 'status': 'error', 'error': 'Cancelled'}
+        error = future.exception()
+        if error is not None:
+            return {'request_id': request_id, 'status': 'error', 'error': str(error)}
+        return {'request_id': request_id, 'status': 'done', 'result': future.result()}
+
+
+async_results = AsyncResults()
+
+
+def get_async_client(api_base: str, api_version: str, api_key: str):
+    """ AsyncAzureOpenAI client (and its connection pool) reused per endpoint/token """
+    key = (api_base, api_version, token_fingerprint(api_key))
+    client = _clients.get(key)
+    if client is None:
+        from openai import AsyncAzureOpenAI  # pylint: disable=C0415
+        client = AsyncAzureOpenAI(
+            azure_endpoint=api_base,
+            api_version=api_version,
+            api_key=api_key,
+        )
+        _clients.put(key, client)
+    return client
+
+
+def shutdown() -> None:
+    global _loop, _loop_thread  # pylint: disable=W0603
+    with _loop_lock:
+        if _loop is None:
+            return
+        _loop.call_soon_threadsafe(_loop.stop)
+        if _loop_thread is not None:
+            _loop_thread.join(timeout=5)
+        if not _loop.is_running():
+            _loop.close()
+        _loop = None
+        _loop_thread = None
+    _clients.clear()
@@ -6,10 +6,23 @@ from ...models.integration_pd import IntegrationModel
 
 
 class ProjectAPI(api_tools.APIModeHandler):
-    # def get(self, project_id, **kwargs):
-    #     models: list = self.module.get_models()
-    #     return models
-    ...
+    def get(self, project_id, **kwargs):
+        integration_id = request.args.get('integration_id', type=int)
+        if integration_id is None:
+            return [{'loc': ['integration_id'], 'msg': 'integration_id is required'}], 400
+        #
+        integration = self.module.context.rpc_manager.call.integrations_get_by_id(
+            project_id, integration_id
+        )
+        if not integration:
+            return [{'loc': ['integration_id'], 'msg': 'Integration not found'}], 404
+        #
+        models: list = self.module.context.rpc_manager.call.ai_dial_get_models({
+            'name': 'ai_dial',
+            'settings': integration.settings,
+            'project_id': project_id,
+        })
+        return models, 200
 
 class AdminAPI(api_tools.APIModeHandler):
     ...
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Bulk prompt preparation against a loop of prepare_conversation_old
+
+    Example:
+        python benchmarks/bulk.py --prompts 10000 --history 20
+        python benchmarks/bulk.py --prompts 3000 --history 200
+
+    Both sides get the same prompt structs (shared context and examples,
+    distinct history and input per prompt) and a cold static-count cache; the
+    results are compared before timings are reported. The exit code is 1 when
+    they differ or the bulk path is slower.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from runtime import import_plugin_module, use_stub_encodings  # pylint: disable=C0413
+
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa')
+
+
+def make_prompt_structs(args) -> list:
+    rnd = random.Random(args.seed)
+    context = 'You are a helpful assistant. ' * args.context_repeat
+    examples = [
+        {'input': f'Example question {n}?', 'output': f'Example answer {n}.'}
+        for n in range(args.examples)
+    ]
+
+    def _text() -> str:
+        return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, args.message_words)))
+
+    return [
+        {
+            'context': context,
+            'examples': examples,
+            'chat_history': [
+                {'role': 'user' if n % 2 == 0 else 'assistant', 'content': _text()}
+                for n in range(args.history)
+            ],
+            'prompt': f'Question number {idx}? {_text()}',
+        }
+        for idx in range(args.prompts)
+    ]
+
+
+def timed(func) -> tuple:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=10000)
+    parser.add_argument('--history', type=int, default=20)
+    parser.add_argument('--message-words', type=int, default=40)
+    parser.add_argument('--examples', type=int, default=4)
+    parser.add_argument('--context-repeat', type=int, default=20)
+    parser.add_argument('--model', default='gpt-4-0613')
+    parser.add_argument('--token-limit', type=int, default=8192)
+    parser.add_argument('--max-tokens', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encodings-dir', default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    #
+    use_stub_encodings(args.encodings_dir)
+    utils = import_plugin_module('utils')
+    bulk = import_plugin_module('bulk')
+    precount = import_plugin_module('precount')
+    prompt_structs = make_prompt_structs(args)
+    # warm the encoding so that neither side pays for loading it
+    utils.num_tokens_from_messages([{'role': 'user', 'content': 'warm'}], args.model)
+    #
+    precount.static_token_counts.clear()
+    loop_s, expected = timed(lambda: [
+        utils.prepare_conversation_old(prompt_struct, args.model, args.max_tokens, args.token_limit)
+        for prompt_struct in prompt_structs
+    ])
+    precount.static_token_counts.clear()
+    bulk_s, result = timed(lambda: bulk.prepare_conversations_bulk(
+        prompt_structs, args.model, args.max_tokens, args.token_limit
+    ))
+    #
+    report = {
+        'prompts': args.prompts,
+        'history': args.history,
+        'loop_s': round(loop_s, 3),
+        'bulk_s': round(bulk_s, 3),
+        'speedup': round(loop_s / bulk_s, 2),
+        'same_result': result == expected,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f'{key:>12}: {value}')
+    sys.exit(0 if report['same_result'] and bulk_s <= loop_s else 1)
+
+
+if __name__ == '__main__':
+    main()
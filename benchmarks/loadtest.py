@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Offline load test against a local DIAL stand-in
+
+    Example:
+        python benchmarks/loadtest.py --target predict_async --concurrency 200 --requests 5000
+
+    Token counting uses --encodings-dir (or AI_DIAL_ENCODINGS_DIR) when given,
+    byte-level stub encodings otherwise, so no network access is needed.
+    The exit code is 1 when the error rate is above --max-error-rate (0 by
+    default) or a latency/throughput limit is missed.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_dial import MockConfig, MockDialServer  # pylint: disable=C0413
+from runtime import import_plugin_module, use_stub_encodings  # pylint: disable=C0413
+
+
+TARGETS = ('predict', 'predict_async', 'chat_completion', 'descriptors')
+
+
+def make_settings(api_base: str, args) -> dict:
+    return {
+        'api_token': 'load-test-token',
+        'api_base': api_base,
+        'api_version': '2024-02-01',
+        'model_name': args.model,
+        'max_tokens': args.max_tokens,
+        'models': [{
+            'id': args.model,
+            'name': args.model,
+            'token_limit': args.token_limit,
+            'capabilities': {'completion': False, 'chat_completion': True, 'embeddings': False},
+        }],
+    }
+
+
+def make_prompt_struct(args, idx: int) -> dict:
+    return {
+        'context': 'You are a helpful assistant. ' * args.context_repeat,
+        'examples': [
+            {'input': f'Example question {n}?', 'output': f'Example answer {n}.'}
+            for n in range(args.examples)
+        ],
+        'chat_history': [
+            {'role': 'user' if n % 2 == 0 else 'assistant', 'content': f'History message {n} ' * 10}
+            for n in range(args.history)
+        ],
+        'prompt': f'Question number {idx}?',
+    }
+
+
+def make_request_data(args, idx: int) -> dict:
+    return {
+        'deployment_id': args.model,
+        'max_tokens': args.max_tokens,
+        'messages': [
+            {'role': 'system', 'content': 'You are a helpful assistant.'},
+            {'role': 'user', 'content': f'Question number {idx}?'},
+        ],
+    }
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+def _check(result) -> bool:
+    return not (isinstance(result, dict) and result.get('ok') is False)
+
+
+def run_threads(call, args) -> tuple:
+    latencies, errors = [], 0
+
+    def _one(idx):
+        start = time.perf_counter()
+        try:
+            ok = _check(call(idx))
+        except Exception:  # pylint: disable=W0703
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for latency, ok in pool.map(_one, range(args.requests)):
+            latencies.append(latency)
+            errors += int(not ok)
+    return latencies, errors
+
+
+def run_async(submit, args) -> tuple:
+    latencies, errors = [], 0
+
+    async def _main():
+        nonlocal errors
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def _one(idx):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = _check(await asyncio.wrap_future(submit(idx)))
+                except Exception:  # pylint: disable=W0703
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += int(not ok)
+
+        await asyncio.gather(*(_one(idx) for idx in range(args.requests)))
+
+    asyncio.run(_main())
+    return latencies, errors
+
+
+def build_target(name: str, api_base: str, args):
+    rpc = import_plugin_module('rpc.main').RPC
+    settings = make_settings(api_base, args)
+    #
+    if name == 'predict':
+        return 'threads', lambda idx: rpc.predict(None, 1, settings, make_prompt_struct(args, idx))
+    if name == 'predict_async':
+        results = import_plugin_module('aio').async_results
+        return 'async', lambda idx: results.future(
+            rpc.predict_async(None, 1, settings, make_prompt_struct(args, idx))['request_id']
+        )
+    if name == 'chat_completion':
+        return 'threads', lambda idx: rpc.chat_completion(None, 1, settings, make_request_data(args, idx))
+    #
+    method = import_plugin_module('methods.callbacks').Method
+    descriptor_settings = types.SimpleNamespace(
+        integration=types.SimpleNamespace(project_id=1),
+        merged_settings=settings,
+    )
+
+    def _descriptors(idx):
+        messages = make_request_data(args, idx)['messages']
+        for result in (
+                method.chat_model_invoke(None, descriptor_settings, messages),
+                method.chat_model_stream(None, descriptor_settings, messages, f'stream-{idx}'),
+                method.count_tokens(None, descriptor_settings, messages),
+        ):
+            json.dumps(result)  # what worker_client pays to enqueue it
+        return True
+
+    return 'threads', _descriptors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=TARGETS, default='predict')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--chunk-interval', type=float, default=0.02)
+    parser.add_argument('--chunks', type=int, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--attachments', type=int, default=0)
+    parser.add_argument('--model', default='gpt-35-turbo')
+    parser.add_argument('--token-limit', type=int, default=16384)
+    parser.add_argument('--max-tokens', type=int, default=256)
+    parser.add_argument('--context-repeat', type=int, default=20)
+    parser.add_argument('--examples', type=int, default=4)
+    parser.add_argument('--history', type=int, default=20)
+    parser.add_argument('--encodings-dir', help='encoding bundle, byte-level stubs when not set')
+    parser.add_argument('--tracemalloc', action='store_true', help='track Python heap peak (slower)')
+    parser.add_argument('--json', action='store_true', help='print report as JSON')
+    parser.add_argument('--max-p99', type=float, help='fail when p99 latency (s) is above')
+    parser.add_argument('--min-rps', type=float, help='fail when throughput is below')
+    parser.add_argument(
+        '--max-error-rate', type=float, default=0.0, help='fail when the share of failed requests is above',
+    )
+    args = parser.parse_args()
+    #
+    use_stub_encodings(args.encodings_dir)
+    #
+    config = MockConfig(
+        latency=args.latency, chunk_interval=args.chunk_interval, chunks=args.chunks,
+        error_rate=args.error_rate, attachments=args.attachments,
+    )
+    with MockDialServer(config) as server:
+        mode, call = build_target(args.target, server.url, args)
+        if args.tracemalloc:
+            tracemalloc.start()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        latencies, errors = run_threads(call, args) if mode == 'threads' else run_async(call, args)
+        elapsed = time.perf_counter() - start
+        report = {
+            'target': args.target,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'errors': errors,
+            'upstream_requests': server.stats.requests,
+            'upstream_throttled': server.stats.throttled,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(args.requests / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'max_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+        }
+        if args.tracemalloc:
+            report['heap_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    #
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f'{key:>20}: {value}')
+    #
+    failed = False
+    if args.max_p99 is not None and report['p99_ms'] > args.max_p99 * 1000:
+        print(f"p99 {report['p99_ms']} ms is above {args.max_p99 * 1000} ms", file=sys.stderr)
+        failed = True
+    if args.min_rps is not None and report['throughput_rps'] < args.min_rps:
+        print(f"throughput {report['throughput_rps']} rps is below {args.min_rps}", file=sys.stderr)
+        failed = True
+    if errors > args.max_error_rate * args.requests:
+        print(f"{errors} of {args.requests} requests failed", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Local DIAL / Azure OpenAI stand-in for offline load tests """
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEPLOYMENT_RE = re.compile(r'^/openai/deployments/(?P<deployment>[^/]+)/(?P<operation>chat/completions|embeddings)')
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.2  # seconds before the first byte
+    latency_jitter: float = 0.05
+    chunk_interval: float = 0.02  # seconds between stream chunks
+    chunks: int = 20  # content chunks per streamed response
+    error_rate: float = 0.0  # share of requests answered with 429
+    retry_after: int = 1
+    attachments: int = 0  # attachments added to every response
+    embedding_size: int = 1536
+    context_window: int = 16384
+    max_output: int = 4096
+    models: list = field(default_factory=lambda: ['gpt-35-turbo', 'gpt-4', 'text-embedding-ada-002'])
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+
+    def hit(self, throttled: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.throttled += int(throttled)
+
+
+def _attachments(config: MockConfig) -> list:
+    return [
+        {
+            "type": "text/markdown",
+            "title": f"Attachment {idx}",
+            "data": "Lorem ipsum dolor sit amet. " * 8,
+            "reference_url": f"https://example.invalid/doc/{idx}",
+        }
+        for idx in range(config.attachments)
+    ]
+
+
+def make_handler(config: MockConfig, stats: MockStats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            return
+
+        def _json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _sleep_latency(self):
+            delay = config.latency + random.uniform(-config.latency_jitter, config.latency_jitter)
+            if delay > 0:
+                time.sleep(delay)
+
+        def do_GET(self):  # pylint: disable=C0103
+            if self.path.split('?')[0].rstrip('/') in ('/openai/models', '/openai/deployments'):
+                stats.hit()
+                self._json(200, {"data": [
+                    {
+                        "id": name,
+                        "model": name,
+                        "object": "model",
+                        "capabilities": {
+                            "completion": False,
+                            "chat_completion": 'embedding' not in name,
+                            "embeddings": 'embedding' in name,
+                        },
+                        "limits": {
+                            "max_total_tokens": config.context_window,
+                            "max_completion_tokens": config.max_output,
+                        },
+                    }
+                    for name in config.models
+                ]})
+                return
+            self._json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):  # pylint: disable=C0103
+            match = DEPLOYMENT_RE.match(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if match is None:
+                self._json(404, {"error": {"message": "Not found"}})
+                return
+            #
+            if config.error_rate and random.random() < config.error_rate:
+                stats.hit(throttled=True)
+                self._json(
+                    429, {"error": {"message": "Rate limit exceeded", "code": "429"}},
+                    headers={"Retry-After": str(config.retry_after)},
+                )
+                return
+            stats.hit()
+            #
+            deployment = match.group('deployment')
+            if match.group('operation') == 'embeddings':
+                self._embeddings(deployment, request)
+            elif request.get('stream'):
+                self._chat_stream(deployment, request)
+            else:
+                self._chat(deployment, request)
+
+        def _usage(self, request: dict, completion_tokens: int) -> dict:
+            prompt_tokens = sum(
+                len(str(message.get('content') or '')) // 4 + 4 for message in request.get('messages', [])
+            )
+            return {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+
+        def _chat(self, deployment: str, request: dict):
+            self._sleep_latency()
+            # answer of config.chunks tokens, cut at max_tokens like a real model
+            completion_tokens = min(config.chunks, request.get("max_tokens") or config.chunks)
+            content = ' '.join(f'token{idx}' for idx in range(completion_tokens))
+            message = {"role": "assistant", "content": content}
+            if config.attachments:
+                message["custom_content"] = {"attachments": _attachments(config)}
+            self._json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{
+                    "index": 0, "message": message,
+                    "finish_reason": "length" if completion_tokens < config.chunks else "stop",
+                }],
+                "usage": self._usage(request, completion_tokens),
+            })
+
+        def _chat_stream(self, deployment: str, request: dict):
+            self._sleep_latency()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            base = {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+            }
+            #
+            def send(payload):
+                data = f"data: {payload}\n\n".encode('utf-8')
+                self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+            #
+            for idx in range(config.chunks):
+                delta = {"content": f"token{idx} "}
+                if idx == 0:
+                    delta["role"] = "assistant"
+                send(json.dumps({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+                time.sleep(config.chunk_interval)
+            for idx, attachment in enumerate(_attachments(config)):
+                delta = {"custom_content": {"attachments": [{"index": idx, **attachment}]}}
+                send(json.dumps({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+            send(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+            if (request.get('stream_options') or {}).get('include_usage'):
+                send(json.dumps({**base, "choices": [], "usage": self._usage(request, config.chunks)}))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def _embeddings(self, deployment: str, request: dict):
+            self._sleep_latency()
+            inputs = request.get('input') or []
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            data = []
+            for idx, text in enumerate(inputs):
+                rnd = random.Random(str(text))
+                data.append({
+                    "object": "embedding",
+                    "index": idx,
+                    "embedding": [rnd.uniform(-1, 1) for _ in range(config.embedding_size)],
+                })
+            self._json(200, {
+                "object": "list",
+                "model": deployment,
+                "data": data,
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+            })
+
+    return Handler
+
+
+class MockDialServer:
+    """ ThreadingHTTPServer running in a background thread """
+
+    def __init__(self, config: MockConfig = None, host: str = '127.0.0.1', port: int = 0):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.config, self.stats))
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockDialServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock_dial', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=MockConfig.latency)
+    parser.add_argument('--chunk-interval', type=float, default=MockConfig.chunk_interval)
+    parser.add_argument('--chunks', type=int, default=MockConfig.chunks)
+    parser.add_argument('--error-rate', type=float, default=MockConfig.error_rate)
+    parser.add_argument('--attachments', type=int, default=MockConfig.attachments)
+    args = parser.parse_args()
+    #
+    config = MockConfig(
+        latency=args.latency, chunk_interval=args.chunk_interval, chunks=args.chunks,
+        error_rate=args.error_rate, attachments=args.attachments,
+    )
+    server = MockDialServer(config, args.host, args.port)
+    print(f"Mock DIAL listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Load the plugin outside of pylon
+
+    When pylon / the tools package are not importable (CI, developer laptop),
+    minimal stand-ins are registered for the few runtime APIs the plugin code
+    touches. Real third-party dependencies (openai, tiktoken, pydantic) are
+    still required.
+
+    Without network access and an encoding bundle, use_stub_encodings()
+    points the tokenizer bundle at byte-level stand-in encodings: one token
+    per byte, so counts are higher than real ones but need no download.
+"""
+
+import base64
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+
+PLUGIN_ROOT = Path(__file__).resolve().parent.parent
+PLUGIN_PACKAGE = 'plugins.ai_dial'
+
+
+def _identity_decorator(*args, **kwargs):  # pylint: disable=W0613
+    def _decorator(func):
+        return func
+    return _decorator
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _install_pylon() -> None:
+    log = logging.getLogger('ai_dial')
+    web = types.SimpleNamespace(
+        rpc=_identity_decorator, method=_identity_decorator,
+        slot=_identity_decorator, event=_identity_decorator,
+    )
+
+    class ModuleModel:  # pylint: disable=R0903
+        pass
+
+    tools = _module('pylon.core.tools', log=log, web=web, module=types.SimpleNamespace(ModuleModel=ModuleModel))
+    core = _module('pylon.core', tools=tools)
+    _module('pylon', core=core)
+
+
+class SecretString(str):
+    """ Plain-text stand-in for the pylon secret field """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value):
+        return value if isinstance(value, cls) else cls(value)
+
+    def unsecret(self, project_id=None):  # pylint: disable=W0613
+        return str(self)
+
+
+def _install_tools() -> None:
+    class VaultClient:
+        _secrets = {'ai_dial_token_limits': json.dumps({})}
+
+        def get_all_secrets(self):
+            return dict(self._secrets)
+
+        def set_secrets(self, secrets):
+            type(self)._secrets = dict(secrets)
+
+    class _Noop:  # pylint: disable=R0903
+        pass
+
+    worker_client = types.SimpleNamespace(
+        unsecret_data=lambda value, project_id=None: value,
+        register_integration=lambda **kwargs: None,
+    )
+    _module(
+        'tools',
+        VaultClient=VaultClient,
+        SecretString=SecretString,
+        worker_client=worker_client,
+        rpc_tools=types.SimpleNamespace(wrap_exceptions=_identity_decorator, RpcMixin=_Noop),
+        api_tools=types.SimpleNamespace(APIBase=_Noop, APIModeHandler=_Noop),
+        this=types.SimpleNamespace(
+            module_name='ai_dial', descriptor=types.SimpleNamespace(config={}),
+        ),
+        session_project=types.SimpleNamespace(get=lambda: None),
+    )
+
+
+def install_runtime() -> bool:
+    """ Register stand-ins when needed, True if they were installed """
+    installed = False
+    try:
+        importlib.import_module('pylon.core.tools')
+    except ImportError:
+        _install_pylon()
+        installed = True
+    try:
+        importlib.import_module('tools')
+    except ImportError:
+        _install_tools()
+        installed = True
+    return installed
+
+
+def load_plugin(package: str = PLUGIN_PACKAGE) -> types.ModuleType:
+    """ Import the plugin directory as a package so relative imports work """
+    install_runtime()
+    if package in sys.modules:
+        return sys.modules[package]
+    parent = package.rpartition('.')[0]
+    if parent and parent not in sys.modules:
+        _module(parent, __path__=[])
+    spec = importlib.util.spec_from_file_location(
+        package, PLUGIN_ROOT / '__init__.py', submodule_search_locations=[str(PLUGIN_ROOT)],
+    )
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules[package] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def import_plugin_module(name: str, package: str = PLUGIN_PACKAGE) -> types.ModuleType:
+    load_plugin(package)
+    return importlib.import_module(f'{package}.{name}')
+
+
+def write_stub_encodings(path: Path) -> Path:
+    """ Byte-level <name>.tiktoken files for every encoding the bundle knows """
+    tokenizer_bundle = import_plugin_module('tokenizer_bundle')
+    path.mkdir(parents=True, exist_ok=True)
+    ranks = ''.join(f'{base64.b64encode(bytes([idx])).decode()} {idx}\n' for idx in range(256))
+    for name in tokenizer_bundle.BUNDLED_ENCODINGS:
+        (path / f'{name}.tiktoken').write_text(ranks, encoding='ascii')
+    return path
+
+
+def use_stub_encodings(bundle_dir: str = None) -> str:
+    """
+        Configure the encoding bundle: bundle_dir or AI_DIAL_ENCODINGS_DIR when
+        given, stub encodings in a temporary directory otherwise
+    """
+    bundle_dir = bundle_dir or os.environ.get('AI_DIAL_ENCODINGS_DIR')
+    if not bundle_dir:
+        bundle_dir = str(write_stub_encodings(Path(tempfile.mkdtemp(prefix='ai_dial_encodings_'))))
+    import_plugin_module('tokenizer_bundle').configure(bundle_dir)
+    return bundle_dir
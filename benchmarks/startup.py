@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Plugin startup benchmark
+
+    Every run is a fresh interpreter, so nothing is warm in sys.modules.
+    Reports the time to import the plugin (and which heavy modules that
+    pulled in), and the time of the first token count with and without
+    preloaded encodings.
+
+    Example:
+        python benchmarks/startup.py --runs 10
+
+    Encodings come from --encodings-dir (or AI_DIAL_ENCODINGS_DIR) when
+    given, byte-level stub encodings otherwise, so no network access is needed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from runtime import use_stub_encodings  # pylint: disable=C0413
+
+
+HEAVY_MODULES = ('tiktoken', 'openai', 'httpx', 'numpy', 'msgpack')
+
+PROBE = r'''
+import json, sys, time
+sys.path.insert(0, {benchmarks!r})
+start = time.perf_counter()
+from runtime import import_plugin_module
+utils = import_plugin_module('utils')
+import_plugin_module('rpc.main')
+import_plugin_module('methods.callbacks')
+result = {{
+    'import_s': time.perf_counter() - start,
+    'heavy_loaded': [name for name in {heavy!r} if name in sys.modules],
+}}
+if {preload!r}:
+    start = time.perf_counter()
+    utils.preload_encodings(['cl100k_base'])
+    result['preload_s'] = time.perf_counter() - start
+start = time.perf_counter()
+utils.num_tokens_from_messages([{{'role': 'user', 'content': 'Hello there'}}], 'gpt-4')
+result['first_count_s'] = time.perf_counter() - start
+print(json.dumps(result))
+'''
+
+
+def probe(preload: bool, bundle_dir: str) -> dict:
+    code = PROBE.format(
+        benchmarks=str(Path(__file__).resolve().parent), heavy=HEAVY_MODULES, preload=preload,
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], check=True, capture_output=True, text=True,
+        env={**os.environ, 'AI_DIAL_ENCODINGS_DIR': bundle_dir},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--encodings-dir', default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    #
+    bundle_dir = use_stub_encodings(args.encodings_dir)
+    report = {}
+    for preload in (False, True):
+        runs = [probe(preload, bundle_dir) for _ in range(args.runs)]
+        name = 'preloaded' if preload else 'cold'
+        report[name] = {
+            'import_ms': round(statistics.median(run['import_s'] for run in runs) * 1000, 2),
+            'first_count_ms': round(statistics.median(run['first_count_s'] for run in runs) * 1000, 2),
+            'heavy_loaded_at_import': runs[0]['heavy_loaded'],
+        }
+        if preload:
+            report[name]['preload_ms'] = round(statistics.median(run['preload_s'] for run in runs) * 1000, 2)
+    #
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, values in report.items():
+            print(name)
+            for key, value in values.items():
+                print(f'{key:>26}: {value}')
+
+
+if __name__ == '__main__':
+    main()
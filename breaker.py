@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Circuit breaker for settings checks and model listing
+
+    Calls are tracked per (api_base, token fingerprint, other checked
+    settings). Healthy results are reused for healthy_ttl seconds and
+    concurrent calls for the same key wait for the one in flight instead of
+    starting their own. Exceptions and unhealthy results are failures; after
+    failure_threshold consecutive ones the circuit opens: calls fail fast
+    with CircuitOpen for reset_timeout seconds (doubling on every failed
+    probe, up to max_reset_timeout), then a single probe call is let through.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import token_fingerprint
+
+
+class CircuitOpen(RuntimeError):
+    def __init__(self, api_base: str, failures: int, retry_in: float):
+        super().__init__(
+            f'{api_base} is unavailable ({failures} consecutive failures), retry in {retry_in:.0f}s'
+        )
+        self.retry_in = retry_in
+
+
+class _Circuit:
+    def __init__(self):
+        self.failures = 0
+        self.opened_until = 0.0
+        self.reset_timeout = 0.0
+        self.result = None
+        self.result_time = None
+        self.in_flight: Optional[Future] = None
+
+
+class CircuitBreaker:
+    def __init__(
+            self, name: str, failure_threshold: int = 3, reset_timeout: float = 15,
+            max_reset_timeout: float = 300, healthy_ttl: float = 30,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.healthy_ttl = healthy_ttl
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict) -> None:
+        self.failure_threshold = config.get('failure_threshold', self.failure_threshold)
+        self.base_reset_timeout = config.get('reset_timeout', self.base_reset_timeout)
+        self.max_reset_timeout = config.get('max_reset_timeout', self.max_reset_timeout)
+        self.healthy_ttl = config.get('healthy_ttl', self.healthy_ttl)
+
+    @staticmethod
+    def key(api_base: str, api_token: str, *settings) -> tuple:
+        return (api_base.rstrip('/'), token_fingerprint(api_token)) + settings
+
+    def call(
+            self, key: tuple, func: Callable, is_healthy: Callable = lambda result: True,
+    ):
+        """
+            func() through the circuit of key. Results passing is_healthy are
+            cached for healthy_ttl; others are returned as is but count as
+            failures, like exceptions.
+        """
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            now = time.monotonic()
+            if circuit.result_time is not None and now - circuit.result_time < self.healthy_ttl:
+                return circuit.result
+            tripped = circuit.failures >= self.failure_threshold
+            follow = circuit.in_flight
+            if follow is None:
+                if tripped and now < circuit.opened_until:
+                    raise CircuitOpen(key[0], circuit.failures, circuit.opened_until - now)
+                circuit.in_flight = Future()
+            elif tripped:
+                # half-open probe in flight: do not pile up behind it
+                raise CircuitOpen(key[0], circuit.failures, 0)
+        if follow is not None:
+            return follow.result()
+        #
+        future = circuit.in_flight
+        try:
+            result = func()
+        except BaseException as e:
+            self._failed(key, circuit)
+            future.set_exception(e)
+            raise
+        if is_healthy(result):
+            self._succeeded(circuit, result)
+        else:
+            self._failed(key, circuit)
+        future.set_result(result)
+        return result
+
+    def _failed(self, key: tuple, circuit: _Circuit) -> None:
+        with self._lock:
+            circuit.in_flight = None
+            circuit.failures += 1
+            circuit.result = None
+            circuit.result_time = None
+            if circuit.failures >= self.failure_threshold:
+                circuit.reset_timeout = min(
+                    self.max_reset_timeout,
+                    circuit.reset_timeout * 2 if circuit.reset_timeout else self.base_reset_timeout,
+                )
+                circuit.opened_until = time.monotonic() + circuit.reset_timeout
+                log.warning(
+                    'Circuit %s open for %s after %s failures, next probe in %.0fs',
+                    self.name, key[0], circuit.failures, circuit.reset_timeout,
+                )
+
+    def _succeeded(self, circuit: _Circuit, result) -> None:
+        with self._lock:
+            circuit.in_flight = None
+            circuit.failures = 0
+            circuit.reset_timeout = 0.0
+            circuit.result = result
+            circuit.result_time = time.monotonic()
+
+    def reset(self, key: tuple) -> None:
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None and circuit.in_flight is None:
+                del self._circuits[key]
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'api_base': key[0],
+                    'failures': circuit.failures,
+                    'open': circuit.failures >= self.failure_threshold and now < circuit.opened_until,
+                    'retry_in': round(max(0.0, circuit.opened_until - now), 3),
+                }
+                for key, circuit in self._circuits.items()
+            ]
+
+
+connection_breaker = CircuitBreaker('check_connection')
+models_breaker = CircuitBreaker('list_models', healthy_ttl=0)
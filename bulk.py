@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Bulk prompt preparation
+
+    Same result as prepare_conversation_old (ordered examples, no history
+    compaction) for every prompt struct, but:
+        - context and examples are built once per distinct pair and counted
+          through the static-count cache
+        - distinct strings are encoded once
+        - example and history cutoffs of all prompts are resolved with
+          NumPy cumulative sums instead of per-message loops
+        - history is counted only as far back as the remaining budget is
+          estimated to reach
+"""
+
+from typing import List
+
+from .example_selection import content_hash
+from .utils import (
+    build_conversation, count_static_tokens, format_history_message, message_token_params, token_count_model
+)
+
+
+# average text length from which encode_batch (threads, GIL released) beats a
+# plain loop; below it the per-string thread pool task costs more than encoding
+BATCH_MIN_CHARS = 2048
+
+
+def encode_lengths(encoding, texts: list):
+    """ Token count of every text as an int64 array """
+    import numpy as np  # pylint: disable=C0415
+    if texts and sum(len(text) for text in texts) >= BATCH_MIN_CHARS * len(texts):
+        tokens = encoding.encode_batch(texts)
+    elif _has_special_tokens(encoding, texts):
+        tokens = map(encoding.encode, texts)  # raises for them as num_tokens_from_messages does
+    else:
+        # same tokens as encode for texts without special tokens, minus its per-call checks
+        tokens = map(encoding.encode_ordinary, texts)
+    return np.fromiter((len(item) for item in tokens), dtype=np.int64, count=len(texts))
+
+
+def _has_special_tokens(encoding, texts: list) -> bool:
+    joined = '\0'.join(texts)
+    return any(token in joined for token in encoding.special_tokens_set)
+
+
+def count_messages(messages: list, model_name: str):
+    """
+        num_tokens_from_messages([message]) of every message as an int64 array,
+        -1 for messages it would reject with TypeError (non-string values)
+    """
+    import numpy as np  # pylint: disable=C0415
+    encoding, tokens_per_message, tokens_per_name = message_token_params(model_name)
+    #
+    texts = {}
+    message_idx = []
+    text_idx = []
+    invalid = []
+    named = []
+    for idx, message in enumerate(messages):
+        refs = []
+        for key, value in message.items():
+            if key == 'custom_content':
+                continue
+            if not isinstance(value, str):
+                invalid.append(idx)
+                break
+            refs.append(texts.setdefault(value, len(texts)))
+            if key == 'name':
+                named.append(idx)
+        else:
+            message_idx.extend([idx] * len(refs))
+            text_idx.extend(refs)
+    #
+    lengths = encode_lengths(encoding, list(texts))
+    counts = np.bincount(
+        np.asarray(message_idx, dtype=np.int64),
+        weights=lengths[np.asarray(text_idx, dtype=np.int64)],
+        minlength=len(messages),
+    ).astype(np.int64)
+    counts += tokens_per_message
+    counts[named] += tokens_per_name
+    counts[invalid] = -1
+    return counts
+
+
+def prepare_conversations_bulk(
+        prompt_structs: list, model_name: str, max_response_tokens: int, token_limit: int
+) -> List[list]:
+    import numpy as np  # pylint: disable=C0415
+    results = [None] * len(prompt_structs)
+    #
+    groups = {}
+    for idx, prompt_struct in enumerate(prompt_structs):
+        key = content_hash([prompt_struct.get('context'), prompt_struct.get('examples')])
+        groups.setdefault(key, []).append(idx)
+    #
+    # inputs of all prompts in one pass
+    inputs = [
+        build_conversation({'prompt': prompt_struct.get('prompt')}, False)['input']
+        for prompt_struct in prompt_structs
+    ]
+    input_messages = [message for items in inputs for message in items]
+    input_counts = count_messages(input_messages, model_name)
+    if (input_counts < 0).any():
+        raise TypeError('Prompt input must be a string')
+    input_tokens = np.zeros(len(prompt_structs), dtype=np.int64)
+    np.add.at(
+        input_tokens,
+        np.repeat(np.arange(len(prompt_structs)), [len(items) for items in inputs]),
+        input_counts,
+    )
+    #
+    history_budget = np.full(len(prompt_structs), -1, dtype=np.int64)
+    prefixes = [None] * len(prompt_structs)
+    for indexes in groups.values():
+        shared = build_conversation(prompt_structs[indexes[0]], False)
+        context = shared['context']
+        remaining_base = token_limit - max_response_tokens - 3
+        remaining_base -= count_static_tokens(context, model_name)
+        if remaining_base < 0:
+            raise Exception(
+                'There are no enough tokens to form messages for ChatCompletion. \
+                Try using a lower value for the token limit parameter.'
+            )
+        #
+        example_counts = np.asarray(
+            [_static_count(example, model_name) for example in shared['examples']], dtype=np.int64
+        )
+        examples = [
+            message for message, count in zip(shared['examples'], example_counts) if count >= 0
+        ]
+        examples_cumsum = np.cumsum(example_counts[example_counts >= 0])
+        examples_total = int(examples_cumsum[-1]) if len(examples_cumsum) else 0
+        #
+        group = np.asarray(indexes)
+        remaining = remaining_base - input_tokens[group]
+        fitting = np.searchsorted(examples_cumsum, remaining, side='right')
+        for idx, left, count in zip(indexes, remaining.tolist(), fitting.tolist()):
+            if left < 0:
+                results[idx] = list(context)
+            elif count < len(examples):
+                count -= count % 2  # remove incomplete example if present
+                results[idx] = context + examples[:count] + inputs[idx]
+            else:
+                prefixes[idx] = context + examples
+                history_budget[idx] = left - examples_total
+    #
+    # history of all remaining prompts, newest first: every round counts, per
+    # prompt, the messages its remaining budget is estimated to reach (from
+    # the tokens per character counted so far) plus one, so that prompts
+    # mostly settle in the first round without counting past their cutoff
+    tokens_per_message = message_token_params(model_name)[1]
+    calibration = [float(input_counts.sum()), _content_chars(input_messages), len(input_messages)]
+    histories = [prompt_struct.get('chat_history') or [] for prompt_struct in prompt_structs]
+    pending = [idx for idx in range(len(prompt_structs)) if results[idx] is None]
+    ends = {idx: len(histories[idx]) for idx in pending}
+    kept = {idx: [] for idx in pending}
+    while pending:
+        tokens_per_char = max(
+            (calibration[0] - calibration[2] * (tokens_per_message + 1)) / max(calibration[1], 1), 0.01
+        )
+        slices = []
+        for idx in pending:
+            end = ends[idx]
+            begin = _history_reach(
+                histories[idx], end, int(history_budget[idx]), tokens_per_message + 1, tokens_per_char
+            )
+            slices.append([format_history_message(message) for message in reversed(histories[idx][begin:end])])
+            ends[idx] = begin
+        messages = [message for items in slices for message in items]
+        counts = count_messages(messages, model_name)
+        segments = np.repeat(np.arange(len(pending)), [len(items) for items in slices])
+        valid = counts >= 0
+        counts, segments = counts[valid], segments[valid]
+        valid_messages = [message for message, ok in zip(messages, valid) if ok]
+        calibration[0] += float(counts.sum())
+        calibration[1] += _content_chars(valid_messages)
+        calibration[2] += len(valid_messages)
+        #
+        cumsum = np.cumsum(counts)
+        starts = np.searchsorted(segments, np.arange(len(pending)))
+        offsets = np.concatenate(([0], cumsum))[starts]
+        local = cumsum - offsets[segments]
+        budget = history_budget[pending]
+        fits = local <= budget[segments]
+        fitting = np.bincount(segments[fits], minlength=len(pending))
+        totals = np.bincount(segments, minlength=len(pending))
+        spent = np.bincount(segments, weights=counts, minlength=len(pending)).astype(np.int64)
+        #
+        still_pending = []
+        for segment, idx in enumerate(pending):
+            first = int(starts[segment])
+            kept[idx].extend(valid_messages[first:first + int(fitting[segment])])
+            if fitting[segment] < totals[segment] or not ends[idx]:
+                results[idx] = prefixes[idx] + kept[idx][::-1] + inputs[idx]
+            else:
+                history_budget[idx] -= spent[segment]
+                still_pending.append(idx)
+        pending = still_pending
+    return results
+
+
+def _static_count(message: dict, model_name: str) -> int:
+    """ count_static_tokens of one message, -1 when it would raise TypeError """
+    try:
+        return count_static_tokens([message], model_name)
+    except TypeError:
+        return -1
+
+
+def _content_chars(messages: list) -> int:
+    return sum(len(message['content']) for message in messages)
+
+
+def _history_reach(
+        history: list, end: int, budget: int, message_tokens: int, tokens_per_char: float
+) -> int:
+    """
+        Start of the window history[start:end] that is estimated to hold all
+        messages fitting into budget, newest first, and the first one past it
+    """
+    estimate = 0.0
+    for idx in range(end - 1, -1, -1):
+        content = history[idx].get('content')
+        estimate += message_tokens + (len(content) * tokens_per_char if isinstance(content, str) else 0)
+        if estimate > budget:
+            return idx
+    return 0
+
+
+def _message_text(message: dict) -> dict:
+    """ Message with multimodal content reduced to its text parts """
+    content = message.get('content')
+    if isinstance(content, list):
+        message = dict(message)
+        message['content'] = '\n'.join(
+            part.get('text') or '' for part in content if isinstance(part, dict) and part.get('type') == 'text'
+        )
+    return message
+
+
+BUFFER_PREFIXES = {'user': 'Human', 'assistant': 'AI', 'system': 'System'}
+
+
+def _buffer_string(message: dict) -> str:
+    """ Message as a completion model sees it (langchain get_buffer_string) """
+    role = message.get('role', '')
+    return f"{BUFFER_PREFIXES.get(role, role)}: {_message_text(message).get('content') or ''}"
+
+
+def count_tokens_batch(items: list, settings: dict) -> list:
+    """
+        Token counts of many inputs with the model of integration settings, as
+        the count_tokens descriptor counts them: a text counts as its encoding
+        length, a message list as num_tokens_from_messages plus reply priming
+        (chat models) or as the sum of its messages as text (completion models).
+        Identical inputs are counted once.
+    """
+    import numpy as np  # pylint: disable=C0415
+    model_name, legacy_completion = token_count_model(settings)
+    if legacy_completion:
+        items = [
+            item if isinstance(item, str) else [_buffer_string(message) for message in item]
+            for item in items
+        ]
+    unique = {}
+    positions = []
+    for item in items:
+        key = item if isinstance(item, str) else content_hash(item)
+        positions.append(unique.setdefault(key, (len(unique), item))[0])
+    counts = np.zeros(len(unique), dtype=np.int64)
+    #
+    texts = [(idx, item) for idx, item in unique.values() if isinstance(item, str)]
+    if texts:
+        encoding = message_token_params(model_name)[0]
+        counts[[idx for idx, _ in texts]] = encode_lengths(encoding, [item for _, item in texts])
+    #
+    conversations = [(idx, item) for idx, item in unique.values() if not isinstance(item, str)]
+    if conversations and legacy_completion:
+        lengths = encode_lengths(
+            message_token_params(model_name)[0], [text for _, item in conversations for text in item]
+        )
+        segments = np.repeat(np.arange(len(conversations)), [len(item) for _, item in conversations])
+        counts[[idx for idx, _ in conversations]] = np.bincount(
+            segments, weights=lengths, minlength=len(conversations)
+        ).astype(np.int64)
+    elif conversations:
+        messages = [_message_text(message) for _, item in conversations for message in item]
+        message_counts = count_messages(messages, model_name)
+        if (message_counts < 0).any():
+            raise TypeError('Message values must be strings')
+        segments = np.repeat(np.arange(len(conversations)), [len(item) for _, item in conversations])
+        counts[[idx for idx, _ in conversations]] = np.bincount(
+            segments, weights=message_counts, minlength=len(conversations)
+        ).astype(np.int64) + 3  # every reply is primed with <|start|>assistant<|message|>
+    return counts[positions].tolist()
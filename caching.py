@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" In-process caches """
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def token_fingerprint(api_key) -> str:
+    """ Short non-reversible identity of a credential, safe for keys and logs """
+    return hashlib.sha256(str(api_key).encode('utf-8')).hexdigest()[:16]
+
+
+class LRUCache:
+    """
+        Small thread-safe LRU mapping, optionally also bounded by total
+        sizeof(value). on_evict(key, value) is called for entries pushed out
+        by the bounds (not for pop/clear).
+    """
+
+    def __init__(self, max_items: int = 1024, max_size: Optional[int] = None,
+                 sizeof: Optional[Callable] = None, on_evict: Optional[Callable] = None):
+        self.max_items = max_items
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.size = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._items.get(key, default)
+            if key in self._items:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        evicted = []
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if self.sizeof is not None:
+                self.size += self.sizeof(value) - self._sizes.get(key, 0)
+                self._sizes[key] = self.sizeof(value)
+            while len(self._items) > self.max_items or (
+                    self.max_size is not None and self.size > self.max_size and len(self._items) > 1
+            ):
+                item = self._items.popitem(last=False)
+                self._discard(item[0])
+                evicted.append(item)
+        if self.on_evict is not None:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def _discard(self, key) -> None:
+        self.size -= self._sizes.pop(key, 0)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._discard(key)
+            return self._items.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.size = 0
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._items)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Model catalog cache """
+
+import threading
+import time
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import LRUCache, token_fingerprint
+
+
+class ModelCatalog:
+    """
+        Model lists per (api_base, token fingerprint, api_version),
+        stale-while-revalidate
+
+        Fresh entries are served as is. Entries older than ttl are served
+        immediately while one background refresh updates them. Entries older
+        than max_age (or missing) are fetched synchronously. At most
+        max_entries lists are kept, least recently used are dropped.
+    """
+
+    def __init__(self, ttl: float = 300, max_age: float = 86400, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_age = max_age
+        self._entries = LRUCache(max_items=max_entries)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(api_base: str, api_token: str, api_version: Optional[str] = None) -> tuple:
+        return api_base.rstrip('/'), token_fingerprint(api_token), api_version
+
+    def peek(self, key: tuple) -> Optional[list]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def invalidate(self, key: tuple) -> None:
+        self._entries.pop(key)
+
+    def get(self, key: tuple, fetch: Callable[[], list]) -> list:
+        entry = self._entries.get(key)
+        age = time.monotonic() - entry[1] if entry else None
+        #
+        if entry is None or age > self.max_age:
+            return self._fetch(key, fetch)
+        if age > self.ttl:
+            self._refresh_in_background(key, fetch)
+        return entry[0]
+
+    def _fetch(self, key: tuple, fetch: Callable[[], list]) -> list:
+        models = fetch()
+        self._entries.put(key, (models, time.monotonic()))
+        return models
+
+    def _refresh_in_background(self, key: tuple, fetch: Callable[[], list]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        #
+        def _refresh():
+            try:
+                self._fetch(key, fetch)
+            except Exception as e:  # pylint: disable=W0703
+                log.warning('Model list refresh failed for %s, serving stale list: %s', key[0], e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        #
+        threading.Thread(target=_refresh, name='ai_dial_models_refresh', daemon=True).start()
+
+
+model_catalog = ModelCatalog()
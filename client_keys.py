@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Client reuse hints for the worker
+
+    Every descriptor carries client_key: a hash of the helper class, its
+    non-secret kwargs, the credential fingerprint and a revocation generation.
+    The worker may keep warm clients per key (LRU of client_cache_size, idle
+    for at most client_ttl seconds). The hints go into the Helper kwargs only
+    when all workers of the routing key advertised 'client_key' on format
+    negotiation; otherwise they are a top-level 'client' entry, which the
+    Helper never receives as a keyword argument. Revoking a fingerprint bumps its
+    generation, so new descriptors get new keys, and fires
+    ai_dial_client_keys_revoked so workers drop the old clients right away.
+"""
+
+import hashlib
+import json
+import threading
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import token_fingerprint
+from .descriptors import wire_format
+
+
+SECRET_KWARGS = frozenset({'api_key', 'openai_api_key', 'azure_ad_token', 'azure_ad_token_provider'})
+
+CLIENT_TTL = 900
+CLIENT_CACHE_SIZE = 64
+
+
+class ClientKeys:
+    def __init__(self):
+        self.emit: Optional[Callable[[dict], None]] = None
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def key(self, target_class: str, target_kwargs: dict) -> tuple:
+        """ (client_key, credential fingerprint) """
+        fingerprint = token_fingerprint(
+            next((target_kwargs[name] for name in SECRET_KWARGS if target_kwargs.get(name)), '')
+        )
+        public_kwargs = {
+            name: value for name, value in target_kwargs.items() if name not in SECRET_KWARGS
+        }
+        payload = json.dumps(
+            [target_class, public_kwargs, fingerprint, self._generations.get(fingerprint, 0)],
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32], fingerprint
+
+    def revoke(self, api_key: Optional[str] = None, fingerprint: Optional[str] = None) -> str:
+        """ Invalidate all client keys derived from a credential """
+        if fingerprint is None:
+            fingerprint = token_fingerprint(api_key or '')
+        with self._lock:
+            self._generations[fingerprint] = self._generations.get(fingerprint, 0) + 1
+        log.info('Revoked worker client keys for credential %s', fingerprint)
+        if self.emit is not None:
+            try:
+                self.emit({'client_fingerprint': fingerprint})
+            except Exception as e:  # pylint: disable=W0703
+                log.warning('Failed to notify workers about revoked client keys: %s', e)
+        return fingerprint
+
+
+client_keys = ClientKeys()
+
+
+def with_client_key(descriptor: dict) -> dict:
+    """
+        Add reuse hints next to target_class/target_kwargs of a descriptor for
+        workers that support them, outside of the Helper kwargs otherwise
+    """
+    helper = descriptor["target_kwargs"]
+    client_key, fingerprint = client_keys.key(helper["target_class"], helper["target_kwargs"] or {})
+    hints = {
+        "key": client_key,
+        "fingerprint": fingerprint,
+        "ttl": CLIENT_TTL,
+        "cache_size": CLIENT_CACHE_SIZE,
+    }
+    if wire_format.supports(descriptor.get("routing_key"), 'client_key'):
+        helper["client"] = hints
+    else:
+        descriptor["client"] = hints
+    return descriptor
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Chat history compaction """
+
+import hashlib
+import json
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import LRUCache
+
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Extend the existing summary with the new messages. Keep facts, decisions, names, "
+    "numbers and open questions; drop pleasantries. Reply with the summary only."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+summary_cache = LRUCache(max_items=1024)
+
+
+def prefix_hashes(messages: list) -> list:
+    """ Chained hashes: item i identifies messages[:i + 1] """
+    result = []
+    digest = b''
+    for message in messages:
+        payload = json.dumps(
+            [message.get('role'), message.get('content')], ensure_ascii=False
+        ).encode('utf-8')
+        digest = hashlib.sha256(digest + payload).digest()
+        result.append(digest.hex())
+    return result
+
+
+def build_summary_messages(previous_summary: Optional[str], messages: list) -> list:
+    """ Make request messages for the summarizing deployment """
+    transcript = '\n'.join(
+        f"{message.get('role', 'user')}: {message.get('content') or ''}"
+        for message in messages
+    )
+    if previous_summary:
+        transcript = f"Existing summary:\n{previous_summary}\n\nNew messages:\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def summarize_history(
+        messages: list, summarize: Callable[[Optional[str], list], str],
+        cache: LRUCache = summary_cache
+) -> str:
+    """
+        Return summary of messages, reusing the longest already summarized prefix
+
+        summarize(previous_summary, new_messages) is called only for the messages
+        that are not covered by a cached summary yet. Summaries are cached per
+        summarize.model (the deployment writing them, when set) and prefix.
+    """
+    model = getattr(summarize, 'model', None)
+    hashes = prefix_hashes(messages)
+    previous_summary = None
+    covered = 0
+    for idx in range(len(hashes), 0, -1):
+        previous_summary = cache.get((model, hashes[idx - 1]))
+        if previous_summary is not None:
+            covered = idx
+            break
+    if covered == len(messages):
+        return previous_summary
+    #
+    summary = summarize(previous_summary, messages[covered:])
+    cache.put((model, hashes[-1]), summary)
+    return summary
+
+
+def make_summary_message(
+        messages: list, summarize: Callable[[Optional[str], list], str]
+) -> Optional[dict]:
+    """ System message carrying the summary of dropped history, None on failure """
+    if not messages:
+        return None
+    try:
+        summary = summarize_history(messages, summarize)
+    except Exception as e:  # pylint: disable=W0703
+        log.warning('History summarization failed, dropping history instead: %s', e)
+        return None
+    if not summary:
+        return None
+    return {
+        "role": "system",
+        "content": SUMMARY_PREFIX + summary,
+    }
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Worker descriptor wire formats
+
+    'dict'    - nested dict as built by Method (default, any worker)
+    'compact' - positional list with interned identifiers, JSON-serializable
+    'msgpack' - 'compact' packed with msgpack (when msgpack is installed)
+
+    Every worker advertises what it understands for the routing key it
+    serves; descriptors get the best format all workers of their routing key
+    negotiated, 'dict' when none did.
+"""
+
+import threading
+from typing import List, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+TABLE_VERSION = 1
+
+# Append only: indexes are part of the wire format
+INTERNED = (
+    "plugins.ai_dial_worker.utils.ai.Helper",
+    "langchain_openai.chat_models.azure.AzureChatOpenAI",
+    "langchain_openai.llms.azure.AzureOpenAI",
+    "langchain_openai.embeddings.azure.AzureOpenAIEmbeddings",
+    "client._client",
+    "check_settings",
+    "get_models",
+    "count_tokens",
+    "llm_invoke",
+    "llm_stream",
+    "chat_invoke",
+    "chat_stream",
+    "embed_documents",
+    "embed_query",
+)
+INTERNED_IDS = {value: idx for idx, value in enumerate(INTERNED)}
+
+FORMATS_PREFERENCE = ('msgpack', 'compact', 'dict')
+
+
+def _msgpack():
+    try:
+        import msgpack  # pylint: disable=C0415,E0401
+    except ImportError:
+        return None
+    return msgpack
+
+
+def supported_formats() -> List[str]:
+    return [item for item in FORMATS_PREFERENCE if item != 'msgpack' or _msgpack() is not None]
+
+
+def _intern(value):
+    return INTERNED_IDS.get(value, value)
+
+
+def _extern(value):
+    return INTERNED[value] if isinstance(value, int) else value
+
+
+def to_compact(descriptor: dict) -> list:
+    """
+        [version, target, class, class_kwargs, client_attr, method, method_kwargs,
+         routing_key, io_bound(, client)]
+    """
+    helper = descriptor["target_kwargs"]
+    compact = [
+        TABLE_VERSION,
+        _intern(descriptor["target"]),
+        _intern(helper["target_class"]),
+        helper["target_kwargs"],
+        _intern(helper["client_attr"]),
+        _intern(descriptor["method"]),
+        descriptor["method_kwargs"],
+        descriptor["routing_key"],
+        descriptor["target_io_bound"],
+    ]
+    if helper.get("client"):
+        compact.append(helper["client"])
+    return compact
+
+
+def from_compact(compact: list) -> dict:
+    version, target, target_class, class_kwargs, client_attr, method, method_kwargs, \
+        routing_key, io_bound = compact[:9]
+    if version != TABLE_VERSION:
+        raise ValueError(f"Unsupported descriptor table version: {version}")
+    descriptor = {
+        "routing_key": routing_key,
+        #
+        "target": _extern(target),
+        "target_args": None,
+        "target_kwargs": {
+            "target_class": _extern(target_class),
+            "target_args": None,
+            "target_kwargs": class_kwargs,
+            "client_attr": _extern(client_attr),
+        },
+        "target_io_bound": io_bound,
+        #
+        "method": _extern(method),
+        "method_args": None,
+        "method_kwargs": method_kwargs,
+    }
+    if len(compact) > 9:
+        descriptor["target_kwargs"]["client"] = compact[9]
+    return descriptor
+
+
+class WireFormat:
+    """
+        Negotiated descriptor formats per routing key. A routing key is served
+        by every worker that negotiated for it, so its format is the least
+        capable of theirs; routing keys nobody negotiated for get 'dict'.
+    """
+
+    def __init__(self):
+        self._workers = {}  # routing_key -> {worker: (format, features)}
+        self._lock = threading.Lock()
+
+    def negotiate(
+            self, worker_formats: list, table_version: int = TABLE_VERSION,
+            routing_key: Optional[str] = None, worker: Optional[str] = None,
+            features: Optional[list] = None,
+    ) -> str:
+        """ Format for the worker, the routing key falls back to the least capable one """
+        if table_version != TABLE_VERSION:
+            name = 'dict'
+        else:
+            ours = supported_formats()
+            name = next((item for item in ours if item in (worker_formats or [])), 'dict')
+        with self._lock:
+            self._workers.setdefault(routing_key, {})[worker] = (name, frozenset(features or ()))
+        log.info(
+            'Worker %s descriptor format: %s, routing key %s: %s',
+            worker, name, routing_key, self.name(routing_key),
+        )
+        return name
+
+    def forget(self, routing_key: Optional[str] = None, worker: Optional[str] = None) -> None:
+        """ Drop a worker that went away, its routing key may pick a better format """
+        with self._lock:
+            workers = self._workers.get(routing_key, {})
+            workers.pop(worker, None)
+            if not workers:
+                self._workers.pop(routing_key, None)
+
+    def name(self, routing_key: Optional[str] = None) -> str:
+        with self._lock:
+            formats = {name for name, _ in self._workers.get(routing_key, {}).values()}
+        return next((item for item in reversed(FORMATS_PREFERENCE) if item in formats), 'dict')
+
+    def supports(self, routing_key: Optional[str], feature: str) -> bool:
+        """ Every worker that negotiated for the routing key (at least one) advertised feature """
+        with self._lock:
+            workers = list(self._workers.get(routing_key, {}).values())
+        return bool(workers) and all(feature in features for _, features in workers)
+
+    def pack(self, descriptor: dict):
+        name = self.name(descriptor.get("routing_key"))
+        if name == 'dict' or descriptor.get("target_args") or descriptor.get("method_args") \
+                or descriptor["target_kwargs"].get("target_args"):
+            return descriptor
+        compact = to_compact(descriptor)
+        if name == 'msgpack':
+            return _msgpack().packb(compact, use_bin_type=True)
+        return compact
+
+
+wire_format = WireFormat()
+
+
+def pack_descriptor(descriptor: dict):
+    return wire_format.pack(descriptor)
+
+
+def unpack_descriptor(payload) -> dict:
+    """ Reverse of pack_descriptor, for the worker side """
+    if isinstance(payload, dict):
+        return payload
+    if isinstance(payload, (bytes, bytearray)):
+        payload = _msgpack().unpackb(payload, raw=False, strict_map_key=False)
+    return from_compact(payload)
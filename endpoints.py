@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" DIAL endpoint selection, health tracking and failover """
+
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+class EndpointState:  # pylint: disable=R0903
+    __slots__ = ('outstanding', 'failures', 'ejections', 'ejected_until')
+
+    def __init__(self):
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+
+class EndpointPool:
+    """
+        Weighted least-outstanding-requests selection over api_base URLs
+
+        Two candidates are drawn by weight and the one with fewer in-flight
+        requests per weight unit wins. Endpoints with failure_threshold
+        consecutive failures are ejected, for longer on every repeated ejection.
+
+        Only calls made by the plugin itself (call_with_failover) are counted
+        as in flight. Worker descriptor traffic is not, so it is selected by
+        weight only (by_load=False); health still applies to it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, ejection_time: float = 30, max_ejection_time: float = 300):
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, url: str) -> EndpointState:
+        state = self._states.get(url)
+        if state is None:
+            with self._lock:
+                state = self._states.setdefault(url, EndpointState())
+        return state
+
+    def is_healthy(self, url: str) -> bool:
+        return self._state(url).ejected_until <= time.monotonic()
+
+    def select(self, endpoints: list, exclude: Iterable[str] = (), by_load: bool = True) -> str:
+        """ endpoints: [(url, weight), ...] """
+        exclude = set(exclude)
+        candidates = [(url, weight) for url, weight in endpoints if url not in exclude and weight > 0]
+        if not candidates:
+            candidates = [(url, weight) for url, weight in endpoints if weight > 0] or list(endpoints)
+        if len(candidates) == 1:
+            return candidates[0][0]
+        #
+        now = time.monotonic()
+        healthy = [item for item in candidates if self._state(item[0]).ejected_until <= now]
+        if not healthy:
+            # everything is ejected: probe the one that comes back first
+            return min(candidates, key=lambda item: self._state(item[0]).ejected_until)[0]
+        if len(healthy) == 1:
+            return healthy[0][0]
+        if not by_load:
+            return random.choices(healthy, weights=[weight for _, weight in healthy])[0][0]
+        first, second = random.choices(healthy, weights=[weight for _, weight in healthy], k=2)
+        return min(
+            (first, second), key=lambda item: self._state(item[0]).outstanding / item[1]
+        )[0]
+
+    def acquire(self, url: str) -> None:
+        state = self._state(url)
+        with self._lock:
+            state.outstanding += 1
+
+    def release(self, url: str, ok: Optional[bool] = True) -> None:
+        """ ok=None releases without touching health (e.g. client errors) """
+        state = self._state(url)
+        with self._lock:
+            state.outstanding = max(0, state.outstanding - 1)
+            if ok is None:
+                return
+            if ok:
+                state.failures = 0
+                state.ejections = 0
+                return
+            state.failures += 1
+            if state.failures >= self.failure_threshold:
+                state.ejections += 1
+                duration = min(self.ejection_time * 2 ** (state.ejections - 1), self.max_ejection_time)
+                state.ejected_until = time.monotonic() + duration
+                log.warning('Ejecting DIAL endpoint %s for %.0f s after %s failures', url, duration, state.failures)
+
+
+endpoint_pool = EndpointPool()
+
+
+def endpoints_from_settings(settings: dict) -> list:
+    """ [(url, weight), ...] from api_bases, falling back to api_base """
+    endpoints = [
+        (item['url'], float(item.get('weight', 1)))
+        for item in settings.get('api_bases') or []
+        if item.get('url')
+    ]
+    return endpoints or [(settings['api_base'], 1.0)]
+
+
+def select_api_base(settings: dict) -> str:
+    """
+        api_base for a worker descriptor: weighted among healthy endpoints.
+        The worker call is not tracked as outstanding, so load is not considered.
+    """
+    return endpoint_pool.select(endpoints_from_settings(settings), by_load=False)
+
+
+def failure_kind(error: Exception) -> Optional[str]:
+    """ 'endpoint' - count against the endpoint, 'retry' - try another one, None - give up """
+    import openai  # pylint: disable=C0415
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return 'endpoint'
+    if isinstance(error, openai.RateLimitError):
+        return 'retry'
+    return None
+
+
+async def call_with_failover(
+        endpoints: list, call: Callable[[str], Awaitable], exclude: Iterable[str] = ()
+):
+    """ Await call(api_base), moving to the next endpoint on endpoint-level errors """
+    tried = list(exclude)
+    while True:
+        api_base = endpoint_pool.select(endpoints, exclude=tried)
+        tried.append(api_base)
+        endpoint_pool.acquire(api_base)
+        ok = None  # cancelled calls do not affect health
+        try:
+            result = await call(api_base)
+            ok = True
+        except Exception as e:
+            kind = failure_kind(e)
+            if kind == 'endpoint':
+                ok = False
+            if kind is not None and len({url for url, _ in endpoints} - set(tried)):
+                log.warning('DIAL endpoint %s failed (%s), failing over', api_base, type(e).__name__)
+                continue
+            raise
+        finally:
+            endpoint_pool.release(api_base, ok=ok)
+        return result
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Few-shot example selection """
+
+import hashlib
+import json
+import math
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import LRUCache
+
+
+STRATEGIES = ('ordered', 'count', 'relevance')
+
+
+pair_tokens_cache = LRUCache(max_items=512)
+embeddings_cache = LRUCache(max_items=8192)
+
+
+def content_hash(value) -> str:
+    return hashlib.sha256(
+        json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def split_pairs(examples: list) -> list:
+    """ Group flat example messages into [user, assistant?] pairs """
+    pairs = []
+    for example in examples:
+        if not pairs or example.get('role') == 'user' or example.get('name') == 'example_user':
+            pairs.append([example])
+        else:
+            pairs[-1].append(example)
+    return pairs
+
+
+def pair_token_counts(pairs: list, model_name: str, count_tokens: Callable) -> list:
+    """
+        Token count of every pair, computed once per examples set (prompt version) and model
+
+        Pairs that cannot be counted get None and are never selected
+    """
+    key = (model_name, content_hash(pairs))
+    counts = pair_tokens_cache.get(key)
+    if counts is None:
+        counts = []
+        for pair in pairs:
+            try:
+                counts.append(count_tokens(pair, model_name))
+            except TypeError:
+                counts.append(None)
+        pair_tokens_cache.put(key, counts)
+    return counts
+
+
+def embed_cached(texts: list, embed: Callable, embedding_model: str) -> list:
+    """ Embeddings for texts, calling embed() only for the ones not cached yet """
+    keys = [(embedding_model, content_hash(text)) for text in texts]
+    vectors = [embeddings_cache.get(key) for key in keys]
+    missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+    if missing:
+        for idx, vector in zip(missing, embed([texts[idx] for idx in missing])):
+            vectors[idx] = vector
+            embeddings_cache.put(keys[idx], vector)
+    return vectors
+
+
+def cosine_similarity(left: list, right: list) -> float:
+    dot = sum(a * b for a, b in zip(left, right))
+    norm = math.sqrt(sum(a * a for a in left)) * math.sqrt(sum(b * b for b in right))
+    return dot / norm if norm else 0.0
+
+
+def _pack(order: list, counts: list, budget: int, stop_at_first: bool = False) -> tuple:
+    chosen = set()
+    for idx in order:
+        if counts[idx] is not None and counts[idx] <= budget:
+            chosen.add(idx)
+            budget -= counts[idx]
+        elif stop_at_first:
+            break
+    return chosen, budget
+
+
+def select_examples(
+        examples: list, model_name: str, budget: int, count_tokens: Callable,
+        strategy: str = 'count', query: Optional[str] = None,
+        embed: Optional[Callable] = None, embedding_model: Optional[str] = None,
+) -> tuple:
+    """
+        Pack complete example pairs into budget
+
+        'ordered' takes pairs in order until one does not fit, 'count' maximizes
+        the number of pairs, 'relevance' prefers pairs whose user input is closest
+        to query. Selected pairs keep their original order.
+        Returns (examples, remaining budget)
+    """
+    pairs = split_pairs(examples)
+    if not pairs:
+        return [], budget
+    counts = pair_token_counts(pairs, model_name, count_tokens)
+    #
+    if strategy == 'ordered':
+        chosen, budget = _pack(list(range(len(pairs))), counts, budget, stop_at_first=True)
+        return [example for idx, pair in enumerate(pairs) if idx in chosen for example in pair], budget
+    #
+    order = sorted(
+        range(len(pairs)), key=lambda idx: (counts[idx] is None, counts[idx] or 0, idx)
+    )
+    if strategy == 'relevance' and query and embed is not None:
+        try:
+            texts = [str(pair[0].get('content') or '') for pair in pairs]
+            query_vector, *vectors = embed_cached([query, *texts], embed, embedding_model)
+            scores = [cosine_similarity(query_vector, vector) for vector in vectors]
+            order = sorted(range(len(pairs)), key=lambda idx: (-scores[idx], idx))
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Example relevance scoring failed, packing by count: %s', e)
+    #
+    chosen, budget = _pack(order, counts, budget)
+    selected = []
+    for idx, pair in enumerate(pairs):
+        if idx in chosen:
+            selected.extend(pair)
+    return selected, budget
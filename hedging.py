@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Hedged upstream requests """
+
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .samples import SampleWindows
+
+
+class HedgeBudget:
+    """ Every request earns `ratio` of a hedge, at most `burst` hedges are banked """
+
+    def __init__(self, ratio: float = 0.05, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self._credits = burst
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self._credits = min(self.burst, self._credits + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            return True
+
+
+latency_tracker = SampleWindows()
+_budgets = {}
+
+
+def get_budget(key: str, ratio: float) -> HedgeBudget:
+    budget = _budgets.get(key)
+    if budget is None or budget.ratio != ratio:
+        budget = _budgets[key] = HedgeBudget(ratio=ratio)
+    return budget
+
+
+async def _timed(key: str, call: Callable[[], Awaitable]):
+    """
+        Await call() and record its latency. A call cancelled because its hedge
+        won is recorded with the time it ran so far (a lower bound), otherwise
+        only fast calls would be sampled and the threshold would keep falling.
+    """
+    start = time.monotonic()
+    try:
+        result = await call()
+    except asyncio.CancelledError:
+        latency_tracker.record(key, time.monotonic() - start)
+        raise
+    latency_tracker.record(key, time.monotonic() - start)
+    return result
+
+
+async def hedged(
+        key: str, primary: Callable[[], Awaitable], secondary: Callable[[], Awaitable],
+        percentile: float = 0.95, budget_ratio: float = 0.05, min_delay: float = 0.5,
+):
+    """
+        Await primary(); when it is slower than the latency percentile for key
+        and the hedge budget allows, start secondary() too. The first successful
+        result wins and the other call is cancelled. Only primary latencies are
+        sampled: they are what the threshold is compared with.
+    """
+    budget = get_budget(key, budget_ratio)
+    budget.on_request()
+    threshold = latency_tracker.percentile(key, percentile)
+    #
+    first = asyncio.ensure_future(_timed(key, primary))
+    if threshold is None:
+        return await first
+    #
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=max(threshold, min_delay))
+        if done or not budget.try_spend():
+            return await first
+        log.info('Hedging slow request for %s after %.2f s', key, max(threshold, min_delay))
+        tasks.add(asyncio.ensure_future(secondary()))
+        #
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                if error is None or task is first:
+                    error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -24,6 +24,12 @@ from pylon.core.tools import web  # pylint: disable=E0611,E0401,W0611
 
 from tools import worker_client  # pylint: disable=E0401
 
+from ..client_keys import with_client_key
+from ..descriptors import pack_descriptor
+from ..endpoints import select_api_base
+from ..streaming import start_stream_usage
+from ..utils import token_count_model
+
 
 class Method:  # pylint: disable=E1101,R0903,W0201
     """
@@ -71,7 +77,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             "method_kwargs": None,
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     @web.method()
     def ai_get_models(  # pylint: disable=R0913
@@ -105,7 +111,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             "method_kwargs": None,
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     @web.method()
     def count_tokens(  # pylint: disable=R0913
@@ -133,7 +139,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             #
             **model_parameters,
             #
-            "azure_endpoint": settings.merged_settings["api_base"],
+            "azure_endpoint": select_api_base(settings.merged_settings),
             "api_version": settings.merged_settings["api_version"],
             "api_key": api_token,
         }
@@ -141,11 +147,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         if isinstance(data, list):
             data = json.loads(json.dumps(data))
         #
-        model_is_legacy_completion = False
-        for model_data in settings.merged_settings["models"]:
-            if model_data["name"] == settings.merged_settings["model_name"]:
-                if not model_data["capabilities"]["chat_completion"]:
-                    model_is_legacy_completion = True
+        _, model_is_legacy_completion = token_count_model(settings.merged_settings)
         #
         target_class = "langchain_openai.chat_models.azure.AzureChatOpenAI"
         if model_is_legacy_completion:
@@ -171,7 +173,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     #
     # LLM
@@ -203,7 +205,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             #
             **model_parameters,
             #
-            "azure_endpoint": settings.merged_settings["api_base"],
+            "azure_endpoint": select_api_base(settings.merged_settings),
             "api_version": settings.merged_settings["api_version"],
             "api_key": api_token,
         }
@@ -228,7 +230,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     @web.method()
     def llm_stream(  # pylint: disable=R0913
@@ -256,13 +258,18 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             #
             **model_parameters,
             #
-            "azure_endpoint": settings.merged_settings["api_base"],
+            "azure_endpoint": select_api_base(settings.merged_settings),
             "api_version": settings.merged_settings["api_version"],
             "api_key": api_token,
             #
             "streaming": True,
         }
         #
+        if settings.merged_settings.get("stream_usage"):
+            target_kwargs["model_kwargs"] = {"stream_options": {"include_usage": True}}
+        #
+        start_stream_usage(stream_id, settings.merged_settings["model_name"], text=text)
+        #
         result = {
             "routing_key": None,
             #
@@ -284,7 +291,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     #
     # ChatModel
@@ -316,7 +323,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             #
             **model_parameters,
             #
-            "azure_endpoint": settings.merged_settings["api_base"],
+            "azure_endpoint": select_api_base(settings.merged_settings),
             "api_version": settings.merged_settings["api_version"],
             "api_key": api_token,
         }
@@ -341,7 +348,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     @web.method()
     def chat_model_stream(  # pylint: disable=R0913
@@ -369,13 +376,18 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             #
             **model_parameters,
             #
-            "azure_endpoint": settings.merged_settings["api_base"],
+            "azure_endpoint": select_api_base(settings.merged_settings),
             "api_version": settings.merged_settings["api_version"],
             "api_key": api_token,
             #
             "streaming": True,
         }
         #
+        if settings.merged_settings.get("stream_usage"):
+            target_kwargs["model_kwargs"] = {"stream_options": {"include_usage": True}}
+        #
+        start_stream_usage(stream_id, settings.merged_settings["model_name"], messages=messages)
+        #
         result = {
             "routing_key": None,
             #
@@ -397,7 +409,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     #
     # Embed
@@ -421,7 +433,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         target_kwargs = {
             "model": settings["model_name"],
             #
-            "azure_endpoint": settings["integration_data"]["settings"]["api_base"],
+            "azure_endpoint": select_api_base(settings["integration_data"]["settings"]),
             "api_version": settings["integration_data"]["settings"]["api_version"],
             "api_key": api_token,
         }
@@ -446,7 +458,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     @web.method()
     def embed_query(  # pylint: disable=R0913
@@ -466,7 +478,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         target_kwargs = {
             "model": settings["model_name"],
             #
-            "azure_endpoint": settings["integration_data"]["settings"]["api_base"],
+            "azure_endpoint": select_api_base(settings["integration_data"]["settings"]),
             "api_version": settings["integration_data"]["settings"]["api_version"],
             "api_key": api_token,
         }
@@ -491,7 +503,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             },
         }
         #
-        return result
+        return pack_descriptor(with_client_key(result))
 
     #
     # Indexer
@@ -523,7 +535,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         )
         #
         auth_kwargs = {
-            "azure_endpoint": settings["settings"]["api_base"],
+            "azure_endpoint": select_api_base(settings["settings"]),
             "api_version": settings["settings"]["api_version"],
             "api_key": api_token,
         }
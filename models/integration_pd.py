@@ -6,11 +6,17 @@ from pylon.core.tools import log
 
 from tools import rpc_tools, VaultClient, worker_client, this, SecretString
 
+from ..breaker import CircuitOpen, connection_breaker
+from ..example_selection import content_hash
+from ..token_limits import TOKEN_LIMITS, token_limit_table
+
 
 def get_token_limits():
     vault_client = VaultClient()
     secrets = vault_client.get_all_secrets()
-    return json.loads(secrets.get('ai_dial_token_limits', ''))
+    if 'ai_dial_token_limits' not in secrets:  # not seeded yet
+        return TOKEN_LIMITS
+    return json.loads(secrets['ai_dial_token_limits'])
 
 
 class CapabilitiesModel(BaseModel):
@@ -24,6 +30,7 @@ class AIModel(BaseModel):
     name: Optional[str]
     capabilities: CapabilitiesModel = CapabilitiesModel()
     token_limit: Optional[int]
+    max_output_tokens: Optional[int]
 
     @validator('name', always=True, check_fields=False)
     def name_validator(cls, value, values):
@@ -37,16 +44,41 @@ class AIModel(BaseModel):
         return token_limits.get(values.get('id'), 8096)
 
 
+class EndpointModel(BaseModel):
+    url: str
+    weight: float = 1
+
+
 class IntegrationModel(BaseModel):
     api_token: SecretString | str
     model_name: str = 'gpt-35-turbo'
     models: List[AIModel] = []
     api_version: str = '2023-03-15-preview'
     api_base: str = "https://ai-proxy.lab.epam.com"
+    api_bases: List[EndpointModel] = []
     api_type: str = "azure"
     temperature: float = 0
     max_tokens: int = 512
     top_p: float = 0.8
+    stream_usage: bool = False
+    history_compaction: bool = False
+    summary_model_name: Optional[str] = None
+    summary_max_tokens: int = 256
+    example_selection: str = 'ordered'
+    embedding_model_name: Optional[str] = None
+    stable_prefix: bool = False
+    stable_prefix_reserve: int = 1024
+    hedging: bool = False
+    hedge_model_name: Optional[str] = None
+    hedge_percentile: float = 0.95
+    hedge_budget_ratio: float = 0.05
+    hedge_min_delay: float = 0.5
+    semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_ttl: int = 3600
+    adaptive_max_tokens: bool = False
+    adaptive_percentile: float = 0.95
+    max_continuations: int = 2
 
     @root_validator(pre=True)
     def prepare_model_list(cls, values):
@@ -55,13 +87,32 @@ class IntegrationModel(BaseModel):
             values['models'] = [AIModel(id=model, name=model).dict(by_alias=True) for model in models]
         return values
 
+    @validator('example_selection')
+    def example_selection_validator(cls, value):
+        if value not in ('ordered', 'count', 'relevance'):
+            raise ValueError(f'Unknown example selection strategy: {value}')
+        return value
+
+    def endpoints(self) -> list:
+        """ [(url, weight), ...] to balance across, api_base when no list is set """
+        return [(item.url, item.weight) for item in self.api_bases] or [(self.api_base, 1.0)]
+
     @property
     def token_limit(self):
-        return next((model.token_limit for model in self.models if model.id == self.model_name), 8096)
+        return self.get_token_limit(self.model_name)
 
     def get_token_limit(self, model_name):
+        context_window = token_limit_table.context_window(self.api_base, model_name)
+        if context_window:
+            return context_window
         return next((model.token_limit for model in self.models if model.id == model_name), 8096)
 
+    def get_max_output_tokens(self, model_name) -> Optional[int]:
+        max_output = token_limit_table.max_output(self.api_base, model_name)
+        if max_output:
+            return max_output
+        return next((model.max_output_tokens for model in self.models if model.id == model_name), None)
+
     def check_connection(self, project_id=None):
         if not project_id:
             from tools import session_project
@@ -70,10 +121,23 @@ class IntegrationModel(BaseModel):
         settings = self.dict()
         settings["api_token"] = self.api_token.unsecret(project_id)
         #
-        return worker_client.ai_check_settings(
-            integration_name=this.module_name,
-            settings=settings,
+        # repeated failures answer at once, healthy results of the same
+        # settings are reused briefly
+        key = connection_breaker.key(
+            settings["api_base"], settings["api_token"],
+            content_hash({name: value for name, value in settings.items() if name != "api_token"}),
         )
+        try:
+            return connection_breaker.call(
+                key,
+                lambda: worker_client.ai_check_settings(
+                    integration_name=this.module_name,
+                    settings=settings,
+                ),
+                is_healthy=lambda result: result is True,
+            )
+        except CircuitOpen as e:
+            return str(e)
 
     def refresh_models(self, project_id):
         integration_name = 'ai_dial'
@@ -17,31 +17,36 @@
 
 """ Module """
 import json
+import threading
+
 from pylon.core.tools import log  # pylint: disable=E0611,E0401
 from pylon.core.tools import module  # pylint: disable=E0611,E0401
 
 from tools import VaultClient, worker_client  # pylint: disable=E0611,E0401
 
+from . import aio
+from .breaker import connection_breaker, models_breaker
+from .client_keys import client_keys
+from .profiling import profiler
+from .quota import quota_manager
+from .scheduler import scheduler
+from .streaming import stream_usage
 from .models.integration_pd import IntegrationModel
+from . import tokenizer_bundle
+from .token_limits import TOKEN_LIMITS
+from .utils import preload_encodings
 
 
-TOKEN_LIMITS = {
-    'text-embedding-ada-002': None,
-    'gpt-35-turbo': 4096,
-    'gpt-35-turbo-16k': 16384,
-    'gpt-4': 8192,
-    'gpt-4-32k': 32768,
-    'gpt-4-turbo': 128000,
-    'gpt-4o': 128000,
-    'gpt-4o-mini': 128000,
-    'chat-bison@001': 8192,
-    'ai21.j2-grande-instruct': 8191,
-    'ai21.j2-jumbo-instruct': 8191,
-    'anthropic.claude-instant-v1': 100000,
-    'anthropic.claude-v1': 100000,
-    'anthropic.claude-v2': 100000,
-    'stability.stable-diffusion-xl': 77
-}
+def seed_token_limits():
+    """ Put default token limits into Vault unless already there """
+    try:
+        vault_client = VaultClient()
+        secrets = vault_client.get_all_secrets()
+        if 'ai_dial_token_limits' not in secrets:
+            secrets['ai_dial_token_limits'] = json.dumps(TOKEN_LIMITS)
+            vault_client.set_secrets(secrets)
+    except Exception as e:  # pylint: disable=W0703
+        log.warning('Failed to seed ai_dial_token_limits: %s', e)
 
 
 class Module(module.ModuleModel):
@@ -67,12 +72,43 @@ class Module(module.ModuleModel):
             section=SECTION_NAME,
             settings_model=IntegrationModel,
         )
+        tokenizer_bundle.configure(self.descriptor.config.get('encodings_dir'))
         #
-        vault_client = VaultClient()
-        secrets = vault_client.get_all_secrets()
-        if 'ai_dial_token_limits' not in secrets:
-            secrets['ai_dial_token_limits'] = json.dumps(TOKEN_LIMITS)
-            vault_client.set_secrets(secrets)
+        # Vault round-trip and tokenizer loading do not block plugin startup
+        threading.Thread(
+            target=seed_token_limits, name='ai_dial_seed_token_limits', daemon=True,
+        ).start()
+        #
+        encodings = self.descriptor.config.get('preload_encodings', [])
+        if encodings:
+            threading.Thread(
+                target=preload_encodings, args=(encodings,), name='ai_dial_preload_encodings', daemon=True,
+            ).start()
+        #
+        stream_usage.emit = lambda payload: self.context.event_manager.fire_event(
+            'ai_dial_stream_usage', payload
+        )
+        client_keys.emit = lambda payload: self.context.event_manager.fire_event(
+            'ai_dial_client_keys_revoked', payload
+        )
+        #
+        quota_config = self.descriptor.config.get('quota', {})
+        quota_manager.flush_interval = quota_config.get('flush_interval', 1.0)
+        quota_manager.period = quota_config.get('period', 'month')
+        for project_id, limits in quota_config.get('projects', {}).items():
+            quota_manager.set_limits(
+                int(project_id), limits.get('prompt_tokens'), limits.get('completion_tokens')
+            )
+        quota_manager.sink = lambda records: self.context.event_manager.fire_event(
+            'ai_dial_token_usage', records
+        )
+        quota_manager.start()
+        #
+        scheduler.configure(self.descriptor.config.get('scheduler', {}))
+        profiler.configure(self.descriptor.config.get('profiling', {}))
+        breaker_config = self.descriptor.config.get('circuit_breaker', {})
+        connection_breaker.configure(breaker_config)
+        models_breaker.configure({**breaker_config, 'healthy_ttl': 0})
         #
         worker_client.register_integration(
             integration_name=self.descriptor.name,
@@ -97,4 +133,7 @@ class Module(module.ModuleModel):
         """ De-init module """
         log.info('De-initializing')
         #
+        aio.shutdown()
+        quota_manager.stop()
+        #
         self.descriptor.deinit_all()
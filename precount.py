@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Token counts of static prompt parts
+
+    Context and example messages are counted when a prompt version is saved
+    (and again for new models when integration models are refreshed), so
+    the request path finds them here and only tokenizes input and history.
+    Counts are keyed by model and a digest of the message (the cache holds no
+    message text); messages with values that are not plain strings are never
+    cached. Remembered static parts are bounded by their total text size.
+"""
+
+from typing import Callable, Iterable, Optional
+
+from .caching import LRUCache
+from .example_selection import content_hash
+
+
+def message_key(message: dict) -> Optional[str]:
+    """ Digest of a message with string values only, None otherwise """
+    fields = {name: value for name, value in message.items() if name != 'custom_content'}
+    if not all(isinstance(value, str) for value in fields.values()):
+        return None
+    return content_hash(fields)
+
+
+def text_size(messages: list) -> int:
+    return sum(len(value) for message in messages for value in message.values() if isinstance(value, str))
+
+
+class StaticTokenCounts:
+    def __init__(self, max_items: int = 65536, max_parts: int = 1024, max_parts_size: int = 32 * 1024 * 1024):
+        self._counts = LRUCache(max_items)
+        # static parts to recount for new models
+        self._parts = LRUCache(max_parts, max_size=max_parts_size, sizeof=text_size)
+
+    def count(self, messages: list, model: str, count_tokens: Callable) -> int:
+        """ Same as count_tokens(messages, model), per message from cache """
+        total = 0
+        for message in messages:
+            key = message_key(message)
+            if key is None:
+                return count_tokens(messages, model)
+            tokens = self._counts.get((model, key))
+            if tokens is None:
+                tokens = count_tokens([message], model)
+                self._counts.put((model, key), tokens)
+            total += tokens
+        return total
+
+    def precount(self, messages: list, models: Iterable[str], count_tokens: Callable) -> dict:
+        """ Warm counts of static messages for models, {model: total tokens} """
+        messages = [message for message in messages if message_key(message) is not None]
+        if messages:
+            self._parts.put(content_hash(messages), messages)
+        return {model: self.count(messages, model, count_tokens) for model in models}
+
+    def precount_registered(self, models: Iterable[str], count_tokens: Callable) -> None:
+        """ Count all remembered static parts for (new) models """
+        models = list(models)
+        for key in self._parts.keys():
+            messages = self._parts.get(key)
+            if messages is not None:
+                self.precount(messages, models, count_tokens)
+
+    def clear(self) -> None:
+        self._counts.clear()
+        self._parts.clear()
+
+
+static_token_counts = StaticTokenCounts()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Opt-in request profiling
+
+    A profiled request records wall time per stage (parse, vault, limits,
+    upstream, ...) and runs its blocking preparation under cProfile; the
+    event loop part is only timed, a loop-wide profile would mix in other
+    requests. Only one profiler can be active per process (Python 3.12+), so
+    overlapping profiled requests are only timed. Requests slower than
+    `threshold` seconds are kept as compact artifacts: stage timings, request
+    metadata and the top functions by cumulative time, gzipped JSON in
+    `artifact_dir` and the last few in memory.
+
+    Profiling starts for a request when enabled in plugin config (sampled by
+    sample_rate) or asked for per request (profile=True), and at most
+    max_per_minute requests are profiled in any case.
+"""
+
+import cProfile
+import gzip
+import json
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+TOP_FUNCTIONS = 40
+
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.stages = {}
+        self.meta = {}
+        self._profile = cProfile.Profile()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def runcall(self, func, *args, **kwargs):
+        """ Run blocking code under cProfile if no other profile is active, just run it otherwise """
+        if not _cprofile_lock.acquire(blocking=False):
+            self.meta['cprofile'] = 'busy'
+            return func(*args, **kwargs)
+        try:
+            try:
+                self._profile.enable()
+            except ValueError:  # another profiling tool (debugger, coverage) is active
+                self.meta['cprofile'] = 'busy'
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._profile.disable()
+        finally:
+            _cprofile_lock.release()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> list:
+        """ [[file:line(function), calls, tottime, cumtime], ...] by cumulative time """
+        try:
+            stats = pstats.Stats(self._profile)
+        except TypeError:  # nothing was profiled
+            return []
+        rows = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append([f'{filename}:{line}({function})', calls, round(tottime, 6), round(cumtime, 6)])
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def artifact(self) -> dict:
+        return {
+            'name': self.name,
+            'started': self.started,
+            'elapsed': round(self.elapsed, 6),
+            'stages': {name: round(value, 6) for name, value in self.stages.items()},
+            'meta': self.meta,
+            'functions': self.top_functions(),
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.threshold = 1.0
+        self.max_per_minute = 6
+        self.artifact_dir: Optional[Path] = None
+        self.recent = deque(maxlen=20)
+        self._started = deque()
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict) -> None:
+        self.enabled = config.get('enabled', self.enabled)
+        self.sample_rate = config.get('sample_rate', self.sample_rate)
+        self.threshold = config.get('threshold', self.threshold)
+        self.max_per_minute = config.get('max_per_minute', self.max_per_minute)
+        artifact_dir = config.get('artifact_dir')
+        self.artifact_dir = Path(artifact_dir) if artifact_dir else None
+
+    def start(self, name: str, requested: bool = False) -> Optional[RequestProfile]:
+        if not requested and not (self.enabled and random.random() < self.sample_rate):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._started and self._started[0] < now - 60:
+                self._started.popleft()
+            if len(self._started) >= self.max_per_minute:
+                return None
+            self._started.append(now)
+        return RequestProfile(name)
+
+    def finish(self, profile: Optional[RequestProfile]) -> Optional[dict]:
+        """ Keep the artifact of a slow request """
+        if profile is None or profile.elapsed < self.threshold:
+            return None
+        artifact = profile.artifact()
+        self.recent.append(artifact)
+        if self.artifact_dir is not None:
+            path = self.artifact_dir / f'{profile.name}-{int(profile.started * 1000)}.json.gz'
+            try:
+                self.artifact_dir.mkdir(parents=True, exist_ok=True)
+                with gzip.open(path, 'wt', encoding='utf-8') as file:
+                    json.dump(artifact, file, separators=(',', ':'))
+            except OSError as e:
+                log.warning('Failed to store profile %s: %s', path, e)
+        log.info(
+            'Slow %s request profiled: %.3fs %s', profile.name, artifact['elapsed'], artifact['stages']
+        )
+        return artifact
+
+
+profiler = Profiler()
+
+
+def stage(profile: Optional[RequestProfile], name: str):
+    """ Stage timer of a profiled request, no-op otherwise """
+    return profile.stage(name) if profile is not None else nullcontext()
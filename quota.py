@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Project token quotas
+
+    Requests append usage deltas to a deque (atomic, no lock on the request
+    path). A background thread folds them into per-project aggregates every
+    flush_interval seconds and hands the batch to the sink (storage); a batch
+    the sink failed to take is merged into the next one. Budget checks read
+    the aggregates without locking, so they may lag actual usage by up to one
+    flush interval.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+def current_period(period: str = 'month') -> str:
+    return time.strftime('%Y-%m-%d' if period == 'day' else '%Y-%m', time.gmtime())
+
+
+class QuotaManager:
+    def __init__(self, flush_interval: float = 1.0, period: str = 'month'):
+        self.flush_interval = flush_interval
+        self.period = period
+        self.sink: Optional[Callable[[list], None]] = None
+        self._limits = {}  # project_id -> (prompt_tokens, completion_tokens), None is unlimited
+        self._used = {}  # project_id -> (prompt_tokens, completion_tokens) in _period
+        self._period = current_period(period)
+        self._pending = deque()
+        self._unsent = {}  # (project_id, period) -> (prompt_tokens, completion_tokens) the sink did not take
+        self._lock = threading.Lock()  # aggregate writers
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def set_limits(self, project_id, prompt_tokens: Optional[int] = None,
+                   completion_tokens: Optional[int] = None) -> None:
+        if prompt_tokens is None and completion_tokens is None:
+            self._limits.pop(project_id, None)
+        else:
+            self._limits[project_id] = (prompt_tokens, completion_tokens)
+
+    def set_used(self, project_id, prompt_tokens: int, completion_tokens: int) -> None:
+        """ Seed aggregates from storage (e.g. after restart) """
+        with self._lock:
+            used = dict(self._used)
+            used[project_id] = (prompt_tokens, completion_tokens)
+            self._used = used
+
+    def limited(self, project_id) -> bool:
+        return project_id in self._limits
+
+    def usage(self, project_id) -> dict:
+        prompt, completion = self._used.get(project_id, (0, 0))
+        prompt_limit, completion_limit = self._limits.get(project_id, (None, None))
+        return {
+            'period': self._period,
+            'prompt_tokens': prompt,
+            'completion_tokens': completion,
+            'prompt_limit': prompt_limit,
+            'completion_limit': completion_limit,
+        }
+
+    def check(self, project_id, prompt_tokens: int, completion_tokens: int) -> None:
+        """ Pre-check estimated usage of one request against the project budget """
+        limits = self._limits.get(project_id)
+        if limits is None:
+            return
+        prompt_limit, completion_limit = limits
+        used_prompt, used_completion = self._used.get(project_id, (0, 0))
+        if prompt_limit is not None and used_prompt + prompt_tokens > prompt_limit:
+            raise QuotaExceeded(
+                f'Project {project_id} prompt token quota exceeded: '
+                f'{used_prompt} + {prompt_tokens} > {prompt_limit}'
+            )
+        if completion_limit is not None and used_completion + completion_tokens > completion_limit:
+            raise QuotaExceeded(
+                f'Project {project_id} completion token quota exceeded: '
+                f'{used_completion} + {completion_tokens} > {completion_limit}'
+            )
+
+    def record(self, project_id, prompt_tokens: int, completion_tokens: int) -> None:
+        self._pending.append((project_id, prompt_tokens, completion_tokens))
+
+    def flush(self) -> list:
+        """ Fold pending deltas into aggregates, pass the batch (and unsent ones) to the sink """
+        with self._flush_lock:
+            batch = {}
+            while True:
+                try:
+                    project_id, prompt, completion = self._pending.popleft()
+                except IndexError:
+                    break
+                item_prompt, item_completion = batch.get(project_id, (0, 0))
+                batch[project_id] = (item_prompt + prompt, item_completion + completion)
+            #
+            with self._lock:
+                period = current_period(self.period)
+                if period != self._period:
+                    self._period = period
+                    self._used = {}
+                if batch:
+                    used = dict(self._used)
+                    for project_id, (prompt, completion) in batch.items():
+                        used_prompt, used_completion = used.get(project_id, (0, 0))
+                        used[project_id] = (used_prompt + prompt, used_completion + completion)
+                    self._used = used  # readers see either the old or the new aggregates
+            #
+            records = [
+                {
+                    'project_id': project_id,
+                    'period': period,
+                    'prompt_tokens': prompt,
+                    'completion_tokens': completion,
+                }
+                for project_id, (prompt, completion) in batch.items()
+            ]
+            if self.sink is not None and (records or self._unsent):
+                self._send(records)
+            return records
+
+    def _send(self, records: list) -> None:
+        """ Sink records together with earlier unsent ones, keep them all on failure """
+        unsent = dict(self._unsent)
+        for record in records:
+            key = (record['project_id'], record['period'])
+            prompt, completion = unsent.get(key, (0, 0))
+            unsent[key] = (prompt + record['prompt_tokens'], completion + record['completion_tokens'])
+        try:
+            self.sink([
+                {
+                    'project_id': project_id,
+                    'period': period,
+                    'prompt_tokens': prompt,
+                    'completion_tokens': completion,
+                }
+                for (project_id, period), (prompt, completion) in unsent.items()
+            ])
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Failed to store token usage batch, retrying with the next one: %s', e)
+            self._unsent = unsent
+        else:
+            self._unsent = {}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ai_dial_quota_flush', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+
+quota_manager = QuotaManager()
@@ -1,3 +1,6 @@
+import threading
+from functools import partial
+
 from pydantic.v1 import ValidationError
 from pylon.core.tools import web, log
 from traceback import format_exc
@@ -5,7 +8,19 @@ from traceback import format_exc
 from tools import rpc_tools, worker_client, this, SecretString
 from ..models.integration_pd import IntegrationModel, AIDialSettings, AIModel
 from ..models.request_body import ChatCompletionRequestBody
-from ..utils import predict_chat,  predict_chat_from_request
+from ..aio import async_results, get_loop, run_sync
+from ..breaker import connection_breaker, models_breaker
+from ..catalog import model_catalog
+from ..client_keys import client_keys
+from ..bulk import count_tokens_batch, prepare_conversations_bulk
+from ..profiling import profiler
+from ..quota import quota_manager
+from ..scheduler import EXTERNAL_LEASE, scheduler
+from ..descriptors import INTERNED, TABLE_VERSION, supported_formats, wire_format
+from ..streaming import stream_results, stream_usage
+from ..token_limits import token_limit_table
+from ..precount import static_token_counts
+from ..utils import apredict_chat, apredict_chat_from_request, num_tokens_from_messages, precount_static_parts
 
 
 # def _get_redis_client():
@@ -16,6 +31,96 @@ from ..utils import predict_chat,  predict_chat_from_request
 #         )
 
 
+def _catalog_settings(payload: dict) -> dict:
+    settings = {
+        "api_base": payload["settings"]["api_base"],
+        "api_version": payload["settings"]["api_version"],
+    }
+    #
+    if isinstance(payload['settings'].get('api_token', {}), SecretString):
+        token_field = payload['settings'].get('api_token')
+    else:
+        token_field = SecretString(
+            payload['settings'].get('api_token', {})
+        )
+    #
+    settings["api_token"] = token_field.unsecret(payload.get('project_id'))
+    return settings
+
+
+def _fetch_models(settings: dict) -> list:
+    raw_models = worker_client.ai_get_models(
+        integration_name=this.module_name,
+        settings=settings,
+    )
+    #
+    limits = token_limit_table.ingest(settings["api_base"], raw_models)
+    #
+    # saved prompts get counts for models that appeared with these settings
+    threading.Thread(
+        target=static_token_counts.precount_registered,
+        args=(
+            [
+                model["id"] for model in raw_models
+                if model.get("id") and (model.get("capabilities") or {}).get("chat_completion", True)
+            ],
+            num_tokens_from_messages,
+        ),
+        name='ai_dial_precount', daemon=True,
+    ).start()
+    #
+    models = []
+    for model in raw_models:
+        model_limits = limits.get(model.get("id"))
+        if model_limits is not None:
+            model = {
+                **model,
+                "token_limit": model_limits.context_window or model.get("token_limit"),
+                "max_output_tokens": model_limits.max_output,
+            }
+        models.append(AIModel(**model).dict())
+    return models
+
+
+def get_catalog_models(payload: dict) -> list:
+    """ Model list from catalog cache, upstream listing at most once per TTL """
+    settings = _catalog_settings(payload)
+    key = model_catalog.key(settings["api_base"], settings["api_token"], settings["api_version"])
+    return model_catalog.get(key, partial(models_breaker.call, key, partial(_fetch_models, settings)))
+
+
+async def apredict(project_id, settings, prompt_struct, format_response: bool = True, **kwargs):
+    """ Predict coroutine """
+    try:
+        result = await apredict_chat(
+            project_id, settings, prompt_struct,
+            format_response=format_response,
+            **kwargs
+        )
+    except Exception as e:
+        log.error(format_exc())
+        return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+
+    return {"ok": True, "response": result}
+
+
+async def achat_completion(
+        project_id, settings, request_data, priority: str = 'interactive', profile: bool = False
+):
+    """ Chat completion coroutine """
+    try:
+        result = await apredict_chat_from_request(project_id, settings, request_data, priority, profile)
+    except Exception as e:
+        log.error(str(e))
+        return {"ok": False, "error": f"{str(e)}"}
+
+    return {"ok": True, "response": result}
+
+
+async def _scheduler_stats():
+    return scheduler.stats()
+
+
 class RPC:
     integration_name = 'ai_dial'
 
@@ -23,29 +128,191 @@ class RPC:
     @rpc_tools.wrap_exceptions(RuntimeError)
     def predict(self, project_id, settings, prompt_struct, format_response: bool = True, **kwargs):
         """ Predict function """
-        try:
-            result = predict_chat(
-                project_id, settings, prompt_struct,
-                format_response=format_response,
-                **kwargs
-            )
-        except Exception as e:
-            log.error(format_exc())
-            return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+        return run_sync(apredict(
+            project_id, settings, prompt_struct, format_response=format_response, **kwargs
+        ))
 
-        return {"ok": True, "response": result}
+    @web.rpc(f'{integration_name}__predict_async')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def predict_async(self, project_id, settings, prompt_struct, format_response: bool = True, **kwargs):
+        """ Predict without holding the caller: returns request_id for ai_dial__async_result """
+        kwargs.setdefault('priority', 'batch')
+        return {"request_id": async_results.submit(apredict(
+            project_id, settings, prompt_struct, format_response=format_response, **kwargs
+        ))}
 
     @web.rpc(f'{integration_name}__chat_completion')
     @rpc_tools.wrap_exceptions(RuntimeError)
-    def chat_completion(self, project_id, settings, request_data):
+    def chat_completion(self, project_id, settings, request_data, priority='interactive', profile=False):
         """ Chat completion function """
-        try:
-            result = predict_chat_from_request(project_id, settings, request_data)
-        except Exception as e:
-            log.error(str(e))
-            return {"ok": False, "error": f"{str(e)}"}
+        return run_sync(achat_completion(project_id, settings, request_data, priority, profile))
 
-        return {"ok": True, "response": result}
+    @web.rpc(f'{integration_name}__chat_completion_async')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def chat_completion_async(self, project_id, settings, request_data, priority='batch', profile=False):
+        """ Chat completion without holding the caller: returns request_id for ai_dial__async_result """
+        return {"request_id": async_results.submit(
+            achat_completion(project_id, settings, request_data, priority, profile)
+        )}
+
+    @web.rpc(f'{integration_name}__async_result')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def async_result(self, request_id, timeout=0):
+        """ Poll a predict_async / chat_completion_async request, waiting up to timeout seconds """
+        return async_results.poll(request_id, timeout)
+
+    @web.rpc(f'{integration_name}__scheduler_acquire')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def scheduler_acquire(self, priority='indexing', project_id=None, tokens=0, timeout=None):
+        """ Slot for upstream work done outside the plugin (e.g. worker embed_documents) """
+        return run_sync(scheduler.acquire(
+            priority, project_id, tokens,
+            max_wait=timeout if timeout is not None else ..., lease=EXTERNAL_LEASE,
+        ))
+
+    @web.rpc(f'{integration_name}__scheduler_release')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def scheduler_release(self, ticket):
+        get_loop().call_soon_threadsafe(scheduler.release, ticket)
+
+    @web.rpc(f'{integration_name}__scheduler_stats')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def scheduler_stats(self):
+        return run_sync(_scheduler_stats())
+
+    @web.rpc(f'{integration_name}__circuit_stats')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def circuit_stats(self):
+        return {
+            'check_connection': connection_breaker.stats(),
+            'list_models': models_breaker.stats(),
+        }
+
+    @web.rpc(f'{integration_name}__stream_usage_feed')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def stream_usage_feed(self, stream_id, chunk, model=None):
+        """ Account one stream chunk or a list of them, returns running totals """
+        return stream_usage.feed(stream_id, chunk, model=model)
+
+    @web.rpc(f'{integration_name}__stream_usage_finish')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def stream_usage_finish(self, stream_id):
+        """ Close stream accounting, returns final totals """
+        return stream_usage.finish(stream_id)
+
+    @web.rpc(f'{integration_name}__stream_usage')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def get_stream_usage(self, stream_id):
+        """ Current totals of a stream """
+        return stream_usage.get(stream_id)
+
+    @web.rpc(f'{integration_name}__stream_result_feed')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def stream_result_feed(self, stream_id, chunk):
+        """ Merge one stream chunk or a list of them, returns the partial result in prepare_result shape """
+        return stream_results.feed(stream_id, chunk)
+
+    @web.rpc(f'{integration_name}__stream_result_finish')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def stream_result_finish(self, stream_id):
+        """ Final result of a stream, drops its state """
+        return stream_results.finish(stream_id)
+
+    @web.rpc(f'{integration_name}__descriptor_formats')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def descriptor_formats(self, routing_key=None):
+        """ Descriptor wire formats and intern table offered to the worker """
+        return {
+            "formats": supported_formats(),
+            "table_version": TABLE_VERSION,
+            "interned": list(INTERNED),
+            "current": wire_format.name(routing_key),
+        }
+
+    @web.rpc(f'{integration_name}__negotiate_descriptor_format')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def negotiate_descriptor_format(
+            self, formats, table_version=TABLE_VERSION, routing_key=None, worker=None, features=None
+    ):
+        """
+            Called by the worker with formats it can decode and features it
+            supports ('client_key'), returns the chosen format
+        """
+        return wire_format.negotiate(formats, table_version, routing_key, worker, features)
+
+    @web.rpc(f'{integration_name}__forget_descriptor_format')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def forget_descriptor_format(self, routing_key=None, worker=None):
+        """ Called by a worker that stops serving its routing key """
+        wire_format.forget(routing_key, worker)
+
+    @web.rpc(f'{integration_name}__revoke_client_keys')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def revoke_client_keys(self, api_token=None, fingerprint=None, project_id=None):
+        """ Drop warm worker clients of a rotated credential """
+        if isinstance(api_token, SecretString):
+            api_token = api_token.unsecret(project_id)
+        return client_keys.revoke(api_key=api_token, fingerprint=fingerprint)
+
+    @web.rpc(f'{integration_name}__prepare_conversations')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def prepare_conversations(self, settings, prompt_structs):
+        """ Token-limited messages for many legacy prompt structs (batch evaluations) """
+        settings = IntegrationModel.parse_obj(settings)
+        max_tokens = settings.max_tokens
+        max_output_tokens = settings.get_max_output_tokens(settings.model_name)
+        if max_output_tokens and max_tokens > max_output_tokens:
+            max_tokens = max_output_tokens
+        return prepare_conversations_bulk(
+            prompt_structs, settings.model_name, max_tokens, settings.token_limit
+        )
+
+    @web.rpc(f'{integration_name}__profiles')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def profiles(self):
+        """ Artifacts of the last profiled slow requests """
+        return list(profiler.recent)
+
+    @web.rpc(f'{integration_name}__count_tokens_batch')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def count_tokens_batch(self, settings, items):
+        """ count_tokens of many texts / message lists in one call, counted locally """
+        return count_tokens_batch(items, settings)
+
+    @web.rpc(f'{integration_name}__precount_prompt')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def precount_prompt(self, settings, prompt):
+        """ Call on prompt version save: count context/examples for configured models in background """
+        settings = IntegrationModel.parse_obj(settings)
+        models = list(dict.fromkeys(
+            [settings.model_name] + [
+                model.id for model in settings.models if model.capabilities.chat_completion
+            ]
+        ))
+        threading.Thread(
+            target=precount_static_parts, args=(prompt, models), name='ai_dial_precount', daemon=True,
+        ).start()
+        return {"ok": True, "models": models}
+
+    @web.rpc(f'{integration_name}__set_quota')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def set_quota(self, project_id, prompt_tokens=None, completion_tokens=None):
+        """ Token budget of a project for the current period, None removes the limit """
+        quota_manager.set_limits(project_id, prompt_tokens, completion_tokens)
+        return quota_manager.usage(project_id)
+
+    @web.rpc(f'{integration_name}__seed_quota_usage')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def seed_quota_usage(self, project_id, prompt_tokens, completion_tokens):
+        """ Restore stored usage of the current period (e.g. after restart) """
+        quota_manager.set_used(project_id, prompt_tokens, completion_tokens)
+        return quota_manager.usage(project_id)
+
+    @web.rpc(f'{integration_name}__quota_usage')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def quota_usage(self, project_id):
+        """ Flushed token usage and limits of a project """
+        return quota_manager.usage(project_id)
 
     @web.rpc(f'{integration_name}__completion')
     @rpc_tools.wrap_exceptions(RuntimeError)
@@ -62,33 +329,12 @@ class RPC:
             return {"ok": False, "error": e}
         return {"ok": True, "item": settings}
 
-    # @web.rpc(f'{integration_name}_get_models', 'get_models')
-    # @rpc_tools.wrap_exceptions(RuntimeError)
-    # def get_models(self):
-    #     _rc = _get_redis_client()
-    #     models = _rc.get(name=RPC.integration_name)
-    #     return json.loads(models) if models else []
+    @web.rpc(f'{integration_name}_get_models', 'get_models')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    def get_models(self, payload: dict):
+        return get_catalog_models(payload)
 
     @web.rpc(f'{integration_name}_set_models', 'set_models')
     @rpc_tools.wrap_exceptions(RuntimeError)
     def set_models(self, payload: dict):
-        settings = {
-            "api_base": payload["settings"]["api_base"],
-            "api_version": payload["settings"]["api_version"],
-        }
-        #
-        if isinstance(payload['settings'].get('api_token', {}), SecretString):
-            token_field = payload['settings'].get('api_token')
-        else:
-            token_field = SecretString(
-                payload['settings'].get('api_token', {})
-            )
-        #
-        settings["api_token"] = token_field.unsecret(payload.get('project_id'))
-        #
-        raw_models = worker_client.ai_get_models(
-            integration_name=this.module_name,
-            settings=settings,
-        )
-        #
-        return [AIModel(**model).dict() for model in raw_models]
+        return get_catalog_models(payload)
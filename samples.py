@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+""" Recent numeric samples per key (latencies, completion lengths) """
+
+from collections import deque
+from typing import Optional
+
+
+class SampleWindows:
+    """ Recent samples per key in fixed-size windows """
+
+    def __init__(self, window: int = 512, min_samples: int = 50):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+
+    def record(self, key: str, value: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples.setdefault(key, deque(maxlen=self.window))
+        samples.append(value)
+
+    def percentile(self, key: str, share: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
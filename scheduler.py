@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Priority scheduler for upstream calls
+
+    Slots (at most `concurrency` calls in flight) are handed out by weighted
+    fair queueing: classes (interactive, batch, indexing) share slots by
+    weight, projects within a class share them equally. Fairness is tracked
+    with per-class and per-project virtual time charged by estimated tokens.
+
+    With tpm_limit set, admission control keeps a sliding one-minute window
+    of granted tokens. A class is admitted only while the remaining headroom
+    stays above its reserve; low-priority work waits for headroom and is shed
+    (SchedulerOverloaded) after its max_wait.
+
+    Must be used from the shared event loop (see aio.get_loop).
+"""
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+PRIORITY_WEIGHTS = {'interactive': 8, 'batch': 2, 'indexing': 1}
+# share of tpm_limit that must stay free after admitting the request
+HEADROOM_RESERVE = {'interactive': 0.0, 'batch': 0.2, 'indexing': 0.4}
+# seconds to wait for a slot before shedding, None waits forever
+MAX_WAIT = {'interactive': None, 'batch': 30.0, 'indexing': 120.0}
+
+RETRY_INTERVAL = 0.25
+EXTERNAL_LEASE = 300.0
+
+
+class SchedulerOverloaded(RuntimeError):
+    pass
+
+
+def estimate_cost(messages: list, max_tokens: int = 0) -> int:
+    """ Rough token cost (4 characters per token) without running the tokenizer """
+    chars = sum(len(str(message.get('content') or '')) for message in messages)
+    return chars // 4 + (max_tokens or 0)
+
+
+class TokenWindow:
+    """ Tokens granted during the last `window` seconds """
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._items = deque()
+        self._total = 0
+
+    def add(self, tokens: int) -> None:
+        self._items.append((time.monotonic(), tokens))
+        self._total += tokens
+
+    def used(self) -> int:
+        horizon = time.monotonic() - self.window
+        while self._items and self._items[0][0] < horizon:
+            self._total -= self._items.popleft()[1]
+        return self._total
+
+
+class _Waiter:
+    __slots__ = ('priority', 'project_id', 'cost', 'future', 'deadline')
+
+    def __init__(self, priority, project_id, cost, future, deadline):
+        self.priority = priority
+        self.project_id = project_id
+        self.cost = cost
+        self.future = future
+        self.deadline = deadline
+
+
+class Scheduler:
+    def __init__(self, concurrency: int = 64, tpm_limit: Optional[int] = None):
+        self.concurrency = concurrency
+        self.tpm_limit = tpm_limit
+        self.weights = dict(PRIORITY_WEIGHTS)
+        self.reserve = dict(HEADROOM_RESERVE)
+        self.max_wait = dict(MAX_WAIT)
+        self.tokens = TokenWindow()
+        self.in_flight = 0
+        self._queues = {}  # priority -> {project_id: deque of _Waiter}
+        self._class_vtime = {}
+        self._project_vtime = {}  # (priority, project_id) -> vtime, active projects only
+        self._tickets = {}  # ticket -> lease deadline (None for internal calls)
+        self._ticket_ids = itertools.count(1)
+        self._timer = None
+
+    def configure(self, config: dict) -> None:
+        self.concurrency = config.get('concurrency', self.concurrency)
+        self.tpm_limit = config.get('tpm_limit', self.tpm_limit)
+        self.weights.update(config.get('weights', {}))
+        self.reserve.update(config.get('reserve', {}))
+        self.max_wait.update(config.get('max_wait', {}))
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'concurrency': self.concurrency,
+            'tpm_used': self.tokens.used(),
+            'tpm_limit': self.tpm_limit,
+            'queued': {
+                priority: sum(len(queue) for queue in projects.values())
+                for priority, projects in self._queues.items()
+            },
+        }
+
+    def _admissible(self, priority: str, cost: int) -> bool:
+        if self.tpm_limit is None:
+            return True
+        headroom = self.tpm_limit - self.tokens.used()
+        reserve = self.reserve.get(priority, 0.0)
+        if not reserve:
+            return headroom > 0
+        return headroom - cost >= reserve * self.tpm_limit
+
+    def _grant(self, priority: str, project_id, cost: int, lease: Optional[float]) -> int:
+        weight = self.weights.get(priority, 1)
+        self._class_vtime[priority] = self._class_vtime.get(priority, 0.0) + max(cost, 1) / weight
+        key = (priority, project_id)
+        if key in self._project_vtime:
+            self._project_vtime[key] += max(cost, 1)
+        self.in_flight += 1
+        self.tokens.add(cost)
+        ticket = next(self._ticket_ids)
+        self._tickets[ticket] = time.monotonic() + lease if lease else None
+        return ticket
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        projects = self._queues.setdefault(waiter.priority, {})
+        if not projects:
+            # newly active class does not bank credit for its idle time
+            active = [self._class_vtime.get(name, 0.0) for name, items in self._queues.items() if items]
+            if active:
+                self._class_vtime[waiter.priority] = max(
+                    self._class_vtime.get(waiter.priority, 0.0), min(active)
+                )
+        queue = projects.get(waiter.project_id)
+        if queue is None:
+            active = [
+                vtime for (priority, _), vtime in self._project_vtime.items()
+                if priority == waiter.priority
+            ]
+            self._project_vtime[(waiter.priority, waiter.project_id)] = min(active) if active else 0.0
+            queue = projects[waiter.project_id] = deque()
+        queue.append(waiter)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        projects = self._queues.get(waiter.priority, {})
+        queue = projects.get(waiter.project_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del projects[waiter.project_id]
+            self._project_vtime.pop((waiter.priority, waiter.project_id), None)
+
+    def _next(self) -> Optional[_Waiter]:
+        """ Head waiter of the fairest admissible class/project """
+        classes = sorted(
+            (priority for priority, projects in self._queues.items() if projects),
+            key=lambda priority: self._class_vtime.get(priority, 0.0),
+        )
+        for priority in classes:
+            projects = self._queues[priority]
+            project_id = min(projects, key=lambda item: self._project_vtime.get((priority, item), 0.0))
+            waiter = projects[project_id][0]
+            if self._admissible(priority, waiter.cost):
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        now = time.monotonic()
+        #
+        for ticket, deadline in list(self._tickets.items()):
+            if deadline is not None and deadline < now:
+                log.warning('Scheduler slot %s lease expired, releasing', ticket)
+                self.release(ticket, dispatch=False)
+        #
+        for projects in list(self._queues.values()):
+            for queue in list(projects.values()):
+                for waiter in list(queue):
+                    if waiter.deadline is not None and waiter.deadline < now:
+                        self._remove(waiter)
+                        if not waiter.future.done():
+                            waiter.future.set_exception(SchedulerOverloaded(
+                                f'No capacity for {waiter.priority} request within its wait limit'
+                            ))
+        #
+        while self.in_flight < self.concurrency:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self._remove(waiter)
+            if waiter.future.done():
+                continue
+            waiter.future.set_result(self._grant(
+                waiter.priority, waiter.project_id, waiter.cost, None
+            ))
+        #
+        if any(projects for projects in self._queues.values()) and self._timer is None:
+            # waiting on TPM headroom or deadlines: nothing else will wake us
+            self._timer = asyncio.get_running_loop().call_later(RETRY_INTERVAL, self._dispatch)
+
+    async def acquire(
+            self, priority: str = 'interactive', project_id=None, cost: int = 0,
+            max_wait: Optional[float] = ..., lease: Optional[float] = None
+    ) -> int:
+        """ Wait for a slot, returns a ticket to release() """
+        if priority not in self.weights:
+            raise ValueError(f'Unknown priority class {priority!r}')
+        queued = any(self._queues.get(priority, {}).values())
+        if not queued and self.in_flight < self.concurrency and self._admissible(priority, cost):
+            return self._grant(priority, project_id, cost, lease)
+        #
+        if max_wait is ...:
+            max_wait = self.max_wait.get(priority)
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(
+            priority, project_id, cost, loop.create_future(),
+            time.monotonic() + max_wait if max_wait is not None else None,
+        )
+        self._enqueue(waiter)
+        self._dispatch()
+        try:
+            ticket = await waiter.future
+        except asyncio.CancelledError:
+            self._remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self.release(waiter.future.result())
+            raise
+        if lease:
+            self._tickets[ticket] = time.monotonic() + lease
+        return ticket
+
+    def release(self, ticket: int, dispatch: bool = True) -> None:
+        if self._tickets.pop(ticket, False) is False:
+            return  # already released (e.g. lease expired)
+        self.in_flight -= 1
+        if dispatch:
+            self._dispatch()
+
+
+scheduler = Scheduler()
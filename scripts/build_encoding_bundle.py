@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Build a local tiktoken encoding bundle (.bpe files)
+
+    Run once on a machine with network access (or pass --source with
+    already downloaded .tiktoken files), then ship the output directory to
+    air-gapped workers and point encodings_dir / AI_DIAL_ENCODINGS_DIR to it.
+
+    Example:
+        python scripts/build_encoding_bundle.py /opt/ai_dial/encodings
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from runtime import import_plugin_module  # pylint: disable=C0413,E0401
+
+
+def main():
+    bundle = import_plugin_module('tokenizer_bundle')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', type=Path)
+    parser.add_argument('--encodings', nargs='+', default=list(bundle.BUNDLED_ENCODINGS))
+    parser.add_argument('--source', type=Path, help='directory with <name>.tiktoken files')
+    args = parser.parse_args()
+    #
+    args.output.mkdir(parents=True, exist_ok=True)
+    for name in args.encodings:
+        if args.source is not None:
+            ranks = bundle.read_tiktoken_file(args.source / f'{name}.tiktoken')
+        else:
+            from tiktoken_ext.openai_public import ENCODING_CONSTRUCTORS  # pylint: disable=C0415,E0401
+            ranks = ENCODING_CONSTRUCTORS[name]()['mergeable_ranks']
+        path = args.output / f'{name}.bpe'
+        bundle.build_bpe_file(ranks, path)
+        print(f'{name}: {len(ranks)} tokens -> {path}')
+
+
+if __name__ == '__main__':
+    main()
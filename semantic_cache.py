@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Semantic response cache
+
+    Answers are stored per scope (project, prompt, deployment) in a fixed-size
+    matrix of normalized input embeddings; lookup is one matrix-vector product.
+    When a scope is full, expired entries are replaced first, then the least
+    recently used one. Only single-turn conversations (system/example messages
+    plus the user input) are cached: with chat history the same input may
+    need a different answer.
+"""
+
+import copy
+import threading
+import time
+from typing import Optional
+
+from .caching import LRUCache
+from .example_selection import content_hash
+
+
+class VectorIndex:
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._vectors = None  # capacity x dim, allocated on first add
+        self._values = [None] * capacity
+        self._created = [0.0] * capacity
+        self._used = [0.0] * capacity
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _alive(self, slot: int, now: float) -> bool:
+        return self._values[slot] is not None and now - self._created[slot] < self.ttl
+
+    def search(self, vector, threshold: float):
+        """ Value of the most similar live entry with cosine similarity >= threshold """
+        with self._lock:
+            if not self._size or len(vector) != self._vectors.shape[1]:
+                return None
+            scores = self._vectors[:self._size] @ vector
+            now = time.monotonic()
+            for slot in scores.argsort()[::-1]:
+                if scores[slot] < threshold:
+                    return None
+                if self._alive(slot, now):
+                    self._used[slot] = now
+                    return self._values[slot]
+            return None
+
+    def add(self, vector, value) -> None:
+        import numpy as np  # pylint: disable=C0415
+        with self._lock:
+            if self._vectors is None or len(vector) != self._vectors.shape[1]:
+                # first entry or the embedding deployment changed: start over
+                self._vectors = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+                self._values = [None] * self.capacity
+                self._size = 0
+            now = time.monotonic()
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                expired = [idx for idx in range(self.capacity) if not self._alive(idx, now)]
+                slot = expired[0] if expired else min(range(self.capacity), key=self._used.__getitem__)
+            self._vectors[slot] = vector
+            self._values[slot] = value
+            self._created[slot] = now
+            self._used[slot] = now
+
+
+def normalize(embedding: list):
+    import numpy as np  # pylint: disable=C0415
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def cache_scope(project_id: int, model_name: str, conversation: list) -> Optional[tuple]:
+    """ ((project, prompt hash, deployment), input text), None when not cacheable """
+    if not conversation or conversation[-1]['role'] != 'user':
+        return None
+    prompt = conversation[:-1]
+    for message in prompt:
+        if message['role'] != 'system' and message.get('name') not in ('example_user', 'example_assistant'):
+            return None
+    text = conversation[-1].get('content')
+    if not isinstance(text, str) or not text.strip():
+        return None
+    return (project_id, content_hash(prompt), model_name), text
+
+
+class SemanticCache:
+    def __init__(self, capacity: int = 512, max_scopes: int = 1024):
+        self.capacity = capacity
+        self._indexes = LRUCache(max_scopes)
+        self._lock = threading.Lock()
+
+    def _index(self, scope: tuple, ttl: float) -> VectorIndex:
+        index = self._indexes.get(scope)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(scope)
+                if index is None:
+                    index = VectorIndex(self.capacity, ttl)
+                    self._indexes.put(scope, index)
+        index.ttl = ttl
+        return index
+
+    def lookup(self, scope: tuple, embedding: list, threshold: float, ttl: float) -> Optional[dict]:
+        result = self._index(scope, ttl).search(normalize(embedding), threshold)
+        return copy.deepcopy(result) if result is not None else None
+
+    def store(self, scope: tuple, embedding: list, result: dict, ttl: float) -> None:
+        self._index(scope, ttl).add(normalize(embedding), copy.deepcopy(result))
+
+    def clear(self) -> None:
+        self._indexes.clear()
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Stream usage accounting and incremental results """
+
+import threading
+from typing import Callable, Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+from .caching import LRUCache
+from .utils import attachment_messages, get_encoding
+
+
+class StreamTokenCounter:
+    """
+        Completion token counter fed with stream deltas as they arrive
+
+        Text is encoded up to the last whitespace (tokens do not span it in
+        practice), so only the unfinished word is kept: memory is constant
+        whatever the response length. Usage reported by the stream itself
+        (stream_options.include_usage) replaces the estimate. A prompt given
+        as (messages, text) is counted on the first chunk, not at stream start.
+    """
+
+    def __init__(
+            self, model: str, prompt_tokens: int = 0, max_pending: int = 1024,
+            prompt: Optional[tuple] = None,
+    ):
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self._prompt = prompt
+        self.completion_tokens = 0
+        self.chunks = 0
+        self.exact = False
+        self.finished = False
+        self.max_pending = max_pending
+        self._pending = ''
+        self._lock = threading.Lock()
+
+    def _encode(self, text: str) -> int:
+        return len(get_encoding(self.model).encode(text, disallowed_special=()))
+
+    def _count_prompt(self) -> None:
+        """ Count the pending prompt once, under lock """
+        if self._prompt is None:
+            return
+        messages, text = self._prompt
+        self._prompt = None
+        if self.exact:
+            return
+        try:
+            self.prompt_tokens = count_prompt_tokens(self.model, messages=messages, text=text)
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Could not count stream prompt tokens: %s', e)
+
+    def feed_text(self, text: str) -> None:
+        if not text or self.exact:
+            return
+        with self._lock:
+            pending = self._pending + text
+            cut = max(pending.rfind(' '), pending.rfind('\n'))
+            if cut <= 0 and len(pending) > self.max_pending:
+                cut = len(pending)
+            if cut > 0:
+                self.completion_tokens += self._encode(pending[:cut])
+                pending = pending[cut:]
+            self._pending = pending
+
+    def feed_chunk(self, chunk) -> None:
+        """ Chat/text completion chunk dict, langchain chunk dict or plain text """
+        self.chunks += 1
+        if self._prompt is not None:
+            with self._lock:
+                self._count_prompt()
+        if isinstance(chunk, str):
+            self.feed_text(chunk)
+            return
+        usage = chunk.get('usage') or chunk.get('usage_metadata')
+        if usage:
+            self.set_usage(usage)
+            return
+        if 'content' in chunk or 'text' in chunk:
+            self.feed_text(chunk.get('content') or chunk.get('text') or '')
+        for choice in chunk.get('choices') or []:
+            delta = choice.get('delta') or {}
+            self.feed_text(delta.get('content') or choice.get('text') or '')
+
+    def set_usage(self, usage: dict) -> None:
+        with self._lock:
+            self.prompt_tokens = usage.get('prompt_tokens', usage.get('input_tokens', self.prompt_tokens))
+            self.completion_tokens = usage.get(
+                'completion_tokens', usage.get('output_tokens', self.completion_tokens)
+            )
+            self.exact = True
+            self._pending = ''
+            self._prompt = None
+
+    def finish(self) -> dict:
+        with self._lock:
+            self._count_prompt()
+            if self._pending and not self.exact:
+                self.completion_tokens += self._encode(self._pending)
+            self._pending = ''
+            self.finished = True
+        return self.totals()
+
+    def totals(self) -> dict:
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens + self.completion_tokens,
+            'exact': self.exact,
+            'final': self.finished,
+        }
+
+
+class StreamUsageRegistry:
+    """ Counters per stream_id, running totals emitted every emit_every chunks """
+
+    def __init__(self, max_streams: int = 4096, emit_every: int = 16):
+        self.emit_every = emit_every
+        self.emit: Optional[Callable[[dict], None]] = None
+        self._counters = LRUCache(max_items=max_streams)
+
+    def start(
+            self, stream_id: str, model: str, prompt_tokens: int = 0, prompt: Optional[tuple] = None,
+    ) -> StreamTokenCounter:
+        counter = StreamTokenCounter(model, prompt_tokens, prompt=prompt)
+        self._counters.put(stream_id, counter)
+        return counter
+
+    def feed(self, stream_id: str, chunks, model: Optional[str] = None) -> Optional[dict]:
+        """ Account a chunk or a list of chunks, returns running totals """
+        counter = self._counters.get(stream_id)
+        if counter is None:
+            if model is None:
+                return None
+            counter = self.start(stream_id, model)
+        emitted = counter.chunks // self.emit_every
+        for chunk in chunks if isinstance(chunks, list) else [chunks]:
+            counter.feed_chunk(chunk)
+        if counter.chunks // self.emit_every > emitted:
+            self._emit(stream_id, counter.totals())
+        return counter.totals()
+
+    def finish(self, stream_id: str) -> Optional[dict]:
+        counter = self._counters.get(stream_id)
+        if counter is None:
+            return None
+        totals = counter.finish()
+        self._emit(stream_id, totals)
+        return totals
+
+    def get(self, stream_id: str) -> Optional[dict]:
+        counter = self._counters.get(stream_id)
+        return counter.totals() if counter is not None else None
+
+    def _emit(self, stream_id: str, totals: dict) -> None:
+        if self.emit is None:
+            return
+        try:
+            self.emit({'stream_id': stream_id, **totals})
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Failed to emit stream usage for %s: %s', stream_id, e)
+
+
+stream_usage = StreamUsageRegistry()
+
+
+def start_stream_usage(stream_id: str, model: str, messages=None, text: Optional[str] = None) -> None:
+    """
+        Register a counter for a stream about to be started on the worker.
+        Called while building descriptors: the prompt is kept, not tokenized.
+    """
+    stream_usage.start(stream_id, model, prompt=(messages, text))
+
+
+def count_prompt_tokens(model: str, messages=None, text: Optional[str] = None) -> int:
+    """ Prompt estimate for stream start: chat messages (any dict flavour) or plain text """
+    if text is not None:
+        return len(get_encoding(model).encode(str(text), disallowed_special=()))
+    total = 0
+    for message in messages or []:
+        content = message.get('content') if isinstance(message, dict) else message
+        if isinstance(content, list):  # multimodal parts
+            content = ' '.join(str(part.get('text', '')) for part in content if isinstance(part, dict))
+        total += 4 + len(get_encoding(model).encode(str(content or ''), disallowed_special=()))
+    return total + 3
+
+
+def merge_delta(target: dict, delta: dict) -> dict:
+    """
+        DIAL chunk merge: strings are concatenated, dicts merged recursively,
+        list items with an `index` update the item at that index (others are appended),
+        None means absent (model_dump of a chunk fills unset fields with None)
+    """
+    for key, value in delta.items():
+        if value is None:
+            continue
+        current = target.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merge_delta(current, value)
+        elif isinstance(current, list) and isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and 'index' in item:
+                    index = item['index']
+                    while len(current) <= index:
+                        current.append({})
+                    merge_delta(current[index], item)
+                else:
+                    current.append(item)
+        elif isinstance(current, str) and isinstance(value, str):
+            target[key] = current + value
+        elif isinstance(value, list):
+            target[key] = []
+            merge_delta(target, {key: value})
+        elif isinstance(value, dict):
+            target[key] = {}
+            merge_delta(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class StreamResultFormatter:
+    """
+        prepare_result for a stream: {'messages': [...]} of everything received
+        so far. Content deltas are collected and joined when a result is taken,
+        not concatenated chunk by chunk; empty text is not reported.
+    """
+
+    def __init__(self):
+        self.message = {}
+        self.custom_content = {}  # choice level custom_content
+        self._content = []
+
+    def feed(self, chunk: dict) -> None:
+        for choice in chunk.get('choices') or []:
+            if choice.get('index', 0) != 0:
+                continue
+            delta = dict(choice.get('delta') or {})
+            delta.pop('role', None)
+            content = delta.pop('content', None)
+            if content:
+                self._content.append(content)
+            merge_delta(self.message, delta)
+            if choice.get('custom_content'):
+                merge_delta(self.custom_content, choice['custom_content'])
+
+    def content(self) -> str:
+        if len(self._content) > 1:
+            self._content = [''.join(self._content)]
+        return self._content[0] if self._content else ''
+
+    def result(self) -> dict:
+        messages = []
+        custom_content = self.message.get('custom_content', {})
+        if 'state' in custom_content:
+            messages.append({
+                'type': 'state',
+                'content': custom_content['state']
+            })
+        content = self.content()
+        if content:
+            messages.append({
+                'type': 'text',
+                'content': content
+            })
+        messages.extend(attachment_messages([
+            *self.custom_content.get('attachments', []),
+            *custom_content.get('attachments', []),
+        ]))
+        return {'messages': messages}
+
+
+class StreamResultRegistry:
+    """ Formatters per stream_id """
+
+    def __init__(self, max_streams: int = 4096):
+        self._formatters = LRUCache(max_items=max_streams)
+
+    def feed(self, stream_id: str, chunks: dict | list) -> dict:
+        """ Merge a chunk or a batch of chunks, returns the partial result once """
+        formatter = self._formatters.get(stream_id)
+        if formatter is None:
+            formatter = StreamResultFormatter()
+            self._formatters.put(stream_id, formatter)
+        for chunk in chunks if isinstance(chunks, list) else [chunks]:
+            formatter.feed(chunk)
+        return formatter.result()
+
+    def finish(self, stream_id: str) -> Optional[dict]:
+        formatter = self._formatters.pop(stream_id)
+        return formatter.result() if formatter is not None else None
+
+
+stream_results = StreamResultRegistry()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Plugin modules are loaded outside of pylon through benchmarks/runtime
+    (stand-ins for pylon/tools), token counting uses byte-level stub encodings.
+    The stand-ins are installed at import: pytest imports the plugin
+    __init__ itself when setting up the package the tests live in.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from runtime import import_plugin_module, install_runtime, use_stub_encodings  # pylint: disable=C0413
+
+install_runtime()
+
+
+@pytest.fixture(scope='session')
+def plugin():
+    use_stub_encodings()
+    return import_plugin_module
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Adaptive max_tokens: reservation from samples and continuation of cut answers """
+
+import asyncio
+import math
+import types
+
+import pytest
+
+MODEL = 'gpt-4-0613'
+
+
+@pytest.fixture
+def modules(plugin):
+    return plugin('utils'), plugin('adaptive')
+
+
+class Response:
+    def __init__(self, content, finish_reason, completion_tokens, tool_calls=None):
+        self._data = {
+            'choices': [{
+                'index': 0,
+                'finish_reason': finish_reason,
+                'message': {'role': 'assistant', 'content': content, 'tool_calls': tool_calls},
+            }],
+            'usage': {
+                'prompt_tokens': 10,
+                'completion_tokens': completion_tokens,
+                'total_tokens': 10 + completion_tokens,
+            },
+        }
+
+    def model_dump(self):
+        return self._data
+
+
+def _continue(utils, adaptive, response: Response, parts: list, key: str):
+    settings = types.SimpleNamespace(model_name=MODEL, max_continuations=3)
+    calls = []
+
+    async def _create(model, messages=None, max_tokens=None):
+        calls.append(max_tokens)
+        return parts.pop(0)
+
+    options = {'key': key, 'max_tokens': 100, 'token_limit': 8192}
+    result = asyncio.run(utils._continue_truncated(  # pylint: disable=W0212
+        response.model_dump(), [{'role': 'user', 'content': 'Hi'}], settings, options, _create
+    ))
+    return result, calls
+
+
+def test_cut_answer_is_continued_and_merged(modules):
+    utils, adaptive = modules
+    result, calls = _continue(
+        utils, adaptive, Response('Once upon', 'length', 40), [Response(' a time.', 'stop', 5)], 'cut',
+    )
+    assert calls == [60]
+    assert result['choices'][0]['message']['content'] == 'Once upon a time.'
+    assert result['choices'][0]['finish_reason'] == 'stop'
+    assert result['usage']['completion_tokens'] == 45
+    assert adaptive.completion_lengths._samples['cut'][-1] == 45  # pylint: disable=W0212
+
+
+def test_tool_call_answer_keeps_none_content(modules):
+    utils, adaptive = modules
+    tool_calls = [{'id': 'call', 'type': 'function', 'function': {'name': 'lookup', 'arguments': '{}'}}]
+    result, calls = _continue(
+        utils, adaptive, Response(None, 'tool_calls', 12, tool_calls=tool_calls), [], 'tools',
+    )
+    assert not calls
+    assert result['choices'][0]['message']['content'] is None
+    assert result['choices'][0]['message']['tool_calls'] == tool_calls
+
+
+def test_reserve_follows_observed_lengths(modules):
+    _, adaptive = modules
+    key = adaptive.prompt_key(MODEL, {'context': 'reserve test', 'examples': []})
+    assert adaptive.reserve_tokens(key, 1000, 0.95) == 1000
+    for length in range(100, 300):
+        adaptive.completion_lengths.record(key, length)
+    assert adaptive.reserve_tokens(key, 1000, 0.95) == math.ceil(290 * adaptive.RESERVE_MARGIN)
+    assert adaptive.reserve_tokens(key, 200, 0.95) == 200
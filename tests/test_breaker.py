@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Circuit breaker transitions: closed, open, half-open, reset """
+
+import threading
+import types
+
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def breaker(plugin, monkeypatch):
+    module = plugin('breaker')
+    clock = Clock()
+    monkeypatch.setattr(module, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    circuit_breaker = module.CircuitBreaker(
+        'test', failure_threshold=3, reset_timeout=10, max_reset_timeout=40, healthy_ttl=5,
+    )
+    return module, circuit_breaker, clock
+
+
+def _fail():
+    raise TimeoutError('upstream timeout')
+
+
+def _trip(circuit_breaker, key):
+    for _ in range(circuit_breaker.failure_threshold):
+        with pytest.raises(TimeoutError):
+            circuit_breaker.call(key, _fail)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    module, circuit_breaker, _ = breaker
+    key = circuit_breaker.key('https://dial.example/', 'token')
+    _trip(circuit_breaker, key)
+    calls = []
+    with pytest.raises(module.CircuitOpen):
+        circuit_breaker.call(key, lambda: calls.append(1))
+    assert not calls
+    assert circuit_breaker.stats() == [
+        {'api_base': 'https://dial.example', 'failures': 3, 'open': True, 'retry_in': 10.0}
+    ]
+
+
+def test_unhealthy_results_count_as_failures(breaker):
+    module, circuit_breaker, _ = breaker
+    key = circuit_breaker.key('https://dial.example', 'token')
+    for _ in range(3):
+        assert circuit_breaker.call(key, lambda: 'Connection timed out', is_healthy=lambda r: r is True) \
+            == 'Connection timed out'
+    with pytest.raises(module.CircuitOpen):
+        circuit_breaker.call(key, lambda: True, is_healthy=lambda r: r is True)
+
+
+def test_success_resets_failure_count(breaker):
+    _, circuit_breaker, clock = breaker
+    key = circuit_breaker.key('https://dial.example', 'token')
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            circuit_breaker.call(key, _fail)
+    circuit_breaker.call(key, lambda: True)
+    clock.now += circuit_breaker.healthy_ttl
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            circuit_breaker.call(key, _fail)
+    assert not circuit_breaker.stats()[0]['open']
+
+
+def test_half_open_probe_closes_circuit(breaker):
+    module, circuit_breaker, clock = breaker
+    key = circuit_breaker.key('https://dial.example', 'token')
+    _trip(circuit_breaker, key)
+    clock.now += 10
+    assert circuit_breaker.call(key, lambda: 'models') == 'models'
+    assert circuit_breaker.stats()[0]['failures'] == 0
+    # closed again: the next failure after the healthy TTL is passed through, not short-circuited
+    clock.now += circuit_breaker.healthy_ttl
+    with pytest.raises(TimeoutError):
+        circuit_breaker.call(key, _fail)
+    assert not circuit_breaker.stats()[0]['open']
+
+
+def test_failed_probe_backs_off(breaker):
+    module, circuit_breaker, clock = breaker
+    key = circuit_breaker.key('https://dial.example', 'token')
+    _trip(circuit_breaker, key)
+    for expected in (20, 40, 40):
+        clock.now += circuit_breaker.stats()[0]['retry_in']
+        with pytest.raises(TimeoutError):
+            circuit_breaker.call(key, _fail)
+        assert circuit_breaker.stats()[0]['retry_in'] == expected
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    module, circuit_breaker, clock = breaker
+    key = circuit_breaker.key('https://dial.example', 'token')
+    _trip(circuit_breaker, key)
+    clock.now += 10
+    started, finish = threading.Event(), threading.Event()
+
+    def _probe():
+        started.set()
+        finish.wait(5)
+        return True
+
+    probe = threading.Thread(target=circuit_breaker.call, args=(key, _probe))
+    probe.start()
+    started.wait(5)
+    with pytest.raises(module.CircuitOpen):
+        circuit_breaker.call(key, lambda: True)
+    finish.set()
+    probe.join(5)
+    assert not circuit_breaker.stats()[0]['open']
+
+
+def test_healthy_result_reused_within_ttl(breaker):
+    _, circuit_breaker, clock = breaker
+    key = circuit_breaker.key('https://dial.example', 'token', 'settings-hash')
+    calls = []
+
+    def _check():
+        calls.append(1)
+        return True
+
+    assert circuit_breaker.call(key, _check) is True
+    clock.now += 4
+    assert circuit_breaker.call(key, _check) is True
+    assert len(calls) == 1
+    clock.now += 2
+    circuit_breaker.call(key, _check)
+    assert len(calls) == 2
+    # other settings are checked on their own
+    circuit_breaker.call(circuit_breaker.key('https://dial.example', 'token', 'other'), _check)
+    assert len(calls) == 3
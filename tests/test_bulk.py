@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Bulk preparation: same prompts as the prepare_conversation_old loop, less tokenized """
+
+import random
+
+import pytest
+
+MODEL = 'gpt-4-0613'
+
+
+class CountingEncoding:
+    """ Encoding proxy that sums the characters it was asked to encode """
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self.special_tokens_set = encoding.special_tokens_set
+        self.chars = 0
+
+    def encode(self, text, **kwargs):
+        self.chars += len(text)
+        return self._encoding.encode(text, **kwargs)
+
+    def encode_ordinary(self, text):
+        self.chars += len(text)
+        return self._encoding.encode_ordinary(text)
+
+    def encode_batch(self, texts, **kwargs):
+        self.chars += sum(len(text) for text in texts)
+        return self._encoding.encode_batch(texts, **kwargs)
+
+
+@pytest.fixture
+def modules(plugin):
+    plugin('precount').static_token_counts.clear()
+    return plugin('utils'), plugin('bulk')
+
+
+def _prompt_structs(count: int, history: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    shared = [
+        {'context': 'You are a helpful assistant.', 'examples': [
+            {'input': f'question {n}?', 'output': f'answer {n}.'} for n in range(4)
+        ]},
+        {'context': 'Answer briefly. ' * 10, 'examples': []},
+    ]
+    prompt_structs = []
+    for idx in range(count):
+        chat_history = [
+            {'role': 'user' if n % 2 == 0 else 'assistant', 'content': 'word ' * rnd.randint(1, 60)}
+            for n in range(rnd.randint(0, history))
+        ]
+        if chat_history and idx % 7 == 0:
+            chat_history[-1]['content'] = None  # skipped by both paths
+        prompt_structs.append({
+            **shared[idx % 2],
+            'chat_history': chat_history,
+            'prompt': 'Tell me more ' * rnd.randint(1, 40 if idx % 11 else 400),
+        })
+    return prompt_structs
+
+
+@pytest.mark.parametrize('token_limit', [400, 1500, 8192])
+def test_bulk_matches_loop(modules, token_limit):
+    utils, bulk = modules
+    prompt_structs = _prompt_structs(200, 80)
+    expected = [
+        utils.prepare_conversation_old(prompt_struct, MODEL, 128, token_limit)
+        for prompt_struct in prompt_structs
+    ]
+    assert bulk.prepare_conversations_bulk(prompt_structs, MODEL, 128, token_limit) == expected
+
+
+def test_bulk_tokenizes_less_than_loop(modules, monkeypatch):
+    utils, bulk = modules
+    counting = CountingEncoding(utils.get_encoding(MODEL))
+    monkeypatch.setattr(utils, 'get_encoding', lambda model: counting)
+    prompt_structs = _prompt_structs(300, 200, seed=1)
+    #
+    expected = [
+        utils.prepare_conversation_old(prompt_struct, MODEL, 256, 4096) for prompt_struct in prompt_structs
+    ]
+    loop_chars, counting.chars = counting.chars, 0
+    utils.static_token_counts.clear()
+    result = bulk.prepare_conversations_bulk(prompt_structs, MODEL, 256, 4096)
+    #
+    assert result == expected
+    assert counting.chars < loop_chars
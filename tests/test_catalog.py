@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Model catalog: keys per API version, bounded entries """
+
+import pytest
+
+
+@pytest.fixture
+def catalog(plugin):
+    return plugin('catalog')
+
+
+def test_api_versions_are_cached_separately(catalog):
+    model_catalog = catalog.ModelCatalog()
+    old = model_catalog.key('https://dial/', 'token', '2023-05-15')
+    new = model_catalog.key('https://dial', 'token', '2024-02-01')
+    assert old != new
+    assert model_catalog.get(old, lambda: ['gpt-35-turbo']) == ['gpt-35-turbo']
+    assert model_catalog.get(new, lambda: ['gpt-4o']) == ['gpt-4o']
+    assert model_catalog.get(old, pytest.fail) == ['gpt-35-turbo']
+
+
+def test_least_recently_used_lists_are_dropped(catalog):
+    model_catalog = catalog.ModelCatalog(max_entries=2)
+    keys = [model_catalog.key(f'https://dial-{idx}', 'token', '2024-02-01') for idx in range(3)]
+    model_catalog.get(keys[0], lambda: ['a'])
+    model_catalog.get(keys[1], lambda: ['b'])
+    model_catalog.get(keys[0], pytest.fail)
+    model_catalog.get(keys[2], lambda: ['c'])
+    assert model_catalog.peek(keys[1]) is None
+    assert model_catalog.peek(keys[0]) == ['a']
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Client reuse hints: placed in the Helper kwargs only for workers that support them """
+
+import pytest
+
+
+@pytest.fixture
+def modules(plugin):
+    wire_format = plugin('descriptors').wire_format
+    yield plugin('client_keys'), wire_format
+    wire_format.forget('hinted', 'new')
+
+
+def _descriptor(routing_key=None) -> dict:
+    return {
+        "routing_key": routing_key,
+        "target": "plugins.ai_dial_worker.utils.ai.Helper",
+        "target_args": None,
+        "target_kwargs": {
+            "target_class": "langchain_openai.chat_models.azure.AzureChatOpenAI",
+            "target_args": None,
+            "target_kwargs": {"azure_endpoint": "https://dial", "api_key": "secret"},
+            "client_attr": "client._client",
+        },
+        "target_io_bound": True,
+        "method": "check_settings",
+        "method_args": None,
+        "method_kwargs": None,
+    }
+
+
+def test_hints_stay_out_of_helper_kwargs_without_support(modules):
+    client_keys, _ = modules
+    descriptor = client_keys.with_client_key(_descriptor())
+    assert "client" not in descriptor["target_kwargs"]
+    assert descriptor["client"]["fingerprint"] == client_keys.token_fingerprint("secret")
+
+
+def test_hints_in_helper_kwargs_for_advertising_workers(modules):
+    client_keys, wire_format = modules
+    wire_format.negotiate(['dict'], routing_key='hinted', worker='new', features=['client_key'])
+    descriptor = client_keys.with_client_key(_descriptor('hinted'))
+    assert "client" not in descriptor
+    assert descriptor["target_kwargs"]["client"]["key"]
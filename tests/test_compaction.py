@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" History compaction: summary insertion and fallback to plain dropping """
+
+import pytest
+
+MODEL = 'gpt-4'
+MAX_RESPONSE_TOKENS = 100
+TOKEN_LIMIT = 1200
+
+
+@pytest.fixture
+def utils(plugin):
+    module = plugin('utils')
+    plugin('compaction').summary_cache.clear()
+    return module
+
+
+def _conversation() -> dict:
+    return {
+        'context': [{'role': 'system', 'content': 'You are a helpful assistant.'}],
+        'examples': [],
+        'chat_history': [
+            {'role': 'user' if idx % 2 == 0 else 'assistant', 'content': f'message {idx} ' + 'x' * 80}
+            for idx in range(30)
+        ],
+        'input': [{'role': 'user', 'content': 'And now?'}],
+    }
+
+
+def _limit(utils, **options) -> tuple:
+    token_counts = {}
+    messages = utils.limit_conversation(
+        _conversation(), MODEL, MAX_RESPONSE_TOKENS, TOKEN_LIMIT, token_counts=token_counts, **options
+    )
+    return messages, token_counts['prompt_tokens']
+
+
+def _failing_summarize(previous_summary, messages):
+    raise RuntimeError('summary deployment is down')
+
+
+def test_failed_summary_keeps_history_without_compaction(utils):
+    plain, _ = _limit(utils)
+    compacted, _ = _limit(utils, summarize=_failing_summarize, summary_max_tokens=200)
+    assert compacted == plain
+
+
+def test_oversized_summary_keeps_history_without_compaction(utils):
+    plain, _ = _limit(utils)
+    compacted, _ = _limit(utils, summarize=lambda previous, messages: 'y' * 5000, summary_max_tokens=200)
+    assert compacted == plain
+
+
+def test_summary_replaces_dropped_history(utils):
+    plain, _ = _limit(utils)
+    compacted, prompt_tokens = _limit(
+        utils, summarize=lambda previous, messages: f'{len(messages)} earlier messages', summary_max_tokens=50
+    )
+    summary = compacted[1]
+    assert summary['role'] == 'system' and 'earlier messages' in summary['content']
+    # the newest messages are kept, the input stays last
+    assert compacted[-2:] == plain[-2:]
+    assert prompt_tokens == utils.num_tokens_from_messages(compacted, MODEL)
+    assert prompt_tokens + 3 <= TOKEN_LIMIT - MAX_RESPONSE_TOKENS
+
+
+def test_prompt_token_count_matches_result(utils):
+    messages, prompt_tokens = _limit(utils)
+    assert prompt_tokens == utils.num_tokens_from_messages(messages, MODEL)
+
+
+def test_summaries_are_cached_per_summary_model(plugin):
+    compaction = plugin('compaction')
+    cache = compaction.LRUCache(16)
+    messages = _conversation()['chat_history'][:6]
+    calls = []
+
+    def _summarizer(model):
+        def summarize(previous, new_messages):
+            calls.append(model)
+            return f'summary by {model}'
+        summarize.model = model
+        return summarize
+
+    cheap, large = _summarizer('gpt-35-turbo'), _summarizer('gpt-4')
+    assert compaction.summarize_history(messages, cheap, cache) == 'summary by gpt-35-turbo'
+    assert compaction.summarize_history(messages, large, cache) == 'summary by gpt-4'
+    assert compaction.summarize_history(messages, cheap, cache) == 'summary by gpt-35-turbo'
+    assert calls == ['gpt-35-turbo', 'gpt-4']
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Batched token counting: same counts as one by one, duplicates counted once """
+
+import pytest
+
+CHAT_MODEL = 'gpt-4-0613'
+LEGACY_MODEL = 'legacy-instruct'
+
+
+@pytest.fixture
+def modules(plugin):
+    return plugin('utils'), plugin('bulk')
+
+
+def _settings(model_name: str, chat_completion: bool) -> dict:
+    return {
+        'model_name': model_name,
+        'models': [{
+            'id': model_name, 'name': model_name, 'token_limit': 8192,
+            'capabilities': {'completion': not chat_completion, 'chat_completion': chat_completion},
+        }],
+    }
+
+
+MESSAGES = [
+    {'role': 'system', 'content': 'You are terse.'},
+    {'role': 'user', 'content': 'Summarize the report', 'name': 'alice'},
+]
+MULTIMODAL = [{'role': 'user', 'content': [
+    {'type': 'text', 'text': 'What is on'},
+    {'type': 'image_url', 'image_url': {'url': 'files/cat.png'}},
+    {'type': 'text', 'text': 'this picture?'},
+]}]
+
+
+def test_chat_model_counts(modules):
+    utils, bulk = modules
+    encoding = utils.get_encoding(CHAT_MODEL)
+    counts = bulk.count_tokens_batch(['plain text', MESSAGES, MULTIMODAL], _settings(CHAT_MODEL, True))
+    assert counts == [
+        len(encoding.encode('plain text')),
+        utils.num_tokens_from_messages(MESSAGES, CHAT_MODEL) + 3,
+        utils.num_tokens_from_messages(
+            [{'role': 'user', 'content': 'What is on\nthis picture?'}], CHAT_MODEL
+        ) + 3,
+    ]
+
+
+def test_legacy_completion_model_counts_prompt_text(modules):
+    utils, bulk = modules
+    encoding = utils.get_encoding(LEGACY_MODEL)
+    counts = bulk.count_tokens_batch(['plain text', MESSAGES], _settings(LEGACY_MODEL, False))
+    assert counts == [
+        len(encoding.encode('plain text')),
+        len(encoding.encode('System: You are terse.')) + len(encoding.encode('Human: Summarize the report')),
+    ]
+
+
+def test_duplicates_are_counted_once(modules, monkeypatch):
+    _, bulk = modules
+    encoded = []
+    encode_lengths = bulk.encode_lengths
+
+    def _recording(encoding, texts):
+        encoded.extend(texts)
+        return encode_lengths(encoding, texts)
+
+    monkeypatch.setattr(bulk, 'encode_lengths', _recording)
+    items = ['same text', MESSAGES, 'same text', [dict(message) for message in MESSAGES]]
+    counts = bulk.count_tokens_batch(items, _settings(CHAT_MODEL, True))
+    assert counts[0] == counts[2] and counts[1] == counts[3]
+    assert encoded.count('same text') == 1
+    assert encoded.count('Summarize the report') == 1
+
+
+def test_non_string_values_are_rejected(modules):
+    _, bulk = modules
+    with pytest.raises(TypeError):
+        bulk.count_tokens_batch([[{'role': 'user', 'content': 42}]], _settings(CHAT_MODEL, True))
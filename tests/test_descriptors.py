@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Descriptor wire format negotiation per routing key """
+
+import pytest
+
+
+@pytest.fixture
+def descriptors(plugin):
+    return plugin('descriptors')
+
+
+def _descriptor(routing_key=None) -> dict:
+    return {
+        "routing_key": routing_key,
+        "target": "plugins.ai_dial_worker.utils.ai.Helper",
+        "target_args": None,
+        "target_kwargs": {
+            "target_class": "langchain_openai.chat_models.azure.AzureChatOpenAI",
+            "target_args": None,
+            "target_kwargs": {"azure_endpoint": "https://dial", "api_version": "2024-02-01"},
+            "client_attr": "client._client",
+        },
+        "target_io_bound": True,
+        "method": "chat_invoke",
+        "method_args": None,
+        "method_kwargs": {"messages": []},
+    }
+
+
+def test_negotiating_and_legacy_workers_side_by_side(descriptors):
+    wire_format = descriptors.WireFormat()
+    assert wire_format.negotiate(['compact', 'dict'], routing_key='fast', worker='new-1') == 'compact'
+    #
+    packed = wire_format.pack(_descriptor('fast'))
+    assert isinstance(packed, list)
+    assert descriptors.unpack_descriptor(packed) == _descriptor('fast')
+    # the legacy worker never negotiated: its routing key keeps plain dicts
+    assert wire_format.pack(_descriptor('legacy')) == _descriptor('legacy')
+    assert wire_format.pack(_descriptor()) == _descriptor()
+
+
+def test_routing_key_uses_least_capable_worker(descriptors):
+    wire_format = descriptors.WireFormat()
+    wire_format.negotiate(['compact'], routing_key='shared', worker='new')
+    wire_format.negotiate([], routing_key='shared', worker='old')
+    assert wire_format.name('shared') == 'dict'
+    assert wire_format.pack(_descriptor('shared')) == _descriptor('shared')
+    #
+    wire_format.forget('shared', 'old')
+    assert wire_format.name('shared') == 'compact'
+
+
+def test_table_version_mismatch_falls_back_to_dict(descriptors):
+    wire_format = descriptors.WireFormat()
+    assert wire_format.negotiate(['compact'], descriptors.TABLE_VERSION + 1, 'fast', 'w') == 'dict'
+    assert wire_format.name('fast') == 'dict'
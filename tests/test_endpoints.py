@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" DIAL endpoint failover: which errors move on, health and ejection """
+
+import asyncio
+import itertools
+
+import httpx
+import openai
+import pytest
+
+_hosts = itertools.count()
+
+
+@pytest.fixture
+def endpoints(plugin):
+    return plugin('endpoints')
+
+
+@pytest.fixture
+def in_order(endpoints, monkeypatch):
+    """ Weighted draws return candidates in list order: failover order is deterministic """
+    monkeypatch.setattr(endpoints.random, 'choices', lambda population, weights=None, k=1: population[:k])
+
+
+def _urls(count: int) -> list:
+    """ Fresh URLs: the module-level pool remembers health per URL """
+    return [f'https://dial-{next(_hosts)}.test' for _ in range(count)]
+
+
+def _status_error(cls, status: int):
+    request = httpx.Request('POST', 'https://dial.test/openai/deployments/gpt-4/chat/completions')
+    return cls('upstream error', response=httpx.Response(status, request=request), body=None)
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'https://dial.test'))
+
+
+def _failover(endpoints, urls: list, errors: dict, exclude=()):
+    """ call_with_failover over urls, where errors[url] is raised by that endpoint """
+    tried = []
+
+    async def _call(api_base):
+        tried.append(api_base)
+        if api_base in errors:
+            raise errors[api_base]
+        return f'answer from {api_base}'
+
+    result = asyncio.run(endpoints.call_with_failover([(url, 1.0) for url in urls], _call, exclude))
+    return result, tried
+
+
+def test_connection_error_fails_over_and_counts_against_endpoint(endpoints, in_order):
+    down, up = _urls(2)
+    result, tried = _failover(endpoints, [down, up], {down: _connection_error()})
+    assert tried == [down, up]
+    assert result == f'answer from {up}'
+    assert endpoints.endpoint_pool._state(down).failures == 1  # pylint: disable=W0212
+    assert endpoints.endpoint_pool._state(up).outstanding == 0  # pylint: disable=W0212
+
+
+def test_rate_limit_moves_on_without_health_penalty(endpoints, in_order):
+    busy, idle = _urls(2)
+    error = _status_error(openai.RateLimitError, 429)
+    result, tried = _failover(endpoints, [busy, idle], {busy: error})
+    assert tried == [busy, idle]
+    assert result == f'answer from {idle}'
+    assert endpoints.endpoint_pool._state(busy).failures == 0  # pylint: disable=W0212
+
+
+def test_excluded_endpoints_are_not_tried(endpoints):
+    primary, other = _urls(2)
+    with pytest.raises(openai.APIConnectionError):
+        _failover(endpoints, [primary, other], {other: _connection_error()}, exclude=[primary])
+
+
+def test_client_error_is_not_retried(endpoints):
+    urls = _urls(3)
+    error = _status_error(openai.BadRequestError, 400)
+    with pytest.raises(openai.BadRequestError):
+        _failover(endpoints, urls, {url: error for url in urls})
+    assert all(endpoints.endpoint_pool._state(url).failures == 0 for url in urls)  # pylint: disable=W0212
+
+
+def test_every_endpoint_is_tried_once(endpoints):
+    urls = _urls(3)
+    with pytest.raises(openai.InternalServerError):
+        _failover(endpoints, urls, {url: _status_error(openai.InternalServerError, 502) for url in urls})
+    assert sorted(
+        url for url in urls if endpoints.endpoint_pool._state(url).failures == 1  # pylint: disable=W0212
+    ) == sorted(urls)
+
+
+def test_ejected_endpoint_is_skipped_until_it_comes_back(endpoints):
+    pool = endpoints.EndpointPool(failure_threshold=2, ejection_time=30)
+    flaky, stable = _urls(2)
+    for _ in range(2):
+        pool.acquire(flaky)
+        pool.release(flaky, ok=False)
+    assert not pool.is_healthy(flaky)
+    assert {pool.select([(flaky, 100.0), (stable, 1.0)]) for _ in range(50)} == {stable}
+    # with everything ejected the endpoint that returns first is probed
+    for _ in range(2):
+        pool.release(stable, ok=False)
+    assert pool.select([(flaky, 1.0), (stable, 1.0)]) == flaky
+    #
+    pool.release(flaky, ok=True)
+    assert pool._state(flaky).failures == 0  # pylint: disable=W0212
+
+
+def test_weight_only_selection_ignores_load(endpoints):
+    pool = endpoints.EndpointPool()
+    loaded, light = _urls(2)
+    for _ in range(100):
+        pool.acquire(loaded)
+    weighted = [(loaded, 1.0), (light, 1.0)]
+    # of two weighted draws the less loaded wins: only a double draw of loaded picks it
+    assert [pool.select(weighted) for _ in range(400)].count(light) > 250
+    assert [pool.select(weighted, by_load=False) for _ in range(400)].count(light) < 250
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Hedged requests: when the second call starts, which result wins, what is sampled """
+
+import asyncio
+import itertools
+
+import pytest
+
+_keys = itertools.count()
+
+
+@pytest.fixture
+def hedging(plugin):
+    return plugin('hedging')
+
+
+def _warm_key(hedging, latency: float = 0.01) -> str:
+    """ A fresh key with enough fast samples for a threshold """
+    key = f'model-{next(_keys)}'
+    for _ in range(hedging.latency_tracker.min_samples):
+        hedging.latency_tracker.record(key, latency)
+    return key
+
+
+def _call(result=None, delay: float = 0.0, error: Exception = None, calls: list = None):
+    async def _run():
+        if calls is not None:
+            calls.append(result)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return _run
+
+
+def _hedged(hedging, key, primary, secondary, **options):
+    options.setdefault('min_delay', 0.02)
+    return asyncio.run(hedging.hedged(key, primary, secondary, **options))
+
+
+def test_no_hedge_without_enough_samples(hedging):
+    calls = []
+    key = f'cold-{next(_keys)}'
+    result = _hedged(hedging, key, _call('primary', 0.05), _call('secondary', calls=calls))
+    assert result == 'primary'
+    assert not calls
+
+
+def test_slow_primary_is_hedged_and_cancelled(hedging):
+    key = _warm_key(hedging)
+    result = _hedged(hedging, key, _call('primary', 0.3), _call('secondary', 0.01))
+    assert result == 'secondary'
+    # the cancelled primary is still sampled, with the time it ran
+    latest = hedging.latency_tracker._samples[key][-1]  # pylint: disable=W0212
+    assert 0.02 <= latest < 0.3
+
+
+def test_fast_primary_is_not_hedged(hedging):
+    calls = []
+    key = _warm_key(hedging, latency=1.0)
+    assert _hedged(hedging, key, _call('primary', 0.01), _call('secondary', calls=calls)) == 'primary'
+    assert not calls
+
+
+def test_failed_hedge_falls_back_to_primary(hedging):
+    key = _warm_key(hedging)
+    secondary = _call(error=RuntimeError('secondary endpoint down'))
+    assert _hedged(hedging, key, _call('primary', 0.1), secondary) == 'primary'
+
+
+def test_both_failing_raise_primary_error(hedging):
+    key = _warm_key(hedging)
+    with pytest.raises(ValueError, match='primary'):
+        _hedged(
+            hedging, key, _call(delay=0.1, error=ValueError('primary')),
+            _call(delay=0.2, error=RuntimeError('secondary')),
+        )
+
+
+def test_budget_limits_hedges(hedging):
+    calls = []
+    key = _warm_key(hedging)
+    budget = hedging.get_budget(key, 0.0)
+    budget._credits = 1  # pylint: disable=W0212
+    for _ in range(3):
+        result = _hedged(
+            hedging, key, _call('primary', 0.1), _call('secondary', calls=calls), budget_ratio=0.0,
+        )
+    assert calls == ['secondary']
+    assert result == 'primary'
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Token quotas: budget checks, flushing, sink failures and period rollover """
+
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def quota(plugin):
+    return plugin('quota')
+
+
+def test_check_uses_flushed_usage(quota):
+    manager = quota.QuotaManager()
+    manager.set_limits(1, prompt_tokens=100, completion_tokens=50)
+    manager.record(1, 80, 10)
+    manager.check(1, 30, 10)  # not flushed yet: checks lag by one flush
+    manager.flush()
+    assert manager.usage(1)['prompt_tokens'] == 80
+    with pytest.raises(quota.QuotaExceeded, match='prompt'):
+        manager.check(1, 30, 10)
+    with pytest.raises(quota.QuotaExceeded, match='completion'):
+        manager.check(1, 10, 41)
+    manager.check(2, 10 ** 9, 10 ** 9)  # unlimited project
+
+
+def test_failed_sink_batch_is_sent_with_the_next_one(quota):
+    manager = quota.QuotaManager()
+    received = []
+
+    def _sink(records):
+        if not received:
+            received.append(None)
+            raise ConnectionError('storage is down')
+        received.append(records)
+
+    manager.sink = _sink
+    manager.record(1, 10, 1)
+    assert manager.flush() == [{'project_id': 1, 'period': manager.usage(1)['period'],
+                                'prompt_tokens': 10, 'completion_tokens': 1}]
+    manager.record(1, 5, 2)
+    manager.record(2, 7, 3)
+    manager.flush()
+    assert sorted(
+        (record['project_id'], record['prompt_tokens'], record['completion_tokens']) for record in received[1]
+    ) == [(1, 15, 3), (2, 7, 3)]
+    # nothing left to resend
+    manager.flush()
+    assert len(received) == 2
+
+
+def test_period_rollover_resets_usage(quota, monkeypatch):
+    manager = quota.QuotaManager()
+    manager.record(1, 10, 1)
+    manager.flush()
+    monkeypatch.setattr(quota, 'current_period', lambda period='month': '2999-01')
+    manager.record(1, 3, 1)
+    records = manager.flush()
+    assert manager.usage(1) == {
+        'period': '2999-01', 'prompt_tokens': 3, 'completion_tokens': 1,
+        'prompt_limit': None, 'completion_limit': None,
+    }
+    assert records[0]['period'] == '2999-01'
+
+
+def test_seeded_usage_is_not_lost_to_concurrent_flushes(quota):
+    manager = quota.QuotaManager()
+    stop = threading.Event()
+
+    def _flush():
+        while not stop.is_set():
+            manager.record('busy', 1, 1)
+            manager.flush()
+
+    flusher = threading.Thread(target=_flush)
+    flusher.start()
+    try:
+        for project_id in range(2000):
+            manager.set_used(project_id, project_id, 0)
+    finally:
+        stop.set()
+        flusher.join()
+    assert all(manager.usage(project_id)['prompt_tokens'] == project_id for project_id in range(2000))
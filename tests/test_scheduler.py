@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Scheduler priority, project fairness and admission control """
+
+import asyncio
+
+import pytest
+
+
+async def _grant_order(scheduler, requests: list, cost: int = 10) -> list:
+    """ (priority, project) of requests in the order slots were granted, one slot at a time """
+    blocker = await scheduler.acquire('interactive', 'blocker', cost)
+    order = []
+
+    async def _one(priority, project_id):
+        ticket = await scheduler.acquire(priority, project_id, cost, max_wait=None)
+        order.append((priority, project_id))
+        await asyncio.sleep(0)
+        scheduler.release(ticket)
+
+    tasks = [asyncio.ensure_future(_one(*request)) for request in requests]
+    await asyncio.sleep(0)
+    scheduler.release(blocker)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_classes_share_slots_by_weight(plugin):
+    scheduler = plugin('scheduler').Scheduler(concurrency=1)
+    requests = [('batch', 1)] * 20 + [('interactive', 1)] * 20
+    order = asyncio.run(_grant_order(scheduler, requests))
+    first = [priority for priority, _ in order[:20]]
+    # weights 8:2
+    assert 15 <= first.count('interactive') <= 17
+    assert first.count('batch') >= 3  # batch is not starved
+    assert len(order) == len(requests)
+
+
+def test_projects_share_class_equally(plugin):
+    scheduler = plugin('scheduler').Scheduler(concurrency=1)
+    requests = [('batch', 'noisy')] * 30 + [('batch', 'quiet')] * 5
+    order = asyncio.run(_grant_order(scheduler, requests))
+    assert [project for _, project in order[:10]].count('quiet') == 5
+
+
+def test_concurrency_limit(plugin):
+    scheduler = plugin('scheduler').Scheduler(concurrency=2)
+
+    async def _main():
+        first = await scheduler.acquire('interactive', 1)
+        await scheduler.acquire('interactive', 1)
+        third = asyncio.ensure_future(scheduler.acquire('interactive', 1))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        scheduler.release(first)
+        await asyncio.wait_for(third, 1)
+        assert scheduler.in_flight == 2
+
+    asyncio.run(_main())
+
+
+def test_low_priority_is_shed_without_headroom(plugin):
+    module = plugin('scheduler')
+    scheduler = module.Scheduler(concurrency=8, tpm_limit=1000)
+
+    async def _main():
+        await scheduler.acquire('interactive', 1, 700)
+        # interactive still fits, batch must leave 20% of the limit free
+        await scheduler.acquire('interactive', 1, 100)
+        with pytest.raises(module.SchedulerOverloaded):
+            await scheduler.acquire('batch', 1, 100, max_wait=0.05)
+
+    asyncio.run(_main())
+
+
+def test_unknown_priority(plugin):
+    scheduler = plugin('scheduler').Scheduler()
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.acquire('urgent'))
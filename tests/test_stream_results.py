@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Incremental stream results: DIAL delta merging and prepare_result shape """
+
+import pytest
+
+
+@pytest.fixture
+def streaming(plugin):
+    return plugin('streaming')
+
+
+def _chunk(content=None, **delta) -> dict:
+    return {'choices': [{'index': 0, 'delta': {'content': content, **delta}}]}
+
+
+def test_merge_delta_concatenates_and_merges_indexed_items(streaming):
+    target = {}
+    streaming.merge_delta(target, {'content': 'Hel', 'tool_calls': [
+        {'index': 0, 'id': 'call', 'function': {'name': 'lookup', 'arguments': '{"q": '}},
+    ]})
+    streaming.merge_delta(target, {'content': 'lo', 'refusal': None, 'tool_calls': [
+        {'index': 0, 'function': {'arguments': '"x"}'}},
+        {'index': 1, 'id': 'second'},
+    ]})
+    assert target == {
+        'content': 'Hello',
+        'tool_calls': [
+            {'index': 0, 'id': 'call', 'function': {'name': 'lookup', 'arguments': '{"q": "x"}'}},
+            {'index': 1, 'id': 'second'},
+        ],
+    }
+
+
+def test_formatter_result_matches_prepare_result(streaming, plugin):
+    utils = plugin('utils')
+    formatter = streaming.StreamResultFormatter()
+    attachment = {'type': 'image/png', 'url': 'files/cat.png', 'title': 'cat'}
+    for chunk in (
+            _chunk(role='assistant'),
+            _chunk('A cat'),
+            _chunk(' picture', custom_content={'attachments': [attachment], 'state': {'step': 1}}),
+    ):
+        formatter.feed(chunk)
+    assert formatter.result() == utils.prepare_result({'choices': [{'message': {
+        'content': 'A cat picture',
+        'custom_content': {'attachments': [attachment], 'state': {'step': 1}},
+    }}]})
+
+
+def test_tool_call_stream_has_no_empty_text(streaming):
+    formatter = streaming.StreamResultFormatter()
+    formatter.feed(_chunk(None, tool_calls=[{'index': 0, 'function': {'name': 'f', 'arguments': '{}'}}]))
+    formatter.feed(_chunk(''))
+    assert formatter.result() == {'messages': []}
+
+
+def test_batch_feed_equals_chunk_by_chunk(streaming):
+    chunks = [_chunk(f'part {idx} ') for idx in range(50)]
+    one_by_one = streaming.StreamResultRegistry()
+    for chunk in chunks:
+        partial = one_by_one.feed('one', chunk)
+    batched = streaming.StreamResultRegistry()
+    assert batched.feed('batch', chunks[:20]) == {'messages': [
+        {'type': 'text', 'content': ''.join(f'part {idx} ' for idx in range(20))},
+    ]}
+    assert batched.feed('batch', chunks[20:]) == partial
+    assert batched.finish('batch') == one_by_one.finish('one') == partial
+    assert batched.finish('batch') is None
+
+
+def test_batched_usage_feed_emits_once_per_crossed_interval(streaming):
+    registry = streaming.StreamUsageRegistry(emit_every=4)
+    emitted = []
+    registry.emit = emitted.append
+    registry.start('usage', 'gpt-4-0613')
+    registry.feed('usage', [_chunk('word ')] * 3)
+    assert not emitted
+    registry.feed('usage', [_chunk('word ')] * 6)
+    assert len(emitted) == 1
+    assert registry.finish('usage')['completion_tokens'] == 9 * len('word ')
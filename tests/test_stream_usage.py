@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Stream usage: incremental completion counting and lazy prompt counting """
+
+import pytest
+
+MODEL = 'gpt-4-0613'
+
+
+@pytest.fixture
+def streaming(plugin):
+    return plugin('streaming')
+
+
+def _chunk(text: str) -> dict:
+    return {'choices': [{'index': 0, 'delta': {'content': text}}]}
+
+
+def test_completion_tokens_match_whole_text(streaming):
+    text = 'The quick brown fox\njumps over the lazy dog. ' * 20
+    counter = streaming.StreamTokenCounter(MODEL)
+    for start in range(0, len(text), 7):
+        counter.feed_chunk(_chunk(text[start:start + 7]))
+    totals = counter.finish()
+    # stub encodings are byte-level: the whole text encodes to one token per byte
+    assert totals['completion_tokens'] == len(text.encode('utf-8'))
+    assert totals['final'] and not totals['exact']
+
+
+def test_prompt_is_counted_on_first_chunk_not_at_start(streaming, monkeypatch):
+    calls = []
+
+    def _count(model, messages=None, text=None):
+        calls.append(messages)
+        return 42
+
+    monkeypatch.setattr(streaming, 'count_prompt_tokens', _count)
+    messages = [{'role': 'user', 'content': 'hello'}]
+    streaming.start_stream_usage('lazy-prompt', MODEL, messages=messages)
+    assert not calls
+    #
+    totals = streaming.stream_usage.feed('lazy-prompt', _chunk('Hi '))
+    streaming.stream_usage.feed('lazy-prompt', _chunk('there '))
+    assert calls == [messages]
+    assert totals['prompt_tokens'] == 42
+
+
+def test_reported_usage_replaces_estimate_and_skips_prompt(streaming, monkeypatch):
+    monkeypatch.setattr(streaming, 'count_prompt_tokens', pytest.fail)
+    counter = streaming.StreamTokenCounter(MODEL, prompt=([{'role': 'user', 'content': 'x'}], None))
+    counter.set_usage({'prompt_tokens': 10, 'completion_tokens': 5})
+    counter.feed_chunk(_chunk('ignored once usage is exact'))
+    assert counter.finish() == {
+        'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15, 'exact': True, 'final': True,
+    }
+
+
+def test_running_totals_are_emitted_every_n_chunks(streaming):
+    registry = streaming.StreamUsageRegistry(emit_every=3)
+    emitted = []
+    registry.emit = emitted.append
+    registry.start('emitting', MODEL)
+    for _ in range(7):
+        registry.feed('emitting', _chunk('word '))
+    registry.finish('emitting')
+    assert [item['final'] for item in emitted] == [False, False, True]
+    assert emitted[-1]['completion_tokens'] == 7 * len('word ')
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Encoding bundle: .bpe round trip, encoding spec taken from the installed tiktoken """
+
+import pytest
+import tiktoken_ext.openai_public
+
+
+@pytest.fixture
+def bundle(plugin):
+    return plugin('tokenizer_bundle')
+
+
+def test_bpe_file_round_trip(bundle, tmp_path):
+    ranks = {bytes([idx]): idx for idx in range(256)}
+    ranks.update({b'hello': 256, b' world': 257, 'été'.encode('utf-8'): 258})
+    bundle.build_bpe_file(ranks, tmp_path / 'test.bpe')
+    assert bundle.read_bpe_file(tmp_path / 'test.bpe') == ranks
+
+
+@pytest.mark.parametrize('name', ['cl100k_base', 'o200k_base'])
+def test_spec_matches_installed_tiktoken(bundle, monkeypatch, name):
+    ranks = {bytes([idx]): idx for idx in range(256)}
+    spec = bundle.encoding_spec(name, ranks)
+    assert spec['mergeable_ranks'] is ranks
+    # the module-level loader was not replaced while building the spec
+    assert tiktoken_ext.openai_public.load_tiktoken_bpe.__module__ == 'tiktoken.load'
+    #
+    monkeypatch.setattr(tiktoken_ext.openai_public, 'load_tiktoken_bpe', lambda *args, **kwargs: ranks)
+    expected = tiktoken_ext.openai_public.ENCODING_CONSTRUCTORS[name]()
+    assert spec['pat_str'] == expected['pat_str']
+    assert spec['special_tokens'] == expected['special_tokens']
+
+
+def test_unknown_encoding_has_no_spec(bundle):
+    assert bundle.encoding_spec('no_such_encoding', {}) is None
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Token limits: static defaults and limits reported by DIAL model listings """
+
+from typing import NamedTuple, Optional
+
+
+TOKEN_LIMITS = {
+    'text-embedding-ada-002': None,
+    'gpt-35-turbo': 4096,
+    'gpt-35-turbo-16k': 16384,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'chat-bison@001': 8192,
+    'ai21.j2-grande-instruct': 8191,
+    'ai21.j2-jumbo-instruct': 8191,
+    'anthropic.claude-instant-v1': 100000,
+    'anthropic.claude-v1': 100000,
+    'anthropic.claude-v2': 100000,
+    'stability.stable-diffusion-xl': 77
+}
+
+
+class ModelLimits(NamedTuple):
+    context_window: Optional[int]
+    max_output: Optional[int]
+
+
+def _positive_int(value) -> Optional[int]:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def parse_limits(model: dict) -> Optional[ModelLimits]:
+    """
+        Limits of one /openai/models (deployments) item
+
+        DIAL reports them as limits.max_total_tokens / max_prompt_tokens /
+        max_completion_tokens; flat context_window / max_output_tokens are accepted too
+    """
+    limits = model.get('limits') or {}
+    total = _positive_int(limits.get('max_total_tokens') or model.get('context_window'))
+    prompt = _positive_int(limits.get('max_prompt_tokens'))
+    completion = _positive_int(
+        limits.get('max_completion_tokens') or model.get('max_output_tokens')
+    )
+    if total is None and prompt is not None:
+        total = prompt + completion if completion is not None else prompt
+    if total is None and completion is None:
+        return None
+    return ModelLimits(total, completion)
+
+
+class TokenLimitTable:
+    """ (api_base, model id) -> ModelLimits, filled on every model listing """
+
+    def __init__(self):
+        self._items = {}
+
+    @staticmethod
+    def _key(api_base: str, model_id: str) -> tuple:
+        return (api_base or '').rstrip('/'), model_id
+
+    def ingest(self, api_base: str, models: list) -> dict:
+        """ Store limits found in raw models, return {model id: ModelLimits} """
+        found = {}
+        for model in models:
+            limits = parse_limits(model)
+            if limits is not None and model.get('id'):
+                found[model['id']] = limits
+        # single dict.update keeps readers lock-free
+        self._items.update({self._key(api_base, model_id): limits for model_id, limits in found.items()})
+        return found
+
+    def get(self, api_base: str, model_id: str) -> Optional[ModelLimits]:
+        return self._items.get(self._key(api_base, model_id))
+
+    def context_window(self, api_base: str, model_id: str) -> Optional[int]:
+        limits = self.get(api_base, model_id)
+        return limits.context_window if limits else None
+
+    def max_output(self, api_base: str, model_id: str) -> Optional[int]:
+        limits = self.get(api_base, model_id)
+        return limits.max_output if limits else None
+
+
+token_limit_table = TokenLimitTable()
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+#   Copyright 2024 EPAM Systems
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Local tiktoken encoding bundle
+
+    The bundle directory (plugin config encodings_dir or AI_DIAL_ENCODINGS_DIR)
+    may hold, per encoding:
+        <name>.bpe      - pre-parsed ranks (see build_bpe_file)
+        <name>.tiktoken - regular tiktoken rank file (base64 lines)
+    Encodings found there are never downloaded. Everything else about an
+    encoding (split pattern, special tokens) comes from the installed tiktoken.
+
+    .bpe layout (little-endian): magic, uint32 count, uint32 offsets[count + 1],
+    uint32 ranks[count], token bytes. Loading it skips base64 decoding and
+    line parsing, so it saves load time, not memory: every process still
+    builds its own rank dict and tiktoken table from it.
+"""
+
+import base64
+import mmap
+import os
+import struct
+import threading
+import types
+from pathlib import Path
+from typing import Optional
+
+from pylon.core.tools import log  # pylint: disable=E0611,E0401
+
+
+BPE_MAGIC = b'AIDBPE1\x00'
+
+BUNDLED_ENCODINGS = ('cl100k_base', 'o200k_base')
+
+_bundle_dir: Optional[Path] = None
+_encodings = {}
+_lock = threading.Lock()
+
+
+def configure(bundle_dir: Optional[str]) -> None:
+    global _bundle_dir  # pylint: disable=W0603
+    bundle_dir = bundle_dir or os.environ.get('AI_DIAL_ENCODINGS_DIR')
+    _bundle_dir = Path(bundle_dir) if bundle_dir else None
+    if _bundle_dir is not None:
+        log.info('Using tiktoken encoding bundle from %s', _bundle_dir)
+
+
+def read_tiktoken_file(path: Path) -> dict:
+    ranks = {}
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+    return ranks
+
+
+def build_bpe_file(ranks: dict, path: Path) -> None:
+    """ Write ranks ({token bytes: rank}) in the memory-mappable .bpe layout """
+    items = sorted(ranks.items(), key=lambda item: item[1])
+    offsets = [0]
+    for token, _ in items:
+        offsets.append(offsets[-1] + len(token))
+    with open(path, 'wb') as file:
+        file.write(BPE_MAGIC)
+        file.write(struct.pack('<I', len(items)))
+        file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        file.write(struct.pack(f'<{len(items)}I', *(rank for _, rank in items)))
+        for token, _ in items:
+            file.write(token)
+
+
+def read_bpe_file(path: Path) -> dict:
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(BPE_MAGIC)] != BPE_MAGIC:
+                raise ValueError(f'{path} is not a .bpe encoding file')
+            position = len(BPE_MAGIC)
+            count, = struct.unpack_from('<I', data, position)
+            position += 4
+            offsets = struct.unpack_from(f'<{count + 1}I', data, position)
+            position += 4 * (count + 1)
+            ranks = struct.unpack_from(f'<{count}I', data, position)
+            position += 4 * count
+            return {
+                data[position + offsets[idx]:position + offsets[idx + 1]]: ranks[idx]
+                for idx in range(count)
+            }
+
+
+def _find_ranks(name: str) -> Optional[dict]:
+    if _bundle_dir is None:
+        return None
+    for suffix, reader in (('.bpe', read_bpe_file), ('.tiktoken', read_tiktoken_file)):
+        path = _bundle_dir / f'{name}{suffix}'
+        if path.is_file():
+            return reader(path)
+    return None
+
+
+def encoding_spec(name: str, ranks: dict) -> Optional[dict]:
+    """
+        tiktoken.Encoding arguments of the installed tiktoken for name, with
+        ranks from the bundle instead of a download. None for unknown names.
+    """
+    from tiktoken import registry  # pylint: disable=C0415
+    if name not in registry.list_encoding_names():
+        return None
+    constructor = registry.ENCODING_CONSTRUCTORS[name]
+    # Constructors load their ranks through module-level helpers: run copies
+    # of them whose helpers return the bundled ranks, the originals are untouched
+    namespace = dict(constructor.__globals__)
+    namespace['load_tiktoken_bpe'] = namespace['data_gym_to_mergeable_bpe_ranks'] = \
+        lambda *args, **kwargs: ranks
+    for key, value in list(namespace.items()):
+        if isinstance(value, types.FunctionType) and value.__globals__ is constructor.__globals__:
+            namespace[key] = types.FunctionType(
+                value.__code__, namespace, value.__name__, value.__defaults__, value.__closure__
+            )
+    return namespace[constructor.__name__]()
+
+
+def load_bundled_encoding(name: str):
+    """ tiktoken.Encoding from the bundle, None when not bundled """
+    encoding = _encodings.get(name)
+    if encoding is not None or _bundle_dir is None:
+        return encoding
+    with _lock:
+        encoding = _encodings.get(name)
+        if encoding is None:
+            ranks = _find_ranks(name)
+            if ranks is None:
+                return None
+            spec = encoding_spec(name, ranks)
+            if spec is None:
+                log.warning('Bundled encoding %s is unknown to the installed tiktoken', name)
+                return None
+            import tiktoken  # pylint: disable=C0415
+            encoding = tiktoken.Encoding(**spec)
+            _encodings[name] = encoding
+    return encoding
+
+
+configure(None)
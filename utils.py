@@ -1,8 +1,20 @@
-# FIXME: ChatCompletion is not adapted for openai > 1.0.0
-
+import asyncio
 from collections import deque
-from openai import ChatCompletion
-import tiktoken
+from collections.abc import Sequence
+from functools import lru_cache, partial
+from typing import Callable, Iterable, Optional
+from .adaptive import completion_lengths, continuation_messages, merge_usage, prompt_key, reserve_tokens
+from .aio import get_async_client, run_sync
+from .endpoints import call_with_failover
+from .hedging import hedged
+from .tokenizer_bundle import load_bundled_encoding
+from .compaction import build_summary_messages, make_summary_message
+from .example_selection import select_examples
+from .precount import static_token_counts
+from .profiling import RequestProfile, profiler, stage
+from .quota import quota_manager
+from .scheduler import estimate_cost, scheduler
+from .semantic_cache import cache_scope, semantic_cache
 from .models.integration_pd import IntegrationModel
 from .models.request_body import ChatCompletionRequestBody
 
@@ -28,15 +40,59 @@ def init_openai(settings, project_id):
     }
 
 
-def num_tokens_from_messages(messages: list, model: str) -> int:
-    """Return the number of tokens used by a list of messages.
-    See: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
+async def call_upstream(
+        settings: IntegrationModel, init_settings: dict, call: Callable, exclude: tuple = (),
+        on_endpoint: Optional[Callable[[str], None]] = None, priority: str = 'interactive',
+        project_id: Optional[int] = None, cost: int = 0
+):
+    """
+        Await call(client) on a balanced endpoint, failing over to the others.
+        on_endpoint(api_base) is called for every endpoint tried.
     """
+    async def _call(api_base):
+        if on_endpoint is not None:
+            on_endpoint(api_base)
+        return await call(
+            get_async_client(api_base, init_settings['api_version'], init_settings['api_key'])
+        )
+    ticket = await scheduler.acquire(priority, project_id, cost)
+    try:
+        return await call_with_failover(settings.endpoints(), _call, exclude=exclude)
+    finally:
+        scheduler.release(ticket)
+
+
+def load_encoding(name: str):
+    """ Encoding from the local bundle when present, tiktoken (download) otherwise """
+    encoding = load_bundled_encoding(name)
+    if encoding is not None:
+        return encoding
+    import tiktoken  # heavy: loaded on first use
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=64)
+def get_encoding(model: str):
+    from tiktoken.model import encoding_name_for_model  # pylint: disable=C0415
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        name = encoding_name_for_model(model)
     except KeyError:
         log.warning("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        name = "cl100k_base"
+    return load_encoding(name)
+
+
+def preload_encodings(names: Iterable[str]) -> None:
+    """ Download/parse tiktoken encodings ahead of the first request """
+    for name in names:
+        try:
+            load_encoding(name)
+        except Exception as e:  # pylint: disable=W0703
+            log.warning('Failed to preload tiktoken encoding %s: %s', name, e)
+
+
+def message_token_params(model: str) -> tuple:
+    """ (encoding, tokens_per_message, tokens_per_name) of a model """
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -52,13 +108,21 @@ def num_tokens_from_messages(messages: list, model: str) -> int:
         tokens_per_name = -1  # if there's a name, the role is omitted
     elif "gpt-3.5-turbo" in model:
         log.warning("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
+        return message_token_params("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
         log.warning("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
+        return message_token_params("gpt-4-0613")
     else:
         tokens_per_message = 4
         tokens_per_name = -1
+    return get_encoding(model), tokens_per_message, tokens_per_name
+
+
+def num_tokens_from_messages(messages: list, model: str) -> int:
+    """Return the number of tokens used by a list of messages.
+    See: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
+    """
+    encoding, tokens_per_message, tokens_per_name = message_token_params(model)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
@@ -71,14 +135,56 @@ def num_tokens_from_messages(messages: list, model: str) -> int:
     return num_tokens
 
 
+def token_count_model(settings: dict) -> tuple:
+    """ (model name, is legacy completion model) that token counts of an integration use """
+    model_name = settings["model_name"]
+    legacy_completion = any(
+        model_data["name"] == model_name and not model_data["capabilities"]["chat_completion"]
+        for model_data in settings.get("models") or []
+    )
+    return model_name, legacy_completion
+
+
+def count_static_tokens(messages: list, model: str) -> int:
+    """ num_tokens_from_messages for context/examples, served from precounted parts """
+    return static_token_counts.count(messages, model, num_tokens_from_messages)
+
+
+def precount_static_parts(prompt: dict | list, models: Iterable[str]) -> dict:
+    """ Warm token counts of context/examples of a prompt struct or message list """
+    if isinstance(prompt, dict):
+        conversation = build_conversation(prompt, with_history=False)
+    else:
+        conversation = {
+            'context': [m for m in prompt if m['role'] == 'system' and not m.get('name')],
+            'examples': [m for m in prompt if m.get('name') in ('example_user', 'example_assistant')],
+        }
+    return static_token_counts.precount(
+        conversation['context'] + conversation['examples'], models, num_tokens_from_messages
+    )
+
+
 def limit_conversation(
-        conversation: dict, model_name: str, max_response_tokens: int, token_limit: int
+        conversation: dict, model_name: str, max_response_tokens: int, token_limit: int,
+        summarize: Optional[Callable] = None, summary_max_tokens: int = 256,
+        example_selection: str = 'ordered', embed: Optional[Callable] = None,
+        embedding_model: Optional[str] = None, stable_prefix: bool = False,
+        stable_prefix_reserve: int = 1024, token_counts: Optional[dict] = None
 ) -> list:
+    """
+        Fit the conversation into token_limit. When token_counts is given, its
+        'prompt_tokens' is set to num_tokens_from_messages of the result.
+    """
     limited_conversation = []
     remaining_tokens = token_limit - max_response_tokens
     remaining_tokens -= 3  # every reply is primed with <|start|>assistant<|message|>
 
-    context_tokens = num_tokens_from_messages(conversation['context'], model_name)
+    def _counted(messages: list, remaining: int) -> list:
+        if token_counts is not None:
+            token_counts['prompt_tokens'] = token_limit - max_response_tokens - 3 - remaining
+        return messages
+
+    context_tokens = count_static_tokens(conversation['context'], model_name)
     remaining_tokens -= context_tokens
 
     if remaining_tokens < 0:
@@ -89,46 +195,217 @@ def limit_conversation(
 
     limited_conversation.extend(conversation['context'])
 
+    if stable_prefix:
+        prefix = _stable_prefix(
+            conversation, limited_conversation, remaining_tokens, model_name,
+            example_selection, stable_prefix_reserve
+        )
+        if prefix is not None:
+            return _counted(*_limit_history(conversation, *prefix, model_name, summarize, summary_max_tokens))
+
     input_tokens = num_tokens_from_messages(conversation['input'], model_name)
     remaining_tokens -= input_tokens
     if remaining_tokens < 0:
-        return limited_conversation
+        return _counted(limited_conversation, remaining_tokens + input_tokens)
+
+    if example_selection != 'ordered':
+        final_examples, remaining_tokens = select_examples(
+            conversation['examples'], model_name, remaining_tokens, count_static_tokens,
+            strategy=example_selection,
+            query='\n'.join(str(message.get('content') or '') for message in conversation['input']),
+            embed=embed, embedding_model=embedding_model,
+        )
+        return _counted(*_limit_history(
+            conversation, limited_conversation + final_examples, remaining_tokens,
+            model_name, summarize, summary_max_tokens
+        ))
 
     final_examples = []
+    final_example_tokens = []
     for example in conversation['examples']:
         try:
-            example_tokens = num_tokens_from_messages([example], model_name)
+            example_tokens = count_static_tokens([example], model_name)
             remaining_tokens -= example_tokens
             if remaining_tokens < 0:
+                remaining_tokens += example_tokens
                 if len(final_examples) % 2:
                     final_examples.pop()  # remove incomplete example if present
-                return limited_conversation + final_examples + conversation['input']
+                    remaining_tokens += final_example_tokens.pop()
+                return _counted(limited_conversation + final_examples + conversation['input'], remaining_tokens)
             final_examples.append(example)
+            final_example_tokens.append(example_tokens)
         except TypeError:
             ...
 
     limited_conversation.extend(final_examples)
 
+    return _counted(*_limit_history(
+        conversation, limited_conversation, remaining_tokens,
+        model_name, summarize, summary_max_tokens
+    ))
+
+
+def _stable_prefix(
+        conversation: dict, limited_conversation: list, remaining_tokens: int, model_name: str,
+        example_selection: str, reserve: int
+) -> Optional[tuple]:
+    """
+        Context + examples chosen from static data only, so the prefix stays
+        byte-identical between turns and upstream prompt caching can reuse it.
+        None when the input does not fit after such prefix.
+    """
+    examples_budget = max(0, remaining_tokens - reserve)
+    final_examples, examples_left = select_examples(
+        conversation['examples'], model_name, examples_budget, count_static_tokens,
+        strategy='count' if example_selection == 'count' else 'ordered',
+    )
+    remaining_tokens -= examples_budget - examples_left
+    remaining_tokens -= num_tokens_from_messages(conversation['input'], model_name)
+    if remaining_tokens < 0:
+        return None
+    return limited_conversation + final_examples, remaining_tokens
+
+
+def _limit_history(
+        conversation: dict, limited_conversation: list, remaining_tokens: int,
+        model_name: str, summarize: Optional[Callable], summary_max_tokens: int
+) -> tuple:
+    """ (limited conversation, remaining tokens) """
+    chat_history = conversation['chat_history']
     final_history = deque()
-    for message in reversed(conversation['chat_history']):
+    final_indexes = deque()
+    for idx in range(len(chat_history) - 1, -1, -1):
+        message = chat_history[idx]
         try:
             message_tokens = num_tokens_from_messages([message], model_name)
-            remaining_tokens -= message_tokens
-            if remaining_tokens < 0:
-                return limited_conversation + list(final_history) + conversation['input']
-            final_history.appendleft(message)
         except TypeError:
-            ...
+            continue
+        if message_tokens > remaining_tokens:
+            if summarize is not None:
+                final_history, remaining_tokens = compact_history(
+                    chat_history, final_history, final_indexes, remaining_tokens,
+                    model_name, summarize, summary_max_tokens
+                )
+            return limited_conversation + list(final_history) + conversation['input'], remaining_tokens
+        remaining_tokens -= message_tokens
+        final_history.appendleft(message)
+        final_indexes.appendleft(idx)
     limited_conversation.extend(final_history)
 
     limited_conversation.extend(conversation['input'])
-    return limited_conversation
+    return limited_conversation, remaining_tokens
 
 
-def prepare_conversation_old(
-        prompt_struct: dict, model_name: str, max_response_tokens: int, token_limit: int,
-        check_limits: bool = True
-) -> list:
+def compact_history(
+        chat_history: list, final_history: deque, final_indexes: deque, remaining_tokens: int,
+        model_name: str, summarize: Callable, summary_max_tokens: int
+) -> tuple:
+    """
+        Replace history that did not fit with a rolling summary of it, returns
+        (history, remaining tokens). final_history and remaining_tokens are
+        returned unchanged when no summary is inserted.
+    """
+    summary_budget = summary_max_tokens + num_tokens_from_messages(
+        [{"role": "system", "content": ""}], model_name
+    )
+    kept_history = deque(final_history)
+    kept_indexes = deque(final_indexes)
+    kept_remaining = remaining_tokens
+    while kept_history and kept_remaining < summary_budget:
+        kept_remaining += num_tokens_from_messages([kept_history.popleft()], model_name)
+        kept_indexes.popleft()
+    #
+    dropped_count = kept_indexes[0] if kept_indexes else len(chat_history)
+    summary_message = make_summary_message(chat_history[:dropped_count], summarize)
+    if summary_message is None:
+        return final_history, remaining_tokens
+    summary_tokens = num_tokens_from_messages([summary_message], model_name)
+    if summary_tokens > kept_remaining:
+        log.warning('History summary does not fit into the token limit, skipping it')
+        return final_history, remaining_tokens
+    kept_history.appendleft(summary_message)
+    return kept_history, kept_remaining - summary_tokens
+
+
+def make_embedder(settings: IntegrationModel, init_settings: dict) -> Callable:
+    """ Embed callable backed by the embeddings deployment """
+    def embed(texts: list) -> list:
+        response = run_sync(call_upstream(
+            settings, init_settings, lambda client: client.embeddings.create(
+                model=settings.embedding_model_name,
+                input=texts,
+            )
+        ))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return embed
+
+
+def limit_kwargs(settings: IntegrationModel, init_settings: dict) -> dict:
+    """ Optional limit_conversation features enabled in integration settings """
+    kwargs = {
+        'summary_max_tokens': settings.summary_max_tokens,
+        'example_selection': settings.example_selection,
+        'embedding_model': settings.embedding_model_name,
+        'stable_prefix': settings.stable_prefix,
+        'stable_prefix_reserve': settings.stable_prefix_reserve,
+    }
+    if settings.history_compaction:
+        kwargs['summarize'] = make_history_summarizer(settings, init_settings)
+    if settings.example_selection == 'relevance' and settings.embedding_model_name:
+        kwargs['embed'] = make_embedder(settings, init_settings)
+    return kwargs
+
+
+def make_history_summarizer(settings: IntegrationModel, init_settings: dict) -> Callable:
+    """ Summarize callable backed by the (cheap) summary deployment """
+    model = settings.summary_model_name or settings.model_name
+
+    def summarize(previous_summary: Optional[str], messages: list) -> str:
+        response = run_sync(call_upstream(
+            settings, init_settings, lambda client: client.chat.completions.create(
+                model=model,
+                temperature=0,
+                max_tokens=settings.summary_max_tokens,
+                messages=build_summary_messages(previous_summary, messages),
+            )
+        ))
+        return response.choices[0].message.content
+    summarize.model = model  # summaries are cached per summarizing deployment
+    return summarize
+
+
+def format_history_message(message: dict) -> dict:
+    formatted_message = {
+        "role": "user" if message['role'] == 'user' else "assistant",
+        "content": message['content']
+    }
+    if 'custom_content' in message:
+        formatted_message['custom_content'] = message['custom_content']
+    # if 'name' in message:
+    #     formatted_message['name'] = message['name']
+    return formatted_message
+
+
+class HistoryView(Sequence):
+    """
+        Legacy chat_history formatted on access: limiting walks it newest-first
+        and stops at the budget, so only messages that are sent get built
+    """
+
+    def __init__(self, chat_history: list):
+        self._chat_history = chat_history
+
+    def __len__(self):
+        return len(self._chat_history)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [format_history_message(message) for message in self._chat_history[idx]]
+        return format_history_message(self._chat_history[idx])
+
+
+def build_conversation(prompt_struct: dict, with_history: bool = True) -> dict:
+    """ Legacy prompt struct to context/examples/chat_history/input messages """
     conversation = {
         'context': [],
         'examples': [],
@@ -154,17 +431,9 @@ def prepare_conversation_old(
                     "name": "example_assistant",
                     "content": example['output']
                 })
-    if prompt_struct.get('chat_history'):
+    if with_history and prompt_struct.get('chat_history'):
         for message in prompt_struct['chat_history']:
-            formatted_message = {
-                "role": "user" if message['role'] == 'user' else "assistant",
-                "content": message['content']
-            }
-            if 'custom_content' in message:
-                formatted_message['custom_content'] = message['custom_content']
-            # if 'name' in message:
-            #     formatted_message['name'] = message['name']
-            conversation['chat_history'].append(formatted_message)
+            conversation['chat_history'].append(format_history_message(message))
 
     if prompt_struct.get('prompt'):
         conversation['input'].append({
@@ -172,6 +441,19 @@ def prepare_conversation_old(
             "content": prompt_struct['prompt']
         })
 
+    return conversation
+
+
+def prepare_conversation_old(
+        prompt_struct: dict, model_name: str, max_response_tokens: int, token_limit: int,
+        check_limits: bool = True, **limit_options
+) -> list:
+    if check_limits:
+        conversation = build_conversation(prompt_struct, with_history=False)
+        conversation['chat_history'] = HistoryView(prompt_struct.get('chat_history') or [])
+    else:
+        conversation = build_conversation(prompt_struct)
+
     # conversation = context + examples + chat_history + input_
 
     # conv_history_tokens = num_tokens_from_messages(conversation, model_name)
@@ -185,12 +467,17 @@ def prepare_conversation_old(
     #     conv_history_tokens = num_tokens_from_messages(conversation, model_name)
 
     if check_limits:
-        return limit_conversation(conversation, model_name, max_response_tokens, token_limit)
+        return limit_conversation(
+            conversation, model_name, max_response_tokens, token_limit, **limit_options
+        )
 
     return conversation['context'] + conversation['examples'] + conversation['chat_history'] + conversation['input']
 
 
-def limit_messages(messages: list, model_name: str, max_response_tokens: int, token_limit: int) -> list:
+def limit_messages(
+        messages: list, model_name: str, max_response_tokens: int, token_limit: int,
+        **limit_options
+) -> list:
     conversation = {
         'context': [],
         'examples': [],
@@ -209,7 +496,58 @@ def limit_messages(messages: list, model_name: str, max_response_tokens: int, to
     if messages[-1]['role'] == 'user':
         conversation['input'].append(messages[-1])
 
-    return limit_conversation(conversation, model_name, max_response_tokens, token_limit)
+    return limit_conversation(
+        conversation, model_name, max_response_tokens, token_limit, **limit_options
+    )
+
+
+def extract_usage(response: dict) -> Optional[dict]:
+    """ Token usage of a completion response, including prompt-cache hits """
+    usage = response.get('usage')
+    if not usage:
+        return None
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'cached_tokens': details.get('cached_tokens') or usage.get('cached_tokens') or 0,
+    }
+
+
+def check_quota(project_id: int, messages: list, model_name: str, max_tokens: int,
+                prompt_tokens: Optional[int] = None) -> None:
+    """
+        Reject a request whose estimated usage does not fit the project budget,
+        prompt_tokens as counted by limit_conversation when known
+    """
+    if quota_manager.limited(project_id):
+        if prompt_tokens is None:
+            prompt_tokens = num_tokens_from_messages(messages, model_name)
+        quota_manager.check(project_id, prompt_tokens, max_tokens or 0)
+
+
+def estimate_usage(messages: list, model_name: str, completion: str = '') -> dict:
+    encoding = get_encoding(model_name)
+    return {
+        'prompt_tokens': num_tokens_from_messages(messages, model_name),
+        'completion_tokens': len(encoding.encode(completion)) if completion else 0,
+    }
+
+
+async def record_usage(project_id: int, usage: Optional[dict], messages: list, model_name: str,
+                       completion: str = '') -> None:
+    """
+        Account actual usage. When the upstream did not report any, it is
+        estimated off the loop, and only for projects with a quota.
+    """
+    if usage is None:
+        if not quota_manager.limited(project_id):
+            return
+        usage = await asyncio.get_running_loop().run_in_executor(
+            None, estimate_usage, messages, model_name, completion
+        )
+    quota_manager.record(project_id, usage['prompt_tokens'], usage['completion_tokens'])
 
 
 def prepare_result(response: dict) -> dict:
@@ -233,6 +571,12 @@ def prepare_result(response: dict) -> dict:
             'content': response_message['content']
         })
 
+    messages.extend(attachment_messages(attachments))
+    return {'messages': messages}
+
+
+def attachment_messages(attachments: list) -> list:
+    messages = []
     for attachment in attachments:
         if 'image' in attachment.get('type', ''):
             messages.append({
@@ -248,57 +592,359 @@ def prepare_result(response: dict) -> dict:
                 'type': 'text',
                 'content': content
             })
-    return {'messages': messages}
+    return messages
 
 
-def predict_chat(
+def _prepare_chat(
+        project_id: int, settings: dict, prompt_struct: dict | list, from_legacy_api: bool,
+        profile: Optional[RequestProfile] = None
+) -> tuple:
+    with stage(profile, 'parse'):
+        settings = IntegrationModel.parse_obj(settings)
+    with stage(profile, 'vault'):
+        init_settings = init_openai(settings, project_id)
+
+    max_output_tokens = settings.get_max_output_tokens(settings.model_name)
+    if max_output_tokens and settings.max_tokens > max_output_tokens:
+        settings.max_tokens = max_output_tokens
+
+    token_limit = settings.token_limit
+    limit_options = limit_kwargs(settings, init_settings)
+    token_counts = {}
+
+    adaptive = None
+    if settings.adaptive_max_tokens:
+        key = prompt_key(settings.model_name, prompt_struct)
+        adaptive = {'key': key, 'max_tokens': settings.max_tokens, 'token_limit': token_limit}
+        settings.max_tokens = reserve_tokens(key, settings.max_tokens, settings.adaptive_percentile)
+
+    with stage(profile, 'limits'):
+        if from_legacy_api:
+            conversation = prepare_conversation_old(
+                prompt_struct, settings.model_name, settings.max_tokens, token_limit,
+                token_counts=token_counts, **limit_options
+            )
+        else:
+            conversation = limit_messages(
+                prompt_struct, settings.model_name, settings.max_tokens, token_limit,
+                token_counts=token_counts, **limit_options
+            )
+    with stage(profile, 'quota'):
+        check_quota(
+            project_id, conversation, settings.model_name, settings.max_tokens,
+            token_counts.get('prompt_tokens')
+        )
+    return settings, init_settings, conversation, adaptive
+
+
+async def _continue_truncated(
+        response: dict, conversation: list, settings: IntegrationModel, adaptive: dict, create: Callable
+) -> dict:
+    """ Continue an answer cut at the reserved max_tokens, merged into one response """
+    loop = asyncio.get_running_loop()
+    choice = response['choices'][0]
+    content = choice['message'].get('content') or ''
+    usage = dict(response.get('usage') or {})
+    completion_tokens = usage.get('completion_tokens') or 0
+    continued = False
+    for _ in range(settings.max_continuations):
+        if choice.get('finish_reason') != 'length':
+            break
+        messages = continuation_messages(conversation, content)
+        prompt_tokens = await loop.run_in_executor(
+            None, num_tokens_from_messages, messages, settings.model_name
+        )
+        max_tokens = min(
+            adaptive['max_tokens'] - completion_tokens,
+            adaptive['token_limit'] - prompt_tokens - 3,
+        )
+        if max_tokens <= 0:
+            break
+        part = (await create(
+            settings.model_name, messages=messages, max_tokens=max_tokens
+        )).model_dump()
+        part_choice = part['choices'][0]
+        content += part_choice['message'].get('content') or ''
+        choice['finish_reason'] = part_choice.get('finish_reason')
+        merge_usage(usage, part.get('usage') or {})
+        completion_tokens = usage.get('completion_tokens') or 0
+        continued = True
+    if continued:
+        choice['message']['content'] = content
+    if usage:
+        response['usage'] = usage
+    if completion_tokens:
+        completion_lengths.record(adaptive['key'], completion_tokens)
+    return response
+
+
+def _run_prepare(profile: Optional[RequestProfile], func: Callable, *args):
+    """ Executor side of request preparation, under cProfile when profiled """
+    if profile is None:
+        return func(*args)
+    return profile.runcall(func, *args, profile)
+
+
+def _finish_profile(profile: Optional[RequestProfile]) -> None:
+    if profile is not None:
+        # artifact is written to disk: off the loop
+        asyncio.get_running_loop().run_in_executor(None, profiler.finish, profile)
+
+
+def _prompt_size(messages: list) -> int:
+    return sum(len(str(message.get('content') or '')) for message in messages)
+
+
+async def apredict_chat(
         project_id: int, settings: dict,
         prompt_struct: dict | list, format_response: bool = True,
-        from_legacy_api: bool = True, **kwargs
+        from_legacy_api: bool = True, priority: str = 'interactive', profile: bool = False,
+        **kwargs
 ) -> dict:
-    settings = IntegrationModel.parse_obj(settings)
-    # openai = init_openai(settings, project_id)
-    init_settings = init_openai(settings, project_id)
+    request_profile = profiler.start('predict', requested=profile)
+    try:
+        return await _apredict_chat(
+            project_id, settings, prompt_struct, format_response, from_legacy_api, priority,
+            request_profile
+        )
+    finally:
+        _finish_profile(request_profile)
 
-    token_limit = settings.token_limit
 
-    if from_legacy_api:
-        conversation = prepare_conversation_old(
-            prompt_struct, settings.model_name, settings.max_tokens, token_limit
-        )
-    else:
-        conversation = limit_messages(
-            prompt_struct, settings.model_name, settings.max_tokens, token_limit
+async def _apredict_chat(
+        project_id: int, settings: dict, prompt_struct: dict | list, format_response: bool,
+        from_legacy_api: bool, priority: str, profile: Optional[RequestProfile]
+) -> dict:
+    loop = asyncio.get_running_loop()
+    # Settings parsing, Vault and tokenization are blocking: keep them off the loop
+    settings, init_settings, conversation, adaptive = await loop.run_in_executor(
+        None, partial(
+            _run_prepare, profile, _prepare_chat, project_id, settings, prompt_struct, from_legacy_api
         )
+    )
+    if profile is not None:
+        if isinstance(prompt_struct, dict):
+            input_messages = len(prompt_struct.get('chat_history') or []) + 1
+        else:
+            input_messages = len(prompt_struct)
+        profile.meta.update({
+            'deployment': settings.model_name,
+            'input_messages': input_messages,
+            'sent_messages': len(conversation),
+            'prompt_chars': _prompt_size(conversation),
+            'max_tokens': settings.max_tokens,
+        })
 
     # addons = prompt_struct.pop('addons', None)
     # if addons:
     #     init_settings['addons'] = addons
+    cost = estimate_cost(conversation, settings.max_tokens)
+
+    cached = None
+    if format_response and settings.semantic_cache and settings.embedding_model_name:
+        cached = cache_scope(project_id, settings.model_name, conversation)
+    if cached is not None:
+        scope, text = cached
+        try:
+            with stage(profile, 'embedding'):
+                embedding = (await call_upstream(
+                    settings, init_settings, lambda client: client.embeddings.create(
+                        model=settings.embedding_model_name, input=[text],
+                    ),
+                    priority=priority, project_id=project_id, cost=len(text) // 4,
+                )).data[0].embedding
+        except Exception as e:  # pylint: disable=W0703
+            # the cache is an optimization: go to the completion without it
+            log.warning(
+                'Semantic cache embedding with %s failed, skipping the cache: %s',
+                settings.embedding_model_name, e,
+            )
+            cached = None
+    if cached is not None:
+        result = semantic_cache.lookup(
+            scope, embedding, settings.semantic_cache_threshold, settings.semantic_cache_ttl
+        )
+        if result is not None:
+            result['cached'] = True
+            return result
+
+    def _create(
+            model: str, exclude: tuple = (), on_endpoint: Optional[Callable] = None,
+            messages: Optional[list] = None, max_tokens: Optional[int] = None
+    ):
+        return call_upstream(
+            settings, init_settings, lambda client: client.chat.completions.create(
+                model=model,
+                temperature=settings.temperature,
+                max_tokens=max_tokens or settings.max_tokens,
+                top_p=settings.top_p,
+                messages=messages or conversation,
+            ),
+            exclude=exclude, on_endpoint=on_endpoint, priority=priority, project_id=project_id, cost=cost
+        )
 
-    response = ChatCompletion.create(
-        deployment_id=settings.model_name,
-        temperature=settings.temperature,
-        max_tokens=settings.max_tokens,
-        top_p=settings.top_p,
-        messages=conversation,
-        **init_settings
+    with stage(profile, 'upstream'):
+        if settings.hedging:
+            primary_endpoints = []
+            primary_routed = asyncio.Event()
+
+            def _routed(api_base):
+                primary_endpoints.append(api_base)
+                primary_routed.set()
+
+            async def _primary():
+                try:
+                    return await _create(settings.model_name, on_endpoint=_routed)
+                finally:
+                    primary_routed.set()
+
+            async def _secondary():
+                # not while the primary still waits in the scheduler queue:
+                # its endpoint is not known yet and would not be excluded
+                await primary_routed.wait()
+                return await _create(
+                    settings.hedge_model_name or settings.model_name, exclude=tuple(primary_endpoints)
+                )
+
+            response = await hedged(
+                settings.model_name, _primary, _secondary,
+                percentile=settings.hedge_percentile,
+                budget_ratio=settings.hedge_budget_ratio,
+                min_delay=settings.hedge_min_delay,
+            )
+        else:
+            response = await _create(settings.model_name)
+    response = response.model_dump()
+    if adaptive is not None and response.get('choices'):
+        with stage(profile, 'continuation'):
+            response = await _continue_truncated(response, conversation, settings, adaptive, _create)
+    usage = extract_usage(response)
+    await record_usage(
+        project_id, usage, conversation, settings.model_name,
+        response['choices'][0]['message'].get('content') or '' if response.get('choices') else ''
     )
     if format_response:
-        return prepare_result(response)
-    return dict(response)
+        result = prepare_result(response)
+        if cached is not None:
+            semantic_cache.store(scope, embedding, result, settings.semantic_cache_ttl)
+        if usage is not None:
+            result['usage'] = usage
+        return result
+    return response
 
 
-def predict_chat_from_request(project_id: int, settings: dict, request_data: dict) -> str:
-    params = ChatCompletionRequestBody.validate(request_data).dict(exclude_unset=True)
-    settings = IntegrationModel.parse_obj(settings)
-    # openai = init_openai(settings, project_id)
-    init_settings = init_openai(settings, project_id)
+def predict_chat(
+        project_id: int, settings: dict,
+        prompt_struct: dict | list, format_response: bool = True,
+        from_legacy_api: bool = True, priority: str = 'interactive', profile: bool = False,
+        **kwargs
+) -> dict:
+    return run_sync(apredict_chat(
+        project_id, settings, prompt_struct,
+        format_response=format_response, from_legacy_api=from_legacy_api, priority=priority,
+        profile=profile, **kwargs
+    ))
+
+
+def _prepare_chat_request(
+        project_id: int, settings: dict, request_data: dict, profile: Optional[RequestProfile] = None
+) -> tuple:
+    with stage(profile, 'parse'):
+        params = ChatCompletionRequestBody.validate(request_data).dict(exclude_unset=True)
+        settings = IntegrationModel.parse_obj(settings)
+    with stage(profile, 'vault'):
+        init_settings = init_openai(settings, project_id)
 
     token_limit = settings.get_token_limit(params['deployment_id'])
+    max_output_tokens = settings.get_max_output_tokens(params['deployment_id'])
+    if max_output_tokens and params.get('max_tokens', 0) > max_output_tokens:
+        params['max_tokens'] = max_output_tokens
     max_tokens = params.get('max_tokens', 0)
-    if params.get('messages'):
-        params['messages'] = limit_messages(
-            params['messages'], params['deployment_id'], max_tokens, token_limit
+    token_counts = {}
+    with stage(profile, 'limits'):
+        if params.get('messages'):
+            params['messages'] = limit_messages(
+                params['messages'], params['deployment_id'], max_tokens, token_limit,
+                token_counts=token_counts, **limit_kwargs(settings, init_settings)
+            )
+    with stage(profile, 'quota'):
+        check_quota(
+            project_id, params.get('messages') or [], params['deployment_id'], max_tokens,
+            token_counts.get('prompt_tokens')
         )
+    return settings, init_settings, params
+
+
+def request_to_create_kwargs(params: dict) -> dict:
+    """ ChatCompletionRequestBody params to openai client create() kwargs """
+    kwargs = dict(params)
+    kwargs['model'] = kwargs.pop('deployment_id')
+    addons = kwargs.pop('addons', None)
+    if addons:
+        kwargs['extra_body'] = {'addons': addons}
+    return kwargs
+
+
+async def apredict_chat_from_request(
+        project_id: int, settings: dict, request_data: dict, priority: str = 'interactive',
+        profile: bool = False
+) -> dict | list:
+    request_profile = profiler.start('chat_completion', requested=profile)
+    try:
+        return await _apredict_chat_from_request(
+            project_id, settings, request_data, priority, request_profile
+        )
+    finally:
+        _finish_profile(request_profile)
+
+
+async def _apredict_chat_from_request(
+        project_id: int, settings: dict, request_data: dict, priority: str,
+        profile: Optional[RequestProfile]
+) -> dict | list:
+    loop = asyncio.get_running_loop()
+    settings, init_settings, params = await loop.run_in_executor(
+        None, partial(_run_prepare, profile, _prepare_chat_request, project_id, settings, request_data)
+    )
+    if profile is not None:
+        profile.meta.update({
+            'deployment': params['deployment_id'],
+            'input_messages': len(request_data.get('messages') or []),
+            'sent_messages': len(params.get('messages') or []),
+            'prompt_chars': _prompt_size(params.get('messages') or []),
+            'max_tokens': params.get('max_tokens'),
+            'stream': bool(params.get('stream')),
+        })
+    create_kwargs = request_to_create_kwargs(params)
+
+    async def _create(client):
+        response = await client.chat.completions.create(**create_kwargs)
+        if create_kwargs.get('stream'):
+            return [chunk.model_dump() async for chunk in response]
+        return response.model_dump()
+
+    with stage(profile, 'upstream'):
+        result = await call_upstream(
+            settings, init_settings, _create, priority=priority, project_id=project_id,
+            cost=estimate_cost(params.get('messages') or [], params.get('max_tokens', 0)),
+        )
+    if isinstance(result, list):
+        usage = next((extract_usage(chunk) for chunk in reversed(result) if chunk.get('usage')), None)
+        completion = ''.join(
+            choice['delta'].get('content') or ''
+            for chunk in result for choice in chunk.get('choices') or [] if choice.get('delta')
+        )
+    else:
+        usage = extract_usage(result)
+        completion = result['choices'][0]['message'].get('content') or '' if result.get('choices') else ''
+    await record_usage(
+        project_id, usage, params.get('messages') or [], params['deployment_id'], completion
+    )
+    return result
+
 
-    return ChatCompletion.create(**params, **init_settings)
+def predict_chat_from_request(
+        project_id: int, settings: dict, request_data: dict, priority: str = 'interactive',
+        profile: bool = False
+) -> dict | list:
+    return run_sync(apredict_chat_from_request(project_id, settings, request_data, priority, profile))